@@ -0,0 +1,217 @@
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404, JsonResponse
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from .authentication import ClaimsJWTAuthentication
+from .cache import CatalogCacheMixin
+from .carts import cart_store
+from .models import Product, ReferralCode, Wallet
+from .search import ProductSearchFilter, search_backend
+from .serializers import (
+    ProductDetailSerializer,
+    REFERRAL_PENDING,
+    ProductSerializer,
+    ReferralCodeSerializer,
+    WalletSerializer,
+)
+from .services import SendReferral
+from .views import ProductDetail, ProductFilter, ProductList
+
+
+def json_response(data, status=status.HTTP_200_OK, **kwargs):
+    return JsonResponse(data, status=status, safe=False, encoder=JSONEncoder, **kwargs)
+
+
+def request_data(request):
+    if request.content_type != "application/json":
+        return request.POST
+    try:
+        return json.loads(request.body or b"{}")
+    except ValueError as e:
+        raise exceptions.ParseError(f"JSON parse error - {e}")
+
+
+async def paginate(request, queryset):
+    """ListPagination's page number pagination (and its ``?count=false``
+    variant) on the async ORM, or of a list. Returns the page's rows and the envelope the
+    serialized rows go in."""
+    page_size = settings.REST_FRAMEWORK["PAGE_SIZE"]
+    try:
+        number = int(request.GET.get("page", 1))
+    except ValueError:
+        number = 0
+    count = None
+    if request.GET.get("count") != "false":
+        count = len(queryset) if isinstance(queryset, list) else await queryset.acount()
+    last = max(1, -(-count // page_size)) if count is not None else None
+    if number < 1 or (last is not None and number > last):
+        raise exceptions.NotFound("Invalid page.")
+
+    offset = (number - 1) * page_size
+    rows = queryset[offset : offset + page_size + 1]
+    if not isinstance(rows, list):
+        rows = [row async for row in rows]
+    url = request.build_absolute_uri()
+    page = {} if count is None else {"count": count}
+    page["next"] = None
+    if len(rows) > page_size:
+        page["next"] = replace_query_param(url, "page", number + 1)
+    page["previous"] = None
+    if number == 2:
+        page["previous"] = remove_query_param(url, "page")
+    elif number > 2:
+        page["previous"] = replace_query_param(url, "page", number - 1)
+    return rows[:page_size], page
+
+
+class AsyncAPIView(View):
+    """Async variant of an API view, served on Django's async request path
+    when the project runs under ASGI.
+
+    Requests are authenticated from the access token like the DRF views and
+    API errors are rendered the way DRF renders them. Methods without an
+    async handler, and requests a handler leaves to it by returning None, are
+    served by ``sync_view`` on a thread.
+    """
+
+    authentication = ClaimsJWTAuthentication()
+    login_required = False
+    sync_view = None
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        # authenticated by token, like the DRF views
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        handler = getattr(self, request.method.lower(), None)
+        if handler is None or request.method == "OPTIONS":
+            return await self.fallback(request, *args, **kwargs)
+        try:
+            request.user = await self.authenticate(request)
+            if self.login_required and not request.user.is_authenticated:
+                raise exceptions.NotAuthenticated()
+            response = await handler(request, *args, **kwargs)
+        except Http404 as e:
+            return self.handle_exception(request, exceptions.NotFound(*e.args))
+        except exceptions.APIException as e:
+            return self.handle_exception(request, e)
+        if response is None:
+            return await self.fallback(request, *args, **kwargs)
+        return response
+
+    async def authenticate(self, request):
+        # users forced by APIClient.force_authenticate, as DRF's Request does
+        forced = getattr(request, "_force_auth_user", None)
+        if forced is not None:
+            return forced
+        auth = await self.authentication.aauthenticate(request)
+        return auth[0] if auth else AnonymousUser()
+
+    async def fallback(self, request, *args, **kwargs):
+        return await sync_to_async(self.sync_view)(request, *args, **kwargs)
+
+    def handle_exception(self, request, exc):
+        headers = {}
+        if isinstance(
+            exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)
+        ):
+            headers["WWW-Authenticate"] = self.authentication.authenticate_header(
+                request
+            )
+        if getattr(exc, "wait", None):
+            headers["Retry-After"] = "%d" % exc.wait
+        data = exc.detail
+        if not isinstance(data, (list, dict)):
+            data = {"detail": data}
+        return json_response(data, status=exc.status_code, headers=headers)
+
+
+class AsyncProductList(CatalogCacheMixin, AsyncAPIView):
+    cache_tags = ProductList.cache_tags
+
+    async def get(self, request):
+        if request.GET.get("pagination") == "cursor" or "cursor" in request.GET:
+            # keyset pagination stays on the sync view
+            return None
+        return await self.acached(request, {}, lambda: self.render(request))
+
+    async def render(self, request):
+        filterset = ProductFilter(
+            request.GET, queryset=ProductList.queryset.all(), request=request
+        )
+        if not filterset.is_valid():
+            raise exceptions.ValidationError(filterset.errors)
+        products = filterset.qs
+        term = request.GET.get(ProductSearchFilter.search_param, "").strip()
+        if term:
+            products = await sync_to_async(search_backend().search)(products, term)
+        rows, page = await paginate(request, products)
+        page["results"] = ProductSerializer(
+            rows, many=True, context={"request": request}
+        ).data
+        return json_response(page)
+
+
+class AsyncProductDetail(CatalogCacheMixin, AsyncAPIView):
+    cache_tags = ProductDetail.cache_tags
+
+    async def get(self, request, pk):
+        return await self.acached(request, {"pk": pk}, lambda: self.render(request, pk))
+
+    async def render(self, request, pk):
+        try:
+            product = await ProductDetail.queryset.aget(pk=pk)
+        except Product.DoesNotExist:
+            raise Http404("No Product matches the given query.")
+        return json_response(
+            ProductDetailSerializer(product, context={"request": request}).data
+        )
+
+
+class AsyncCartList(AsyncAPIView):
+    login_required = True
+
+    async def get(self, request):
+        cart = await cart_store().aget(request.user.pk)
+        rows, page = await paginate(request, [cart] if cart is not None else [])
+        page["results"] = rows
+        return json_response(page)
+
+
+class AsyncWalletDetail(AsyncAPIView):
+    login_required = True
+
+    async def get(self, request):
+        wallet = await Wallet.objects.aget(user=request.user)
+        return json_response(WalletSerializer(wallet).data)
+
+
+class AsyncReferralView(AsyncAPIView):
+    login_required = True
+
+    async def get(self, request):
+        code = await ReferralCode.objects.aget(user=request.user)
+        return json_response(ReferralCodeSerializer(code).data)
+
+    async def post(self, request):
+        serializer = ReferralCodeSerializer(
+            data=request_data(request), context={"request": request}
+        )
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status=400)
+        to_email = serializer.validated_data["to_email"]
+        code = await ReferralCode.objects.aget(user=request.user)
+        queued = await SendReferral(
+            mail_id=to_email, referral_code=code.code
+        ).asend_referral_mail()
+        if not queued:
+            return json_response({"to_email": [REFERRAL_PENDING]}, status=400)
+        return json_response({"msg": f"Referral code sent to {to_email}"}, status=202)
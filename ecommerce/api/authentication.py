@@ -0,0 +1,134 @@
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from .blacklist import RevocableRefreshToken
+from .cache import LocalLRUCache
+from .models import ClaimsUser, CustomUser
+
+# claims copied from the user into its tokens, enough for the permission checks
+USER_CLAIMS = ["is_staff", "is_superuser"]
+
+
+def tokens_for(user):
+    refresh = RevocableRefreshToken.for_user(user)
+    for claim in USER_CLAIMS:
+        refresh[claim] = getattr(user, claim)
+    return refresh
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def user_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LocalLRUCache(**settings.AUTH_USER_CACHE)
+        return _cache
+
+
+@receiver(setting_changed)
+def reset_user_cache(setting, **kwargs):
+    global _cache
+    if setting == "AUTH_USER_CACHE":
+        with _cache_lock:
+            _cache = None
+
+
+def user_values(user_id):
+    """Field values of a user, from the user cache when they are there.
+
+    Entries are keyed on a version of the user kept in the default cache,
+    which every process reads, so a save in one process reaches the others
+    on their next read rather than once their entries expire.
+    """
+    version = cache.get(f"user-version:{user_id}", 0)
+    key = f"user:{user_id}:{version}"
+    values = user_cache().get(key)
+    if values is None:
+        names = [field.attname for field in CustomUser._meta.concrete_fields]
+        values = CustomUser.objects.filter(pk=user_id).values(*names).first()
+        if values is None:
+            return None
+        user_cache().set(key, values, 1)
+    return dict(values)
+
+
+def bump_user_version(user_id):
+    # versions must outlive the entries they guard
+    cache.set(f"user-version:{user_id}", time.time(), None)
+
+
+def forget_user(user_id):
+    """Drop the cached user in every process, now and again once the current
+    transaction commits, since a read in between caches what is about to
+    change."""
+    bump_user_version(user_id)
+    transaction.on_commit(lambda: bump_user_version(user_id))
+
+
+def build_user(model, values):
+    names = [
+        field.attname
+        for field in model._meta.concrete_fields
+        if field.attname in values
+    ]
+    return model.from_db(None, names, [values[name] for name in names])
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that does not read the user on every request.
+
+    Tokens carrying USER_CLAIMS authenticate a ClaimsUser built from them,
+    which is enough to filter by user and check staff permissions; the rest
+    of the user is loaded only when a view reads it. Older tokens load the
+    whole user through the user cache. A change to the claims, or the
+    deactivation of the user, reaches requests when the access token is next
+    refreshed: RefreshSerializer reloads them.
+    """
+
+    async def aauthenticate(self, request):
+        """authenticate() for the async views; only tokens without claims
+        read the database, on a thread."""
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        if all(claim in validated_token for claim in USER_CLAIMS):
+            return self.get_user(validated_token), validated_token
+        return await sync_to_async(self.get_user)(validated_token), validated_token
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        if all(claim in validated_token for claim in USER_CLAIMS):
+            claims = {claim: validated_token[claim] for claim in USER_CLAIMS}
+            # tokens are only issued and refreshed for active users
+            return build_user(
+                ClaimsUser,
+                {api_settings.USER_ID_FIELD: user_id, "is_active": True, **claims},
+            )
+
+        values = user_values(user_id)
+        if values is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if not values["is_active"]:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return build_user(CustomUser, values)
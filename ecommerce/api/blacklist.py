@@ -0,0 +1,201 @@
+import hashlib
+import math
+import threading
+import time
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import serializers
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import (
+    TokenRefreshSerializer,
+    TokenVerifySerializer,
+)
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+from rest_framework_simplejwt.tokens import RefreshToken, UntypedToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:], "big") | 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+
+class RevokedTokens:
+    """Bloom filter of the JTIs in the token blacklist.
+
+    A JTI the filter does not hold was never blacklisted, so the blacklist
+    query is only made for the few tokens that pass the filter. Tokens
+    revoked by this process are added at once; those revoked by other
+    processes are read every ``sync_interval`` seconds, and revoking is
+    checked against the database anyway, so a token can never be rotated or
+    logged out twice. The filter is rebuilt at twice the size when it
+    outgrows ``capacity``.
+    """
+
+    def __init__(self, capacity=100_000, error_rate=0.001, sync_interval=5):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.filter = None
+        self.last_id = 0
+        self.synced_at = 0
+        self._lock = threading.Lock()
+
+    def warm(self):
+        """Load every unexpired blacklisted JTI."""
+        blacklisted = BlacklistedToken.objects.filter(
+            token__expires_at__gt=timezone.now()
+        )
+        count = blacklisted.count()
+        with self._lock:
+            capacity = self.capacity
+            while capacity < count:
+                capacity *= 2
+            self.filter = BloomFilter(capacity, self.error_rate)
+            self.last_id = 0
+            self._load(blacklisted)
+
+    def sync(self):
+        if self.filter is None or self.filter.count > self.filter.capacity:
+            return self.warm()
+        with self._lock:
+            self._load(BlacklistedToken.objects.filter(pk__gt=self.last_id))
+
+    def _load(self, blacklisted):
+        for pk, jti in (
+            blacklisted.order_by("pk")
+            .values_list("pk", "token__jti")
+            .iterator(chunk_size=5000)
+        ):
+            self.filter.add(jti)
+            self.last_id = max(self.last_id, pk)
+        self.synced_at = time.monotonic()
+
+    def add(self, jti):
+        with self._lock:
+            if self.filter is not None:
+                self.filter.add(jti)
+
+    def __contains__(self, jti):
+        if (
+            self.filter is None
+            or time.monotonic() - self.synced_at > self.sync_interval
+        ):
+            self.sync()
+        if jti not in self.filter:
+            return False
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+_revoked = None
+
+
+def revoked_tokens():
+    global _revoked
+    if _revoked is None:
+        _revoked = RevokedTokens(**settings.TOKEN_BLACKLIST)
+    return _revoked
+
+
+@receiver(setting_changed)
+def reset_revoked_tokens(setting, **kwargs):
+    global _revoked
+    if setting == "TOKEN_BLACKLIST":
+        _revoked = None
+
+
+class RevocableRefreshToken(RefreshToken):
+    """RefreshToken checking the blacklist through ``revoked_tokens()``."""
+
+    def check_blacklist(self):
+        if self.payload[api_settings.JTI_CLAIM] in revoked_tokens():
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        """Blacklist the token, failing if it already was: the check before
+        may have relied on a filter not yet synced with other processes."""
+        jti = self.payload[api_settings.JTI_CLAIM]
+        with transaction.atomic():
+            token, _created = OutstandingToken.objects.get_or_create(
+                jti=jti,
+                defaults={
+                    "token": str(self),
+                    "expires_at": datetime_from_epoch(self.payload["exp"]),
+                },
+            )
+            blacklisted, created = BlacklistedToken.objects.get_or_create(token=token)
+        if not created:
+            raise TokenError(_("Token is blacklisted"))
+        revoked_tokens().add(jti)
+        return blacklisted
+
+
+class RefreshSerializer(TokenRefreshSerializer):
+    """TokenRefreshSerializer that reloads the user's claims, so that the
+    rotated tokens do not carry on the flags of the old one, and refuses
+    users who were deactivated."""
+
+    token_class = RevocableRefreshToken
+
+    def validate(self, attrs):
+        # api.authentication imports this module
+        from .authentication import USER_CLAIMS, user_values
+
+        refresh = self.token_class(attrs["refresh"])
+        values = user_values(refresh[api_settings.USER_ID_CLAIM])
+        if values is None or not values["is_active"]:
+            raise AuthenticationFailed(
+                _("No active account found for the given credentials"),
+                code="no_active_account",
+            )
+        for claim in USER_CLAIMS:
+            refresh[claim] = values[claim]
+
+        data = {"access": str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data["refresh"] = str(refresh)
+        return data
+
+
+class VerifySerializer(TokenVerifySerializer):
+    def validate(self, attrs):
+        token = UntypedToken(attrs["token"])
+        if token.get(api_settings.JTI_CLAIM) in revoked_tokens():
+            raise serializers.ValidationError("Token is blacklisted")
+        return {}
@@ -0,0 +1,281 @@
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.http import HttpResponseNotModified, JsonResponse
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class LocalLRUCache:
+    """In-process cache, evicting the least recently used entries once it holds
+    more than ``max_entries`` entries or ``max_bytes`` of serialized data."""
+
+    def __init__(self, timeout=60, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires, size, entry = item
+            if expires < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, size):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (time.monotonic() + self.timeout, size, entry)
+            self._size += size
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def versions(self, tags):
+        with self._lock:
+            return {tag: self._versions.get(tag, 0) for tag in tags}
+
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aset(self, key, entry, size):
+        self.set(key, entry, size)
+
+    async def aversions(self, tags):
+        return self.versions(tags)
+
+    def bump(self, tags, version):
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._size = 0
+
+    def _remove(self, key):
+        self._size -= self._entries.pop(key)[1]
+
+
+class DjangoCacheBackend:
+    """Shared cache stored in one of the ``CACHES`` configured for Django."""
+
+    def __init__(self, timeout=60, alias="default"):
+        self.timeout = timeout
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(f"catalog:{key}")
+
+    def set(self, key, entry, size):
+        self.cache.set(f"catalog:{key}", entry, self.timeout)
+
+    def delete(self, key):
+        self.cache.delete(f"catalog:{key}")
+
+    def versions(self, tags):
+        stored = self.cache.get_many([f"catalog-tag:{tag}" for tag in tags])
+        return {tag: stored.get(f"catalog-tag:{tag}", 0) for tag in tags}
+
+    async def aget(self, key):
+        return await self.cache.aget(f"catalog:{key}")
+
+    async def aset(self, key, entry, size):
+        await self.cache.aset(f"catalog:{key}", entry, self.timeout)
+
+    async def aversions(self, tags):
+        stored = await self.cache.aget_many([f"catalog-tag:{tag}" for tag in tags])
+        return {tag: stored.get(f"catalog-tag:{tag}", 0) for tag in tags}
+
+    def bump(self, tags, version):
+        # tag versions must outlive the entries they guard
+        self.cache.set_many({f"catalog-tag:{tag}": version for tag in tags}, None)
+
+    def clear(self):
+        self.cache.clear()
+
+
+_backend = None
+
+
+def catalog_cache():
+    global _backend
+    config = getattr(settings, "CATALOG_CACHE", None)
+    if not config:
+        return None
+    if _backend is None:
+        _backend = import_string(config["BACKEND"])(**config.get("OPTIONS", {}))
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_catalog_cache(setting, **kwargs):
+    global _backend
+    if setting == "CATALOG_CACHE":
+        _backend = None
+
+
+def invalidate(*tags):
+    backend = catalog_cache()
+    if backend is not None:
+        backend.bump(tags, time.time())
+
+
+def invalidate_on_commit(*tags):
+    """Bump the tags now and again once the current transaction commits,
+    since a read in between caches what is about to change."""
+    invalidate(*tags)
+    transaction.on_commit(lambda: invalidate(*tags))
+
+
+class CatalogCacheMixin:
+    """Read-through cache of the serialized response of a catalog GET view.
+
+    Entries are keyed on host, path and query string together with the current
+    versions of ``cache_tags``; bumping a tag (see ``invalidate``) retires every
+    entry built under the previous version. Responses carry an ETag and a
+    Last-Modified taken from the ``modified_at`` of the products they contain,
+    and conditional requests are answered with 304. Responses that fill the
+    cache are rendered from the primary: a lagging replica would otherwise
+    cache rows from before the write that bumped the version.
+    """
+
+    cache_tags = []
+
+    def get(self, request, *args, **kwargs):
+        # api.replicas imports this module through api.authentication
+        from .replicas import primary_reads
+
+        backend = catalog_cache()
+        if backend is None:
+            return super().get(request, *args, **kwargs)
+
+        versions = backend.versions([tag.format(**kwargs) for tag in self.cache_tags])
+        key = self.cache_key(request, versions)
+        entry = backend.get(key)
+        if entry is None:
+            with primary_reads():
+                response = super().get(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            entry, size = self.cache_entry(response.data, versions)
+            backend.set(key, entry, size)
+
+        headers = self.cache_headers(entry)
+        if self.not_modified(request, entry):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(entry["data"], headers=headers)
+
+    async def acached(self, request, kwargs, render):
+        """get() for the async views: ``render`` is a coroutine function
+        returning the response, cached when its status is 200."""
+        from .replicas import primary_reads
+
+        backend = catalog_cache()
+        if backend is None:
+            return await render()
+
+        versions = await backend.aversions(
+            [tag.format(**kwargs) for tag in self.cache_tags]
+        )
+        key = self.cache_key(request, versions)
+        entry = await backend.aget(key)
+        if entry is None:
+            with primary_reads():
+                response = await render()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            entry, size = self.cache_entry(json.loads(response.content), versions)
+            await backend.aset(key, entry, size)
+
+        headers = self.cache_headers(entry)
+        if self.not_modified(request, entry):
+            return HttpResponseNotModified(headers=headers)
+        return JsonResponse(entry["data"], safe=False, headers=headers)
+
+    def cache_key(self, request, versions):
+        return hashlib.md5(
+            json.dumps(
+                [
+                    request.get_host(),
+                    request.path,
+                    sorted(request.GET.lists()),
+                    sorted(versions.items()),
+                ]
+            ).encode()
+        ).hexdigest()
+
+    def cache_entry(self, data, versions):
+        body = json.dumps(data, cls=JSONEncoder).encode()
+        entry = {
+            "data": json.loads(body),
+            "etag": quote_etag(hashlib.md5(body).hexdigest()),
+            "last_modified": math.ceil(max(self.modified_at(data), *versions.values())),
+        }
+        return entry, len(body)
+
+    def cache_headers(self, entry):
+        headers = {"ETag": entry["etag"]}
+        if entry["last_modified"]:
+            headers["Last-Modified"] = http_date(entry["last_modified"])
+        return headers
+
+    def not_modified(self, request, entry):
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match is not None:
+            etags = [etag.strip() for etag in if_none_match.split(",")]
+            return entry["etag"] in etags or "*" in etags
+        since = parse_http_date_safe(request.headers.get("If-Modified-Since", ""))
+        return (
+            since is not None
+            and bool(entry["last_modified"])
+            and entry["last_modified"] <= since
+        )
+
+    def modified_at(self, data):
+        if isinstance(data, dict) and "results" in data:
+            data = data["results"]
+        if isinstance(data, dict):
+            data = data.get("products", [data])
+        stamps = [
+            item["modified_at"]
+            for item in data
+            if isinstance(item, dict) and item.get("modified_at")
+        ]
+        if not stamps:
+            return 0
+        return max(parse_datetime(stamp).timestamp() for stamp in stamps)
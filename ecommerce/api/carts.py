@@ -0,0 +1,236 @@
+import secrets
+import time
+from decimal import Decimal
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Prefetch
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.fields import DateTimeField
+from .models import Cart, CartItem, Product
+
+
+class CartError(Exception):
+    pass
+
+
+ITEM_FIELDS = ["id", "product", "product_name", "product_price", "quantity", "added_at"]
+
+
+class CartStore:
+    """Hot copies of carts in the Django cache ``alias``, so that reading a
+    cart costs no queries.
+
+    A cart is kept as its id and one row per item with the product id, the
+    quantity and a snapshot of the product's name and price, rendered as
+    CartSerializer renders it. A user's cart is read through from the
+    primary and is valid while its version, moved by ``changed`` once a
+    write commits, is the one it was read under, and while the snapshot
+    matches what ``reprice`` recorded for each product. Guest carts only
+    live in the cache, under a random token, until they are merged at login.
+    """
+
+    def __init__(self, alias="default", timeout=900, guest_timeout=7 * 24 * 3600):
+        self.alias = alias
+        self.timeout = timeout
+        self.guest_timeout = guest_timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def user_key(self, user_id):
+        return f"cart:user:{user_id}"
+
+    def guest_key(self, token):
+        return f"cart:guest:{token}"
+
+    def version_key(self, user_id):
+        return f"cart-version:{user_id}"
+
+    def product_key(self, product_id):
+        return f"cart-product:{product_id}"
+
+    def get(self, user_id):
+        """The user's cart, or None if they have none."""
+        entry = self.cache.get(self.user_key(user_id))
+        if entry is None or not self.fresh(
+            entry, self.cache.get_many(self.tags(entry))
+        ):
+            entry = self.load(user_id)
+        return self.render(entry)
+
+    async def aget(self, user_id):
+        entry = await self.cache.aget(self.user_key(user_id))
+        if entry is None or not self.fresh(
+            entry, await self.cache.aget_many(self.tags(entry))
+        ):
+            entry = await sync_to_async(self.load)(user_id)
+        return self.render(entry)
+
+    def load(self, user_id):
+        # the version is read first: a write committing meanwhile moves it
+        # past the one stored, so the entry cannot outlive what it missed
+        version = self.cache.get(self.version_key(user_id), 0)
+        # from the primary, which a replica may lag behind
+        cart = (
+            Cart.objects.using(DEFAULT_DB_ALIAS)
+            .filter(user_id=user_id)
+            .prefetch_related(
+                Prefetch(
+                    "items",
+                    queryset=CartItem.objects.using(DEFAULT_DB_ALIAS).select_related(
+                        "product"
+                    ),
+                )
+            )
+            .first()
+        )
+        entry = {"id": None, "user": user_id, "version": version, "items": []}
+        if cart is not None:
+            entry["id"] = cart.pk
+            entry["created_at"] = DateTimeField().to_representation(cart.created_at)
+            entry["items"] = [
+                [
+                    item.pk,
+                    item.product_id,
+                    item.product.name,
+                    str(item.product.price),
+                    item.quantity,
+                    DateTimeField().to_representation(item.added_at),
+                ]
+                for item in cart.items.all()
+            ]
+        self.cache.set(self.user_key(user_id), entry, self.timeout)
+        return entry
+
+    def tags(self, entry):
+        tags = [self.product_key(row[1]) for row in entry["items"]]
+        if entry["user"] is not None:
+            tags.append(self.version_key(entry["user"]))
+        return tags
+
+    def fresh(self, entry, tags):
+        if entry["user"] is not None:
+            if tags.get(self.version_key(entry["user"]), 0) != entry["version"]:
+                return False
+        return all(
+            tags.get(self.product_key(row[1]), row[2:4]) == row[2:4]
+            for row in entry["items"]
+        )
+
+    def render(self, entry):
+        if entry["user"] is not None and entry["id"] is None:
+            return None
+        return {
+            "id": entry["id"],
+            "user": entry["user"],
+            "created_at": entry.get("created_at"),
+            "items": [dict(zip(ITEM_FIELDS, row)) for row in entry["items"]],
+            "total_value": sum(
+                (Decimal(row[3]) * row[4] for row in entry["items"]), Decimal(0)
+            ),
+        }
+
+    def changed(self, user_id):
+        """Retire the user's cached cart, now and again once the current
+        transaction commits, since a read in between caches what is about
+        to change."""
+
+        def bump():
+            self.cache.set(self.version_key(user_id), time.time(), None)
+
+        bump()
+        transaction.on_commit(bump)
+
+    def reprice(self, products=(), deleted=()):
+        """Record the name and price of changed products, and the deletion of
+        others. Carts holding another snapshot of them are rebuilt, until
+        the database agrees with the record."""
+        tags = {self.product_key(p.pk): [p.name, str(p.price)] for p in products}
+        tags.update({self.product_key(pk): None for pk in deleted})
+        if tags:
+            # like the catalog tags, these must outlive the entries they guard
+            self.cache.set_many(tags, None)
+
+    def guest(self, token):
+        """The guest cart under ``token``, with its snapshots brought up to
+        date without a query."""
+        entry = self.cache.get(self.guest_key(token)) if token else None
+        if entry is None:
+            return {"id": None, "user": None, "token": token, "items": []}
+        tags = self.cache.get_many(self.tags(entry))
+        if not self.fresh(entry, tags):
+            items = []
+            for row in entry["items"]:
+                snapshot = tags.get(self.product_key(row[1]), row[2:4])
+                if snapshot is not None:
+                    items.append([row[0], row[1], *snapshot, *row[4:]])
+            entry["items"] = items
+        return entry
+
+    def change_guest(self, token, changes):
+        """Apply ShoppingCart-style ``changes`` to a guest cart, creating one
+        under a new token if ``token`` is None. Guest carts hold no stock.
+        Returns the cart; raises CartError."""
+        entry = self.guest(token or secrets.token_urlsafe(24))
+        rows = {row[1]: row for row in entry["items"]}
+        products = Product.objects.in_bulk(list(changes))
+        now = DateTimeField().to_representation(timezone.now())
+        for product_id, (operation, quantity) in changes.items():
+            product = products.get(product_id)
+            if product is None:
+                raise CartError(f"Product {product_id} does not exist")
+            current = rows[product_id][4] if product_id in rows else 0
+            quantity = current + quantity if operation == "add" else quantity
+            if quantity > current and not product.is_available:
+                raise CartError(f"{product.name} is out of stock")
+            if not quantity:
+                rows.pop(product_id, None)
+                continue
+            added_at = rows[product_id][5] if product_id in rows else now
+            rows[product_id] = [
+                None,
+                product_id,
+                product.name,
+                str(product.price),
+                quantity,
+                added_at,
+            ]
+        entry["items"] = sorted(rows.values(), key=lambda row: row[5], reverse=True)
+        self.cache.set(self.guest_key(entry["token"]), entry, self.guest_timeout)
+        return entry
+
+    def take_guest(self, token):
+        """Remove the guest cart under ``token`` and return its
+        ``{product_id: quantity}``."""
+        entry = self.cache.get(self.guest_key(token)) if token else None
+        if entry is None:
+            return {}
+        self.cache.delete(self.guest_key(token))
+        return {row[1]: row[4] for row in entry["items"]}
+
+    def render_guest(self, entry):
+        cart = self.render(entry)
+        cart["token"] = entry["token"]
+        return cart
+
+
+_store = None
+
+
+def cart_store():
+    global _store
+    if _store is None:
+        _store = CartStore(**settings.CART_CACHE)
+    return _store
+
+
+@receiver(setting_changed)
+def reset_cart_store(setting, **kwargs):
+    global _store
+    if setting == "CART_CACHE":
+        _store = None
@@ -0,0 +1,222 @@
+import csv
+import io
+import json
+import re
+from collections import defaultdict
+from itertools import islice
+from django.db import transaction
+from django.db.models import F
+from rest_framework.settings import api_settings
+from .cache import invalidate
+from .carts import cart_store
+from .facets import FacetCounter
+from .images import image_pipeline
+from .models import Category, Product, ProductRating
+from .search import search_backend
+from .serializers import ProductImportSerializer
+
+FIELDS = ["sku", "name", "price", "description", "image", "quantity", "category"]
+# columns a file may leave out, which existing products then keep
+OPTIONAL_FIELDS = ["image", "quantity", "category"]
+# bytes that were not UTF-8, as decoded with errors="surrogateescape"
+UNDECODED = re.compile("[\udc80-\udcff]")
+
+
+def read_rows(stream, format):
+    """Yield one dict per CSV row or JSON line of a binary UTF-8 stream,
+    without reading the stream into memory. Rows that cannot be read are
+    yielded as ``UnreadableRow`` in their place."""
+    stream = io.TextIOWrapper(
+        stream, encoding="utf-8", errors="surrogateescape", newline=""
+    )
+    if format == "csv":
+        reader = csv.DictReader(stream)
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                yield UnreadableRow(f"Invalid CSV: {e}")
+                continue
+            if None in row:
+                # DictReader keeps the fields past the header under None
+                yield UnreadableRow("Row has more fields than the header")
+            elif any(
+                isinstance(value, str) and UNDECODED.search(value)
+                for value in row.values()
+            ):
+                yield UnreadableRow("Not valid UTF-8")
+            else:
+                yield row
+    elif format == "jsonl":
+        for line in stream:
+            if not line.strip():
+                continue
+            if UNDECODED.search(line):
+                yield UnreadableRow("Not valid UTF-8")
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield UnreadableRow(f"Invalid JSON: {e}")
+    else:
+        raise ValueError(f"Unsupported format {format!r}")
+
+
+class UnreadableRow:
+    """A row of an import file that could not be parsed."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+class ProductImporter:
+    """Upsert products on ``sku`` in chunks of ``chunk_size`` rows.
+
+    Each row is validated by ``ProductImportSerializer``; invalid and
+    unreadable rows are reported in ``errors`` by their 1-based row number
+    and skipped. Columns in ``OPTIONAL_FIELDS`` that a row leaves out are
+    not changed on an existing product. Category
+    names are resolved through an in-memory map, missing categories are
+    created in bulk, and every chunk is written with a single upsert. Signals
+    are bypassed, so ratings, the search index, facet counts and the catalog
+    cache are brought up to date here.
+    """
+
+    def __init__(self, chunk_size=1000):
+        self.chunk_size = chunk_size
+        self.categories = dict(Category.objects.values_list("name", "pk"))
+        self.imported = 0
+        self.errors = []
+
+    def run(self, rows):
+        rows = enumerate(rows, 1)
+        while chunk := list(islice(rows, self.chunk_size)):
+            self.import_chunk(chunk)
+        FacetCounter.rebuild()
+        invalidate("products", "categories")
+        return self
+
+    def import_chunk(self, chunk):
+        valid = {}
+        for number, row in chunk:
+            if isinstance(row, UnreadableRow):
+                self.errors.append(
+                    {
+                        "row": number,
+                        "errors": {api_settings.NON_FIELD_ERRORS_KEY: [row.error]},
+                    }
+                )
+                continue
+            serializer = ProductImportSerializer(data=row)
+            if serializer.is_valid():
+                # a repeated sku within one chunk keeps its last row
+                valid[serializer.validated_data["sku"]] = serializer.validated_data
+            else:
+                self.errors.append({"row": number, "errors": serializer.errors})
+        if not valid:
+            return
+
+        self.create_categories(
+            {data["category"] for data in valid.values() if data.get("category")}
+        )
+        # one upsert for each set of columns the rows have
+        groups = defaultdict(list)
+        for sku, data in valid.items():
+            present = tuple(field for field in OPTIONAL_FIELDS if field in data)
+            groups[present].append(
+                Product(
+                    sku=sku,
+                    name=data["name"],
+                    price=data["price"],
+                    description=data["description"],
+                    image=data.get("image", ""),
+                    quantity=data.get("quantity", 1),
+                    is_available=data.get("quantity", 1) > 0,
+                    category_id=self.categories.get(data.get("category")),
+                )
+            )
+        with transaction.atomic():
+            for present, products in groups.items():
+                Product.objects.bulk_create(
+                    products,
+                    update_conflicts=True,
+                    unique_fields=["sku"],
+                    update_fields=self.update_fields(present),
+                )
+            imported = list(
+                Product.objects.filter(sku__in=valid).only(
+                    "pk", "name", "price", "image", "image_variants", "category_id"
+                )
+            )
+            product_ids = [product.pk for product in imported]
+            ProductRating.objects.bulk_create(
+                [ProductRating(product_id=pk) for pk in product_ids],
+                ignore_conflicts=True,
+            )
+            search_backend().index(product_ids)
+            cart_store().reprice(imported)
+            image_pipeline().refresh(imported)
+        invalidate(
+            *(f"product:{pk}" for pk in product_ids),
+            *(f"category:{product.category_id}" for product in imported),
+        )
+        self.imported += len(valid)
+
+    def update_fields(self, present):
+        fields = ["name", "price", "description", *present, "modified_at"]
+        if "quantity" in present:
+            fields.append("is_available")
+        return fields
+
+    def create_categories(self, names):
+        missing = names - set(self.categories)
+        if missing:
+            Category.objects.bulk_create(Category(name=name) for name in missing)
+            self.categories.update(
+                Category.objects.filter(name__in=missing).values_list("name", "pk")
+            )
+
+
+class ProductExporter:
+    """Stream products in the import format, reading them with a server-side
+    cursor ``chunk_size`` rows at a time."""
+
+    def __init__(self, queryset=None, chunk_size=2000):
+        if queryset is None:
+            queryset = Product.objects.all()
+        self.queryset = queryset
+        self.chunk_size = chunk_size
+
+    def rows(self):
+        for row in (
+            self.queryset.order_by("pk")
+            .values(*FIELDS[:-1], category_name=F("category__name"))
+            .iterator(chunk_size=self.chunk_size)
+        ):
+            row["category"] = row.pop("category_name") or ""
+            row["price"] = str(row["price"])
+            yield row
+
+    def as_csv(self):
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=FIELDS)
+        writer.writeheader()
+        for row in self.rows():
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    def as_jsonl(self):
+        for row in self.rows():
+            yield json.dumps(row) + "\n"
+
+    def stream(self, format):
+        if format == "csv":
+            return self.as_csv()
+        if format == "jsonl":
+            return self.as_jsonl()
+        raise ValueError(f"Unsupported format {format!r}")
@@ -0,0 +1,201 @@
+import random
+from contextlib import contextmanager
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from .models import FacetCount, Product, ProductRating
+
+PRICE_BUCKETS = [
+    ("0-25", Decimal(0), Decimal(25)),
+    ("25-50", Decimal(25), Decimal(50)),
+    ("50-100", Decimal(50), Decimal(100)),
+    ("100-250", Decimal(100), Decimal(250)),
+    ("250+", Decimal(250), None),
+]
+RATING_BANDS = [("4-5", 4), ("3-4", 3), ("2-3", 2), ("1-2", 1)]
+# rows each count is split over, so that concurrent writers seldom wait on
+# the same row lock
+COUNT_SLOTS = 16
+
+
+def price_bucket(price):
+    for label, low, high in PRICE_BUCKETS:
+        if price >= low and (high is None or price < high):
+            return label
+
+
+def rating_band(average, count):
+    if not count:
+        return "unrated"
+    for label, low in RATING_BANDS:
+        if average >= low:
+            return label
+    return RATING_BANDS[-1][0]
+
+
+def product_facets(category_id, price, is_available, average=0, count=0):
+    return {
+        "category": str(category_id) if category_id else "none",
+        "price": price_bucket(Decimal(price)),
+        "availability": "in_stock" if is_available else "out_of_stock",
+        "rating": rating_band(average, count),
+    }
+
+
+def facet_conditions():
+    conditions = {
+        ("availability", "in_stock"): Q(is_available=True),
+        ("availability", "out_of_stock"): Q(is_available=False),
+        ("rating", "unrated"): Q(rating__isnull=True) | Q(rating__count=0),
+    }
+    for label, low, high in PRICE_BUCKETS:
+        condition = Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        conditions[("price", label)] = condition
+    upper = None
+    for label, low in RATING_BANDS:
+        condition = Q(rating__count__gt=0)
+        if label != RATING_BANDS[-1][0]:
+            condition &= Q(rating__average__gte=low)
+        if upper is not None:
+            condition &= Q(rating__average__lt=upper)
+        conditions[("rating", label)] = condition
+        upper = low
+    return conditions
+
+
+def count_facets(queryset):
+    """Facet counts of ``queryset`` in two queries: one conditional aggregate
+    for the fixed buckets and one GROUP BY for categories."""
+    queryset = queryset.order_by()
+    conditions = facet_conditions()
+    totals = queryset.aggregate(
+        **{
+            f"facet_{i}": Count("pk", filter=condition)
+            for i, condition in enumerate(conditions.values())
+        }
+    )
+    counts = {}
+    for i, key in enumerate(conditions):
+        counts[key] = totals[f"facet_{i}"]
+    for category_id, count in queryset.values_list("category_id").annotate(
+        count=Count("pk")
+    ):
+        counts[("category", str(category_id) if category_id else "none")] = count
+    return counts
+
+
+def as_response(counts):
+    facets = {"category": {}, "price": {}, "availability": {}, "rating": {}}
+    for key in facet_conditions():
+        facets[key[0]][key[1]] = 0
+    for (facet, value), count in counts.items():
+        if count or facet != "category":
+            facets[facet][value] = count
+    return facets
+
+
+class FacetCounter:
+    """Catalog facet counts kept current by the writes that change them.
+
+    Each count is the sum of up to ``COUNT_SLOTS`` rows. A write shifts one
+    slot picked at random, so concurrent transactions rarely update the same
+    row and do not queue behind each other's row lock until they commit.
+    """
+
+    @staticmethod
+    def counts(queryset=None):
+        """Facet counts of ``queryset``, or of the whole catalog from the
+        precomputed table when it is None."""
+        if queryset is not None:
+            return as_response(count_facets(queryset))
+        return as_response(
+            {
+                (facet, value): count
+                for facet, value, count in FacetCount.objects.values("facet", "value")
+                .annotate(total=Sum("count"))
+                .values_list("facet", "value", "total")
+            }
+        )
+
+    @staticmethod
+    def shift(deltas):
+        slot = random.randrange(COUNT_SLOTS)
+        # in a fixed order, so that writers shifting the same counts cannot
+        # deadlock
+        for (facet, value), delta in sorted(deltas.items()):
+            if not delta:
+                continue
+            counter = FacetCount.objects.filter(facet=facet, value=value, slot=slot)
+            updated = counter.update(count=F("count") + delta)
+            if not updated:
+                try:
+                    with transaction.atomic():
+                        FacetCount.objects.create(
+                            facet=facet, value=value, slot=slot, count=delta
+                        )
+                except IntegrityError:
+                    counter.update(count=F("count") + delta)
+
+    @staticmethod
+    def move(old, new):
+        deltas = {}
+        for facets, delta in ((old, -1), (new, 1)):
+            for key in (facets or {}).items():
+                deltas[key] = deltas.get(key, 0) + delta
+        FacetCounter.shift(deltas)
+
+    @staticmethod
+    def product_state(product_ids):
+        return {
+            row["pk"]: product_facets(
+                row["category_id"],
+                row["price"],
+                row["is_available"],
+                row["rating__average"],
+                row["rating__count"],
+            )
+            for row in Product.objects.filter(pk__in=product_ids).values(
+                "pk",
+                "category_id",
+                "price",
+                "is_available",
+                "rating__average",
+                "rating__count",
+            )
+        }
+
+    @staticmethod
+    @contextmanager
+    def tracking_ratings(product_ids):
+        """Move the rating band of ``product_ids`` if the block changes it.
+        Yields the category ids of the products."""
+        before = FacetCounter.rating_bands(product_ids)
+        yield {product_id: category for product_id, (_, category) in before.items()}
+        after = FacetCounter.rating_bands(product_ids)
+        for product_id, (band, _) in after.items():
+            old = before.get(product_id, (band, None))[0]
+            if old != band:
+                FacetCounter.move({"rating": old}, {"rating": band})
+
+    @staticmethod
+    def rating_bands(product_ids):
+        """The rating band and category id of each product."""
+        return {
+            product_id: (rating_band(average, count), category_id)
+            for product_id, average, count, category_id in ProductRating.objects.filter(
+                product_id__in=product_ids
+            ).values_list("product_id", "average", "count", "product__category_id")
+        }
+
+    @staticmethod
+    def rebuild():
+        counts = count_facets(Product.objects.all())
+        with transaction.atomic():
+            FacetCount.objects.all().delete()
+            FacetCount.objects.bulk_create(
+                FacetCount(facet=facet, value=value, count=count)
+                for (facet, value), count in counts.items()
+            )
+        return len(counts)
@@ -0,0 +1,224 @@
+import hashlib
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.signals import setting_changed
+from django.db import connections, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from .cache import invalidate
+from .models import Product
+
+# Pillow format and encoder options of each variant format
+FORMATS = {
+    "webp": ("WEBP", {"method": 4}),
+    "jpeg": ("JPEG", {"optimize": True, "progressive": True}),
+}
+
+
+class ImagePipeline:
+    """Resized variants of product images, at most ``widths[size]`` pixels
+    wide in each of ``formats``.
+
+    Variants are stored under ``variants/`` in the image's storage with the
+    hash of the original and the options in their name, so a name always
+    holds the same bytes and can be cached forever. They are rendered on
+    ``workers`` threads (or inline with none), ``batch_size`` products per
+    task, once the save of the products commits, and recorded in
+    ``Product.image_variants``; until then, and for images that cannot be
+    read, clients get the original. At most ``queue_size`` tasks wait for a
+    thread: products that find the queue full stay stale until
+    ``render_image_variants`` runs. Pillow releases the GIL while it
+    decodes, resizes and encodes.
+    """
+
+    def __init__(
+        self,
+        widths,
+        formats=("webp", "jpeg"),
+        quality=80,
+        workers=2,
+        batch_size=100,
+        queue_size=100,
+    ):
+        self.widths = dict(widths)
+        self.formats = list(formats)
+        self.quality = quality
+        self.batch_size = batch_size
+        self.executor = None
+        if workers:
+            self.executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="image-variants"
+            )
+            # tasks running or waiting for a thread
+            self.slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def stale(self, product):
+        """Whether the recorded variants were not made from the current
+        image; a product without an image has none to make."""
+        name = product.image.name
+        return bool(name) and (product.image_variants or {}).get("source") != name
+
+    def refresh(self, products):
+        """Render the variants of the products whose image changed once the
+        current transaction commits."""
+        product_ids = [product.pk for product in products if self.stale(product)]
+        if product_ids:
+            transaction.on_commit(lambda: self.submit(product_ids))
+
+    def submit(self, product_ids, block=False):
+        """Queue the products in batches; unless ``block``, those that find
+        the queue full are left out."""
+        batches = [
+            product_ids[i : i + self.batch_size]
+            for i in range(0, len(product_ids), self.batch_size)
+        ]
+        if self.executor is None:
+            return [self.work(batch) for batch in batches]
+        futures = []
+        for batch in batches:
+            if not self.slots.acquire(blocking=block):
+                break
+            future = self.executor.submit(self.work, batch)
+            future.add_done_callback(lambda future: self.slots.release())
+            futures.append(future)
+        return futures
+
+    def run(self, product_ids):
+        """Render the variants of the products now, in parallel, and return
+        how many were rendered."""
+        results = self.submit(product_ids, block=True)
+        if self.executor is not None:
+            results = [future.result() for future in results]
+        return sum(results)
+
+    def work(self, product_ids):
+        try:
+            return self.process(product_ids)
+        finally:
+            if self.executor is not None:
+                # the worker thread's own connections
+                connections.close_all()
+
+    def process(self, product_ids):
+        """Render and record the variants of the products, and return how
+        many were rendered."""
+        rendered, tags = 0, []
+        for product in Product.objects.filter(pk__in=product_ids).only(
+            "pk", "image", "category_id"
+        ):
+            name = product.image.name
+            variants = {"source": name, "sizes": {}}
+            if name:
+                try:
+                    with product.image.open("rb") as image:
+                        data = image.read()
+                    variants["sizes"] = self.render(product.image.storage, data)
+                except (OSError, ValueError, Image.DecompressionBombError) as e:
+                    variants["error"] = str(e)
+            # unless the image changed meanwhile, which renders again
+            updated = Product.objects.filter(pk=product.pk, image=name).update(
+                image_variants=variants, modified_at=timezone.now()
+            )
+            if updated:
+                tags += [f"product:{product.pk}", f"category:{product.category_id}"]
+                rendered += "error" not in variants
+        if tags:
+            invalidate("products", *tags)
+        return rendered
+
+    def render(self, storage, data):
+        """Store the variants of the image in ``data`` that are not stored
+        yet and return their names by size and format."""
+        digest = hashlib.sha256(data).hexdigest()[:20]
+        names = {
+            size: {
+                format: f"variants/{digest}-{width}w-q{self.quality}.{format}"
+                for format in self.formats
+            }
+            for size, width in self.widths.items()
+        }
+        missing = [
+            (size, format)
+            for size, formats in names.items()
+            for format, name in formats.items()
+            if not storage.exists(name)
+        ]
+        if not missing:
+            return names
+
+        with Image.open(io.BytesIO(data)) as original:
+            widest = max(self.widths[size] for size, _ in missing)
+            if original.width > widest:
+                # JPEGs decode straight at a reduced scale
+                original.draft(
+                    "RGB", (widest, original.height * widest // original.width)
+                )
+            image = ImageOps.exif_transpose(original)
+            image.load()
+        # each size is resized from the next larger one, which is cheaper
+        resized = {}
+        for size in sorted({size for size, _ in missing}, key=self.widths.get)[::-1]:
+            width = self.widths[size]
+            if image.width > width:
+                image = image.resize(
+                    (width, max(1, round(image.height * width / image.width))),
+                    Image.LANCZOS,
+                    reducing_gap=3.0,
+                )
+            resized[size] = image
+        for size, format in missing:
+            content = self.encode(resized[size], format)
+            names[size][format] = storage.save(names[size][format], content)
+        return names
+
+    def encode(self, image, format):
+        pillow_format, options = FORMATS[format]
+        alpha = image.mode in ("RGBA", "LA") or "transparency" in image.info
+        if format == "jpeg" and alpha:
+            # flattened onto white, which JPEG has no alpha for
+            image = image.convert("RGBA")
+            flat = Image.new("RGB", image.size, "white")
+            flat.paste(image, mask=image.getchannel("A"))
+            image = flat
+        elif image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if alpha else "RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, pillow_format, quality=self.quality, **options)
+        return ContentFile(buffer.getvalue())
+
+
+def variant_urls(product, request=None):
+    """URLs of the variants of the product's image by size and format, empty
+    until they are rendered."""
+    variants = product.image_variants or {}
+    if variants.get("source") != product.image.name:
+        return {}
+    storage = product.image.storage
+    urls = {}
+    for size, formats in variants.get("sizes", {}).items():
+        urls[size] = {}
+        for format, name in formats.items():
+            url = storage.url(name)
+            urls[size][format] = request.build_absolute_uri(url) if request else url
+    return urls
+
+
+_pipeline = None
+
+
+def image_pipeline():
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = ImagePipeline(**settings.IMAGE_VARIANTS)
+    return _pipeline
+
+
+@receiver(setting_changed)
+def reset_image_pipeline(setting, **kwargs):
+    global _pipeline
+    if setting == "IMAGE_VARIANTS":
+        _pipeline = None
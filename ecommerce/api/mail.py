@@ -0,0 +1,59 @@
+import os
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from sendgrid import SendGridAPIClient
+from sendgrid.helpers.mail import Mail
+
+
+class MailError(Exception):
+    pass
+
+
+class SendGridBackend:
+    """Sends through one SendGrid client kept for the life of the worker
+    process. The client opens a new HTTPS connection for each message."""
+
+    def __init__(self):
+        self.client = SendGridAPIClient(os.environ.get("SENDGRID_API_KEY"))
+        self.from_email = os.environ.get("gmail_usr")
+
+    def send(self, message):
+        response = self.client.send(
+            Mail(
+                from_email=self.from_email,
+                to_emails=message.recipient,
+                subject=message.subject,
+                html_content=message.html_content,
+            )
+        )
+        if response.status_code >= 300:
+            raise MailError(f"SendGrid answered {response.status_code}")
+
+
+class LocMemBackend:
+    """Keeps sent messages in ``LocMemBackend.outbox``, for tests and local
+    development."""
+
+    outbox = []
+
+    def send(self, message):
+        LocMemBackend.outbox.append(message)
+
+
+_backend = None
+
+
+def mail_backend():
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.OUTBOX_MAIL_BACKEND)()
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_mail_backend(setting, **kwargs):
+    global _backend
+    if setting == "OUTBOX_MAIL_BACKEND":
+        _backend = None
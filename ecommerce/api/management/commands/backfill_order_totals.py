@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from api.services import OrderSummaries
+
+
+class Command(BaseCommand):
+    help = (
+        "Store the total and item count of existing orders from their items, "
+        "then rebuild every user's order summary"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--summaries-only",
+            action="store_true",
+            help="only rebuild the summaries from the stored totals",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if not options["summaries_only"]:
+            orders = OrderSummaries.backfill_totals(batch_size=batch_size)
+            self.stdout.write(f"Stored totals of {orders} orders")
+        users = OrderSummaries.rebuild(batch_size=batch_size)
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt order summaries of {users} users")
+        )
@@ -0,0 +1,48 @@
+import os
+import time
+from django.contrib.auth import hashers
+from django.core.management.base import BaseCommand
+from api.passwords import HashingPool
+
+PASSWORD = "Bench-passw0rd!"
+
+
+class Command(BaseCommand):
+    help = (
+        "Time password verification with every configured hasher at its "
+        "configured cost and report logins per second per core"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--logins", type=int, default=50)
+        parser.add_argument("--workers", type=int, default=os.cpu_count())
+
+    def handle(self, *args, **options):
+        logins, workers = options["logins"], options["workers"]
+        pool = HashingPool(workers=workers, queue=logins)
+        cores = min(workers, os.cpu_count())
+        for hasher in hashers.get_hashers():
+            try:
+                encoded = hasher.encode(PASSWORD, hasher.salt())
+            except ValueError as e:
+                # e.g. argon2 without argon2-cffi installed
+                self.stdout.write(f"{hasher.algorithm}: skipped ({e})")
+                continue
+
+            started = time.perf_counter()
+            for _ in range(logins):
+                hasher.verify(PASSWORD, encoded)
+            serial = logins / (time.perf_counter() - started)
+
+            started = time.perf_counter()
+            pool.map(
+                lambda password: hasher.verify(password, encoded), [PASSWORD] * logins
+            )
+            pooled = logins / (time.perf_counter() - started)
+
+            self.stdout.write(
+                f"{hasher.algorithm}: {1000 / serial:.1f}ms per login, "
+                f"{serial:.1f} logins/s on one thread, "
+                f"{pooled:.1f} logins/s on {workers} workers "
+                f"({pooled / cores:.1f} per core)"
+            )
@@ -0,0 +1,82 @@
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, setup_test_environment
+from rest_framework.test import APIClient
+from api.models import ReferralCode
+from api.services import Registration
+
+PASSWORD = "Bench-passw0rd!"
+
+
+class Command(BaseCommand):
+    help = (
+        "Register users inside a rolled back transaction and report the queries "
+        "and time per registration, single and bulk"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--registrations", type=int, default=20)
+        parser.add_argument("--provision", type=int, default=5000)
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        count = options["registrations"]
+        with transaction.atomic():
+            referrer = Registration.register("bench-referrer@example.com", PASSWORD)
+            code = ReferralCode.objects.get(user=referrer).code
+            client = APIClient()
+            self.report(
+                "POST /api/register/",
+                count,
+                lambda i: client.post(
+                    "/api/register/",
+                    {"email": f"bench-api-{i}@example.com", "password": PASSWORD},
+                ),
+            )
+            self.report(
+                "POST /api/register/ with referral code",
+                count,
+                lambda i: client.post(
+                    "/api/register/",
+                    {
+                        "email": f"bench-referred-{i}@example.com",
+                        "password": PASSWORD,
+                        "referral_code": code,
+                    },
+                ),
+            )
+            self.report(
+                "Registration.register",
+                count,
+                lambda i: Registration.register(f"bench-{i}@example.com", PASSWORD),
+            )
+
+            total = options["provision"]
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                created, _ = Registration.provision(
+                    ({"email": f"bench-bulk-{i}@example.com"} for i in range(total)),
+                    batch_size=options["batch_size"],
+                )
+                elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"Registration.provision: {created} users in {elapsed:.2f}s, "
+                f"{len(queries)} queries ({len(queries) / max(created, 1):.4f} per user)"
+            )
+            transaction.set_rollback(True)
+
+    def report(self, label, count, register):
+        queries, timings = [], []
+        for i in range(count):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                register(i)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(captured))
+        self.stdout.write(
+            f"{label}: {statistics.median(queries):g} queries, "
+            f"p50 {statistics.median(timings):.1f}ms over {count} registrations"
+        )
@@ -0,0 +1,112 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from api.models import Category, Product
+from api.search import search_backend
+
+WORDS = (
+    "alpine amber arctic aurora basalt birch breeze canyon cedar cobalt coral "
+    "crimson dune ember fern fjord glacier granite harbor hazel indigo ivory "
+    "jade juniper lagoon lava maple marble meadow mesa mist monsoon moss "
+    "nebula oak obsidian ocean onyx orchid pebble pine prairie quartz raven "
+    "reef ridge river saffron sage sequoia sierra slate spruce summit tundra "
+    "valley velvet willow zephyr"
+).split()
+NOUNS = (
+    "backpack blender boots candle chair jacket kettle lamp mug notebook "
+    "pillow rug scarf sneakers speaker table tent watch wallet headphones"
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a synthetic catalog inside a rolled back transaction and time "
+        "product searches against the icontains scan they replace"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=1_000_000)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        with transaction.atomic():
+            started = time.perf_counter()
+            self.seed(rng, options["products"], options["batch_size"])
+            indexed = search_backend().index()
+            self.stdout.write(
+                f"Seeded and indexed {indexed} products "
+                f"in {time.perf_counter() - started:.1f}s"
+            )
+
+            terms = [self.term(rng) for _ in range(options["queries"])]
+            backend = search_backend()
+            self.report(
+                "search engine",
+                terms,
+                lambda term: list(
+                    backend.search(Product.objects.all(), term)[:10].values("pk")
+                ),
+            )
+            self.report(
+                "icontains scan",
+                terms,
+                lambda term: list(
+                    Product.objects.filter(
+                        Q(name__icontains=term) | Q(description__icontains=term)
+                    )
+                    .order_by("id")[:10]
+                    .values("pk")
+                ),
+            )
+            transaction.set_rollback(True)
+
+    def seed(self, rng, count, batch_size):
+        categories = Category.objects.bulk_create(
+            Category(name=f"bench {noun}") for noun in NOUNS
+        )
+        for start in range(0, count, batch_size):
+            Product.objects.bulk_create(
+                self.product(rng, categories)
+                for _ in range(min(batch_size, count - start))
+            )
+
+    def product(self, rng, categories):
+        name = f"{rng.choice(WORDS)} {rng.choice(WORDS)} {rng.choice(NOUNS)}"
+        return Product(
+            name=name.title(),
+            description=" ".join(rng.choices(WORDS + NOUNS, k=20)),
+            price=Decimal(rng.randrange(100, 100000)) / 100,
+            image="images/bench.jpg",
+            category=rng.choice(categories),
+            quantity=rng.randrange(0, 50),
+        )
+
+    def term(self, rng):
+        kind = rng.random()
+        if kind < 0.4:
+            return f"{rng.choice(WORDS)} {rng.choice(NOUNS)}"
+        if kind < 0.8:
+            return rng.choice(WORDS)[:4]
+        word = list(rng.choice(WORDS))
+        word[rng.randrange(len(word))] = rng.choice("aeiou")
+        return "".join(word)
+
+    def report(self, label, terms, run):
+        timings = []
+        for term in terms:
+            started = time.perf_counter()
+            run(term)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        self.stdout.write(
+            f"{label}: p50 {statistics.median(timings):.2f}ms "
+            f"p95 {timings[int(len(timings) * 0.95) - 1]:.2f}ms "
+            f"max {timings[-1]:.2f}ms over {len(timings)} queries"
+        )
@@ -0,0 +1,619 @@
+import asyncio
+import json
+import platform
+import random
+import time
+from collections import Counter
+from decimal import Decimal
+from urllib.parse import urlencode
+from asgiref.sync import async_to_sync, sync_to_async
+from django import get_version
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import AsyncClient, Client
+from django.test.client import MULTIPART_CONTENT, encode_multipart, BOUNDARY
+from django.test.utils import override_settings, setup_test_environment
+from django.utils import timezone
+from api.authentication import tokens_for
+from api.carts import cart_store
+from api.facets import FacetCounter
+from api.models import *
+from api.search import search_backend
+from api.services import OrderSummaries, RatingAggregate, Registration
+from .bench_search import Command as SearchBenchmark
+from .load_test import percentile
+
+PASSWORD = "Bench#Passw0rd"
+STATUSES = ["Pending", "Processing", "Shipped", "Delivered", "Cancelled"]
+# median differences below this are noise on a shared machine
+NOISE_MS = 1.0
+
+
+def route(
+    name,
+    method,
+    path,
+    user=None,
+    body=None,
+    multipart=None,
+    headers=None,
+    prepare=None,
+    status=200,
+    limit=None,
+):
+    """A benchmarked route; ``path``, ``user``, ``body`` and ``multipart``
+    may be functions of the iteration."""
+    return {
+        "name": name,
+        "method": method,
+        "path": path,
+        "user": user,
+        "body": body,
+        "multipart": multipart,
+        "headers": headers or {},
+        "prepare": prepare,
+        "status": status if isinstance(status, tuple) else (status,),
+        "limit": limit,
+    }
+
+
+def build(route, i, headers):
+    """The test client arguments of iteration ``i`` of ``route``."""
+
+    def value(spec):
+        return spec(i) if callable(spec) else spec
+
+    kwargs = {
+        "method": route["method"],
+        "path": value(route["path"]),
+        "headers": headers,
+    }
+    if route["multipart"] is not None:
+        kwargs["data"] = encode_multipart(BOUNDARY, value(route["multipart"]))
+        kwargs["content_type"] = MULTIPART_CONTENT
+    elif route["body"] is not None:
+        kwargs["data"] = json.dumps(value(route["body"]))
+        kwargs["content_type"] = "application/json"
+    return kwargs
+
+
+class QueryCounter:
+    """Counts the queries of a connection without keeping them, which
+    CaptureQueriesContext does only up to 9000."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a deterministic dataset inside a rolled back transaction, drive "
+        "every API route in process through the WSGI or the ASGI handler, and "
+        "report latency percentiles, throughput and queries per request, as "
+        "JSON that a later run can be compared with"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=100_000)
+        parser.add_argument("--users", type=int, default=2000)
+        parser.add_argument("--orders", type=int, default=20_000)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--requests", type=int, default=50, help="per route")
+        parser.add_argument("--warmup", type=int, default=3, help="per route")
+        parser.add_argument("--driver", choices=["wsgi", "asgi"], default="wsgi")
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="requests in flight at once, with the asgi driver",
+        )
+        parser.add_argument(
+            "--route", action="append", dest="routes", help="only these, repeatable"
+        )
+        parser.add_argument(
+            "--no-catalog-cache",
+            action="store_true",
+            help="serve the catalog without its response cache",
+        )
+        parser.add_argument("--output", help="write the results as JSON, - for stdout")
+        parser.add_argument("--baseline", help="results of an earlier run")
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="allowed growth of the median over the baseline, as a fraction",
+        )
+
+    def handle(self, *args, **options):
+        if options["driver"] == "wsgi" and options["concurrency"] != 1:
+            # the dataset is only visible to this thread's transaction
+            raise CommandError("--concurrency needs --driver asgi")
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+
+        setup_test_environment()
+        overrides = {}
+        if options["no_catalog_cache"]:
+            overrides["CATALOG_CACHE"] = None
+        with override_settings(**overrides), transaction.atomic():
+            started = time.perf_counter()
+            fixtures = self.seed(random.Random(options["seed"]), options)
+            self.stderr.write(
+                f"Seeded in {time.perf_counter() - started:.1f}s", ending="\n"
+            )
+            routes = self.routes(fixtures)
+            unknown = set(options["routes"] or []) - {r["name"] for r in routes}
+            if unknown:
+                raise CommandError(f"Unknown routes: {', '.join(sorted(unknown))}")
+            results = {}
+            self.queries = QueryCounter()
+            for route in routes:
+                if options["routes"] and route["name"] not in options["routes"]:
+                    continue
+                with connection.execute_wrapper(self.queries):
+                    results[route["name"]] = self.measure(route, options)
+                self.report(route["name"], results[route["name"]])
+            transaction.set_rollback(True)
+
+        output = {"meta": self.meta(options), "routes": results}
+        if options["output"] == "-":
+            self.stdout.write(json.dumps(output, indent=2))
+        elif options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(output, f, indent=2)
+        if baseline is not None:
+            self.compare(results, baseline["routes"], options["tolerance"])
+
+    def meta(self, options):
+        return {
+            "created_at": timezone.now().isoformat(),
+            "driver": options["driver"],
+            "concurrency": options["concurrency"],
+            "requests": options["requests"],
+            "seed": options["seed"],
+            "products": options["products"],
+            "users": options["users"],
+            "orders": options["orders"],
+            "catalog_cache": not options["no_catalog_cache"],
+            "async_views": settings.ASYNC_API_VIEWS,
+            "database": connection.vendor,
+            "python": platform.python_version(),
+            "django": get_version(),
+        }
+
+    def seed(self, rng, options):
+        batch_size = options["batch_size"]
+        SearchBenchmark().seed(rng, options["products"], batch_size)
+        product_ids = list(Product.objects.order_by("pk").values_list("pk", flat=True))
+        ProductRating.objects.bulk_create(
+            [ProductRating(product_id=pk) for pk in product_ids],
+            ignore_conflicts=True,
+            batch_size=batch_size,
+        )
+        in_stock = list(
+            Product.objects.filter(quantity__gte=10)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+
+        Registration.provision(
+            ({"email": f"bench-{i}@example.com"} for i in range(options["users"])),
+            batch_size=batch_size,
+        )
+        users = list(
+            CustomUser.objects.filter(email__startswith="bench-").order_by("pk")
+        )
+        user = CustomUser.objects.create_user(email="bench@example.com")
+        user.set_password(PASSWORD)
+        user.save(update_fields=["password"])
+        staff = CustomUser.objects.create_superuser(email="bench-staff@example.com")
+
+        carts = Cart.objects.bulk_create(Cart(user=u) for u in users)
+        CartItem.objects.bulk_create(
+            (
+                CartItem(cart=cart, product_id=product_id)
+                for cart in carts
+                for product_id in rng.sample(in_stock, 3)
+            ),
+            batch_size=batch_size,
+        )
+
+        # the benchmark user has delivered orders left to review
+        owners = [user] * 200 + [rng.choice(users) for _ in range(options["orders"])]
+        orders = Order.objects.bulk_create(
+            (
+                Order(
+                    user=owner,
+                    status="Delivered" if i < 200 else rng.choice(STATUSES),
+                )
+                for i, owner in enumerate(owners)
+            ),
+            batch_size=batch_size,
+        )
+        items = [
+            OrderItem(
+                order=order,
+                product_id=rng.choice(product_ids),
+                quantity=rng.randrange(1, 4),
+                price=Decimal(rng.randrange(100, 100000)) / 100,
+            )
+            for order in orders
+            for _ in range(3)
+        ]
+        OrderItem.objects.bulk_create(items, batch_size=batch_size)
+        OrderSummaries.backfill_totals(batch_size)
+        OrderSummaries.rebuild(batch_size=batch_size)
+        PurchasedProduct.objects.bulk_create(
+            (
+                PurchasedProduct(user=item.order.user, product_id=item.product_id)
+                for item in items
+                if item.order.status == "Delivered"
+            ),
+            ignore_conflicts=True,
+            batch_size=batch_size,
+        )
+        Review.objects.bulk_create(
+            (
+                Review(
+                    user_id=purchase.user_id,
+                    product_id=purchase.product_id,
+                    rating=rng.randrange(1, 6),
+                )
+                for purchase in PurchasedProduct.objects.exclude(user=user)
+                .order_by("pk")
+                .iterator()
+                if rng.random() < 0.5
+            ),
+            batch_size=batch_size,
+        )
+        RatingAggregate.rebuild(batch_size=batch_size)
+        FacetCounter.rebuild()
+        search_backend().index()
+
+        guest = cart_store().change_guest(None, {in_stock[0]: ("add", 1)})
+        return {
+            "rng": rng,
+            "user": user,
+            "staff": staff,
+            "in_stock": in_stock,
+            "product_ids": product_ids,
+            "categories": list(Category.objects.order_by("pk")),
+            "order": Order.objects.filter(user=user).order_by("pk").first(),
+            "reviewable": list(
+                PurchasedProduct.objects.filter(user=user)
+                .order_by("pk")
+                .values_list("product_id", flat=True)
+            ),
+            "guest_token": guest["token"],
+            "shoppers": users,
+        }
+
+    def routes(self, fixtures):
+        """Every route of api/urls.py but the API docs, with the request of
+        each iteration ``i``. ``prepare`` runs untimed before it."""
+        rng, user, staff = fixtures["rng"], fixtures["user"], fixtures["staff"]
+        in_stock, categories = fixtures["in_stock"], fixtures["categories"]
+        terms = [SearchBenchmark().term(rng) for _ in range(100)]
+
+        def pick(values):
+            return lambda i: values[i % len(values)]
+
+        def import_file(i):
+            rows = "".join(
+                f"bench-import-{n},Imported {n},{n % 100 + 1}.99,Imported,"
+                f"images/bench.jpg,{i + 1},bench import\n"
+                for n in range(100)
+            )
+            header = "sku,name,price,description,image,quantity,category\n"
+            upload = ContentFile((header + rows).encode(), name="catalog.csv")
+            return {"file": upload}
+
+        return [
+            route("health", "GET", "/api/health/"),
+            route(
+                "register",
+                "POST",
+                "/api/register/",
+                body=lambda i: {
+                    "email": f"bench-new-{i}@example.com",
+                    "password": PASSWORD,
+                },
+                status=201,
+            ),
+            route(
+                "login",
+                "POST",
+                "/api/login/",
+                body={"email": user.email, "password": PASSWORD},
+            ),
+            route(
+                "token refresh",
+                "POST",
+                "/api/token/refresh/",
+                body=lambda i: {"refresh": str(tokens_for(user))},
+            ),
+            route(
+                "token verify",
+                "POST",
+                "/api/token/verify/",
+                body=lambda i: {"token": str(tokens_for(user).access_token)},
+            ),
+            route(
+                "logout",
+                "POST",
+                "/api/logout/",
+                user,
+                body=lambda i: {"refresh_token": str(tokens_for(user))},
+                status=205,
+            ),
+            route("users (staff)", "GET", "/api/admin/users/", staff),
+            route(
+                "product list",
+                "GET",
+                lambda i: f"/api/products/?page={i % 10 + 1}",
+            ),
+            route(
+                "product list by category",
+                "GET",
+                lambda i: "/api/products/?"
+                + urlencode({"category": categories[i % len(categories)].name}),
+            ),
+            route(
+                "product search",
+                "GET",
+                lambda i: "/api/products/?"
+                + urlencode({"search": terms[i % len(terms)]}),
+            ),
+            route("product facets", "GET", "/api/products/facets/"),
+            route(
+                "product detail",
+                "GET",
+                lambda i: f"/api/products/{pick(fixtures['product_ids'])(i * 7919)}/",
+            ),
+            route(
+                "product import",
+                "POST",
+                "/api/products/import/",
+                staff,
+                multipart=import_file,
+                limit=5,
+            ),
+            route(
+                "product export",
+                "GET",
+                "/api/products/export/",
+                staff,
+                limit=3,
+            ),
+            route("category list", "GET", "/api/categories/"),
+            route(
+                "category detail",
+                "GET",
+                lambda i: f"/api/categories/{categories[i % len(categories)].pk}/",
+                limit=10,
+            ),
+            route("cart", "GET", "/api/cart/", user),
+            route("cart items", "GET", "/api/cart-items/", user),
+            route(
+                "cart item add",
+                "POST",
+                "/api/cart-items/",
+                user,
+                body=lambda i: {"product": in_stock[i % 500], "quantity": 1},
+                status=(200, 201),
+            ),
+            route(
+                "cart batch",
+                "POST",
+                "/api/cart-items/batch/",
+                user,
+                body=lambda i: {
+                    "items": [
+                        {"product": in_stock[(i * 3 + n) % 500], "add": 1}
+                        for n in range(3)
+                    ]
+                },
+            ),
+            route(
+                "guest cart",
+                "GET",
+                "/api/cart/guest/",
+                headers={"X-Cart-Token": fixtures["guest_token"]},
+            ),
+            route(
+                "guest cart change",
+                "POST",
+                "/api/cart/guest/",
+                body=lambda i: {"items": [{"product": in_stock[i % 500], "add": 1}]},
+                headers={"X-Cart-Token": fixtures["guest_token"]},
+            ),
+            route(
+                "checkout",
+                "POST",
+                "/api/orders/create/",
+                # a shopper with a full cart each, for concurrent checkouts
+                pick(fixtures["shoppers"]),
+                status=201,
+            ),
+            route("order history", "GET", "/api/orders/", user),
+            route("all orders (staff)", "GET", "/api/orders/", staff),
+            route("compact orders", "GET", "/api/orders/compact/", user),
+            route("order summary", "GET", "/api/orders/summary/", user),
+            route(
+                "order export",
+                "GET",
+                "/api/orders/export/?status=Delivered",
+                staff,
+                limit=3,
+            ),
+            route("order detail", "GET", f"/api/orders/{fixtures['order'].pk}/", user),
+            route(
+                "review",
+                "POST",
+                "/api/reviews/",
+                user,
+                body=lambda i: {
+                    "product": fixtures["reviewable"][i],
+                    "rating": i % 5 + 1,
+                },
+                status=201,
+                limit=len(fixtures["reviewable"]),
+            ),
+            route("wallet", "GET", "/api/wallet/", user),
+            route("referral", "GET", "/api/referral/", user),
+            route(
+                "referral send",
+                "POST",
+                "/api/referral/",
+                user,
+                body=lambda i: {"to_email": f"friend-{i}@example.com"},
+                status=202,
+            ),
+        ]
+
+    def measure(self, route, options):
+        limit = route["limit"]
+        count = min(options["requests"], limit or options["requests"])
+        # limited routes are costly, or have as many requests to make
+        warmup = (
+            options["warmup"]
+            if limit is None
+            else min(options["warmup"], limit - count)
+        )
+
+        def auth(user):
+            # fresh tokens, which a long run would otherwise outlive
+            access = tokens_for(user).access_token
+            return {**route["headers"], "Authorization": f"Bearer {access}"}
+
+        headers = route["headers"]
+        if isinstance(route["user"], CustomUser):
+            headers = auth(route["user"])
+
+        def request(i):
+            """The client arguments of iteration ``i``, made untimed, and the
+            number of queries that took."""
+            before = self.queries.count
+            if route["prepare"]:
+                route["prepare"](i)
+            if callable(route["user"]):
+                kwargs = build(route, i, auth(route["user"](i)))
+            else:
+                kwargs = build(route, i, headers)
+            return kwargs, self.queries.count - before
+
+        if options["driver"] == "wsgi":
+            self.run_sync(request, 0, warmup)
+            elapsed, timings, statuses, queries = self.run_sync(request, warmup, count)
+        else:
+            drive = async_to_sync(self.run_async)
+            drive(request, 0, warmup, options["concurrency"])
+            elapsed, timings, statuses, queries = drive(
+                request, warmup, count, options["concurrency"]
+            )
+
+        timings.sort()
+        expected = route["status"]
+        errors = sum(n for code, n in statuses.items() if code not in expected)
+        return {
+            "method": route["method"],
+            "requests": len(timings),
+            "p50_ms": round(percentile(timings, 0.5) * 1000, 3),
+            "p90_ms": round(percentile(timings, 0.9) * 1000, 3),
+            "p95_ms": round(percentile(timings, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(timings, 0.99) * 1000, 3),
+            "max_ms": round(timings[-1] * 1000, 3),
+            "mean_ms": round(sum(timings) / len(timings) * 1000, 3),
+            "throughput_rps": round(len(timings) / elapsed, 1),
+            "queries_per_request": round(queries / len(timings), 2),
+            "statuses": {str(code): n for code, n in sorted(statuses.items())},
+            "errors": errors,
+        }
+
+    def run_sync(self, request, start, count):
+        client = Client()
+        timings, statuses, queries = [], Counter(), 0
+        for i in range(start, start + count):
+            kwargs, _untimed = request(i)
+            before = self.queries.count
+            started = time.perf_counter()
+            response = client.generic(**kwargs)
+            if response.streaming:
+                b"".join(response.streaming_content)
+            timings.append(time.perf_counter() - started)
+            statuses[response.status_code] += 1
+            queries += self.queries.count - before
+        return sum(timings), timings, statuses, queries
+
+    async def run_async(self, request, start, count, concurrency):
+        # the sync parts of views and the ORM run on the thread that holds
+        # the transaction, one at a time, while requests wait on each other
+        client = AsyncClient()
+        indexes = iter(range(start, start + count))
+        timings, statuses, untimed = [], Counter(), [0]
+
+        async def worker():
+            for i in indexes:
+                kwargs, queries = await sync_to_async(request)(i)
+                untimed[0] += queries
+                started = time.perf_counter()
+                response = await client.generic(**kwargs)
+                if response.streaming:
+                    await sync_to_async(b"".join)(response.streaming_content)
+                timings.append(time.perf_counter() - started)
+                statuses[response.status_code] += 1
+
+        before = self.queries.count
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        queries = self.queries.count - before - untimed[0]
+        return elapsed, timings, statuses, queries
+
+    def report(self, name, result):
+        line = (
+            f"{name}: p50 {result['p50_ms']:.1f}ms p95 {result['p95_ms']:.1f}ms "
+            f"p99 {result['p99_ms']:.1f}ms, {result['throughput_rps']:.1f} req/s, "
+            f"{result['queries_per_request']:g} queries"
+        )
+        if result["errors"]:
+            line += f", {result['errors']} unexpected ({result['statuses']})"
+            self.stderr.write(self.style.ERROR(line), ending="\n")
+        else:
+            self.stderr.write(line, ending="\n")
+
+    def compare(self, results, baseline, tolerance):
+        regressed = []
+        for name, result in results.items():
+            base = baseline.get(name)
+            if base is None:
+                continue
+            slower = (
+                result["p50_ms"] > base["p50_ms"] * (1 + tolerance)
+                and result["p50_ms"] - base["p50_ms"] > NOISE_MS
+            )
+            more_queries = result["queries_per_request"] > base["queries_per_request"]
+            line = (
+                f"{name}: p50 {base['p50_ms']:.1f} -> {result['p50_ms']:.1f}ms, "
+                f"queries {base['queries_per_request']:g} -> "
+                f"{result['queries_per_request']:g}"
+            )
+            if slower or more_queries:
+                regressed.append(name)
+                self.stderr.write(self.style.ERROR(line), ending="\n")
+            else:
+                self.stderr.write(line, ending="\n")
+        if regressed:
+            raise CommandError(
+                f"Regressed against the baseline: {', '.join(regressed)}"
+            )
+        self.stderr.write(self.style.SUCCESS("No regressions against the baseline"))
@@ -0,0 +1,325 @@
+import json
+import re
+from datetime import timedelta
+from decimal import Decimal
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.http import QueryDict
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework.viewsets import ViewSetMixin
+from api.models import *
+from api.outbox import OutboxWorker
+from api.reports import OrderExporter
+from api.search import PostgresSearchBackend
+from api.services import PurchaseHistory, ShoppingCart
+from api.views import (
+    CartItemViewSet,
+    CategoryDetail,
+    CompactOrderListView,
+    ListOrderView,
+    ProductDetail,
+    ProductList,
+)
+
+# tables seeded large enough that reading one whole is a regression; the
+# category table stays small and is scanned by name on purpose
+LARGE_TABLES = {
+    "api_customuser",
+    "api_product",
+    "api_cart",
+    "api_cartitem",
+    "api_order",
+    "api_orderitem",
+    "api_review",
+    "api_purchasedproduct",
+    "api_outboxmessage",
+}
+
+# statements whose plan is checked; savepoints and inserts have none worth it
+EXPLAINED = re.compile(r"\s*(SELECT|UPDATE|DELETE)\b", re.IGNORECASE)
+
+
+class StatementRecorder:
+    """Keeps the statements run on a connection, with their parameters."""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and EXPLAINED.match(sql):
+            self.statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the code of each endpoint over large seeded tables, EXPLAIN the "
+        "statements it runs and fail if any of them reads a large table "
+        "sequentially"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=20000)
+        parser.add_argument(
+            "--verbose-plans", action="store_true", help="print every plan"
+        )
+
+    def handle(self, *args, **options):
+        failed = []
+        # the paginators build their links from the host of the request
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=["testserver"]):
+            fixtures = self.seed(options["rows"])
+            self.analyze()
+            for name, run in self.queries(fixtures):
+                recorder = StatementRecorder()
+                with connection.execute_wrapper(recorder):
+                    run()
+                scans = set()
+                for sql, params in recorder.statements:
+                    plan, statement_scans = self.explain(sql, params)
+                    if options["verbose_plans"]:
+                        self.stdout.write(plan)
+                    scans |= statement_scans
+                if scans:
+                    failed.append(name)
+                    self.stdout.write(
+                        self.style.ERROR(f"{name}: scans {', '.join(sorted(scans))}")
+                    )
+                else:
+                    self.stdout.write(f"{name}: indexed")
+            transaction.set_rollback(True)
+
+        if failed:
+            raise CommandError(f"Sequential scans in {', '.join(failed)}")
+        self.stdout.write(self.style.SUCCESS("Every query plan uses an index"))
+
+    def queries(self, fixtures):
+        """The name of each check and a callable running the code of the
+        endpoint, whose statements are explained."""
+        user, staff, product = fixtures["user"], fixtures["staff"], fixtures["product"]
+        category = product.category.name
+        # list endpoints with a keyset_ordering are read page by page in
+        # keyset order; the total count of the default pagination is left out
+        keyset = {"pagination": "cursor"}
+        checks = [
+            ("product list", lambda: self.pages(ProductList, user, keyset)),
+            (
+                "product list by category",
+                lambda: self.pages(ProductList, user, {**keyset, "category": category}),
+            ),
+            (
+                "product list by price",
+                lambda: self.pages(
+                    ProductList, user, {**keyset, "price": str(product.price)}
+                ),
+            ),
+            (
+                "product list by category and price",
+                lambda: self.pages(
+                    ProductList,
+                    user,
+                    {**keyset, "category": category, "price": str(product.price)},
+                ),
+            ),
+            (
+                "product detail",
+                lambda: self.view(ProductDetail, user, pk=product.pk).get_object(),
+            ),
+            (
+                "category products",
+                lambda: self.view(
+                    CategoryDetail, user, pk=product.category_id
+                ).get_object(),
+            ),
+            (
+                "cart items",
+                lambda: self.pages(CartItemViewSet, user, {"count": "false"}),
+            ),
+            (
+                "cart upsert",
+                lambda: ShoppingCart(user).apply({product.pk: ("add", 1)}),
+            ),
+            ("order history", lambda: self.pages(ListOrderView, user, keyset)),
+            (
+                "compact order history",
+                lambda: self.pages(CompactOrderListView, user, keyset),
+            ),
+            (
+                "all orders (staff)",
+                lambda: self.pages(CompactOrderListView, staff, keyset),
+            ),
+            (
+                "order export",
+                lambda: next(
+                    OrderExporter(
+                        created_after=timezone.now() - timedelta(days=1),
+                        statuses=["Delivered"],
+                    ).rows(),
+                    None,
+                ),
+            ),
+            (
+                "review eligibility",
+                lambda: PurchaseHistory.delivered(user, product.pk),
+            ),
+            (
+                "order summary",
+                lambda: OrderSummary.objects.filter(user=user).first(),
+            ),
+            ("outbox claim", lambda: OutboxWorker().claim()),
+        ]
+        if connection.vendor == "postgresql":
+            # the in-process index of other databases reads products by key
+            backend = PostgresSearchBackend()
+            backend.index()
+            checks += [
+                (
+                    "product search",
+                    lambda: self.search(backend, user, product.name),
+                ),
+                (
+                    "product search, misspelt",
+                    lambda: self.search(backend, user, product.name[1:]),
+                ),
+            ]
+        return checks
+
+    def view(self, view_class, user, params=None, **kwargs):
+        """An instance of ``view_class`` set up for a GET of ``user``."""
+        request = APIRequestFactory().get("/", params or {})
+        force_authenticate(request, user=user)
+        view = view_class()
+        if isinstance(view, ViewSetMixin):
+            view.action_map = {"get": "retrieve" if kwargs else "list"}
+        view.setup(request, **kwargs)
+        view.request = view.initialize_request(request)
+        view.format_kwarg = None
+        return view
+
+    def pages(self, view_class, user, params):
+        """The first two pages of the list of ``view_class``, filtered and
+        paginated as the view does."""
+        view = self.view(view_class, user, params)
+        page = view.paginate_queryset(view.filter_queryset(view.get_queryset()))
+        next_link = view.get_paginated_response(page).data["next"]
+        if next_link:
+            params = QueryDict(urlsplit(next_link).query)
+            view = self.view(view_class, user, params.dict())
+            view.paginate_queryset(view.filter_queryset(view.get_queryset()))
+
+    def search(self, backend, user, term):
+        view = self.view(ProductList, user, {"count": "false"})
+        products = view.filter_queryset(view.get_queryset())
+        view.paginate_queryset(backend.search(products, term))
+
+    def seed(self, rows):
+        now = timezone.now()
+        users = CustomUser.objects.bulk_create(
+            CustomUser(email=f"queryplan-{i}@example.com", is_staff=i == 1)
+            for i in range(rows // 20)
+        )
+        categories = Category.objects.bulk_create(
+            Category(name=f"queryplan {i}") for i in range(50)
+        )
+        products = Product.objects.bulk_create(
+            Product(
+                name=f"queryplan {i}",
+                price=Decimal(i % 500) + Decimal("0.99"),
+                description="queryplan",
+                image="images/queryplan.jpg",
+                category=categories[i % len(categories)],
+                quantity=10,
+            )
+            for i in range(rows)
+        )
+        carts = Cart.objects.bulk_create(Cart(user=user) for user in users)
+        CartItem.objects.bulk_create(
+            CartItem(cart=cart, product=products[(i * 5 + j) % rows])
+            for i, cart in enumerate(carts)
+            for j in range(5)
+        )
+        orders = Order.objects.bulk_create(
+            Order(user=users[i % len(users)], status="Delivered") for i in range(rows)
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(
+                order=order,
+                product=products[(i * 3 + j) % rows],
+                price=products[(i * 3 + j) % rows].price,
+            )
+            for i, order in enumerate(orders)
+            for j in range(3)
+        )
+        PurchasedProduct.objects.bulk_create(
+            PurchasedProduct(user=users[i % len(users)], product=products[i])
+            for i in range(rows)
+        )
+        Review.objects.bulk_create(
+            Review(user=users[i % len(users)], product=products[i], rating=i % 5 + 1)
+            for i in range(rows)
+        )
+        OutboxMessage.objects.bulk_create(
+            OutboxMessage(
+                dedupe_key=f"queryplan-{i}",
+                recipient="queryplan@example.com",
+                subject="queryplan",
+                html_content="",
+                status="Pending" if i % 100 == 0 else "Sent",
+                next_attempt_at=now - timedelta(seconds=i),
+            )
+            for i in range(rows)
+        )
+        return {"user": users[0], "staff": users[1], "product": products[0]}
+
+    def analyze(self):
+        # plans follow table statistics, which bulk inserts leave out of date
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                for table in sorted(LARGE_TABLES):
+                    cursor.execute(f"ANALYZE {connection.ops.quote_name(table)}")
+            else:
+                cursor.execute("ANALYZE")
+
+    def explain(self, sql, params):
+        """The query plan of a statement and the large tables it scans."""
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                return json.dumps(plan, indent=2), self.pg_scans(plan[0]["Plan"])
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            details = [row[-1] for row in cursor.fetchall()]
+        return "\n".join(details), self.sqlite_scans(sql, details)
+
+    def pg_scans(self, node):
+        scans = set()
+        if node["Node Type"] in ("Seq Scan", "Parallel Seq Scan"):
+            if node["Relation Name"] in LARGE_TABLES:
+                scans.add(node["Relation Name"])
+        for child in node.get("Plans", []):
+            scans |= self.pg_scans(child)
+        return scans
+
+    def sqlite_scans(self, sql, details):
+        # SQLite reports subquery tables by their alias
+        aliases = {alias: table for table, alias in re.findall(r'"(\w+)" (U\d+)', sql)}
+        # the outer loop of a limited query read in index (or rowid) order
+        # stops at its limit
+        ordered = re.search(r"\bLIMIT\b", sql) is not None and not any(
+            "TEMP B-TREE" in detail for detail in details
+        )
+        scans = set()
+        tables = [d for d in details if re.match(r"(SCAN|SEARCH) \w+", d)]
+        for position, detail in enumerate(tables):
+            match = re.match(r"SCAN (\w+)", detail)
+            if match is None or (ordered and position == 0):
+                continue
+            table = aliases.get(match[1], match[1])
+            if table in LARGE_TABLES:
+                scans.add(table)
+        return scans
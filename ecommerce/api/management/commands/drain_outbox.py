@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from api.outbox import OutboxWorker
+
+
+class Command(BaseCommand):
+    help = "Deliver queued outbox messages, once or continuously with --loop"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--loop", action="store_true")
+        parser.add_argument(
+            "--interval", type=float, default=1.0, help="seconds between polls"
+        )
+
+    def handle(self, *args, **options):
+        worker = OutboxWorker(batch_size=options["batch_size"])
+        while True:
+            sent, failed = worker.drain()
+            if sent or failed or not options["loop"]:
+                self.stdout.write(f"Sent {sent} messages, {failed} failed")
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,20 @@
+import sys
+from django.core.management.base import BaseCommand
+from api.catalog_io import ProductExporter
+
+
+class Command(BaseCommand):
+    help = "Write every product as CSV or JSON lines in the import format"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+        parser.add_argument("--output", help="file to write, stdout when omitted")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        exporter = ProductExporter(chunk_size=options["chunk_size"])
+        if options["output"]:
+            with open(options["output"], "w", newline="", encoding="utf-8") as out:
+                out.writelines(exporter.stream(options["format"]))
+        else:
+            sys.stdout.writelines(exporter.stream(options["format"]))
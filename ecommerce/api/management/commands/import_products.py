@@ -0,0 +1,31 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from api.catalog_io import ProductImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = "Upsert products on sku from a CSV or JSON lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["csv", "jsonl"])
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        format = options["format"] or options["path"].rsplit(".", 1)[-1]
+        if format not in ("csv", "jsonl"):
+            raise CommandError("Pass --format csv or --format jsonl")
+
+        with open(options["path"], "rb") as stream:
+            importer = ProductImporter(chunk_size=options["chunk_size"]).run(
+                read_rows(stream, format)
+            )
+
+        for error in importer.errors:
+            self.stderr.write(f"row {error['row']}: {json.dumps(error['errors'])}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {importer.imported} products, "
+                f"{len(importer.errors)} rows rejected"
+            )
+        )
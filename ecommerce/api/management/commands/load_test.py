@@ -0,0 +1,123 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+
+
+async def fetch(reader, writer, host, path, headers):
+    request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\n{headers}\r\n"
+    writer.write(request.encode())
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+    length, chunked, close = 0, False, False
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        name, value = name.strip().lower(), value.strip().lower()
+        if name == "content-length":
+            length = int(value)
+        elif name == "transfer-encoding":
+            chunked = "chunked" in value
+        elif name == "connection":
+            close = value == "close"
+    if chunked:
+        while size := int((await reader.readline()).split(b";")[0], 16):
+            await reader.readexactly(size + 2)
+        await reader.readline()
+    else:
+        await reader.readexactly(length)
+    return status, close
+
+
+def percentile(timings, fraction):
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test one or more running servers with keep-alive connections, "
+        "e.g. the WSGI and the ASGI deployment side by side, and report "
+        "throughput and latency percentiles for each"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("servers", nargs="+", help="e.g. http://127.0.0.1:8000")
+        parser.add_argument(
+            "--path",
+            action="append",
+            dest="paths",
+            help="path to request, repeatable (default /api/products/)",
+        )
+        parser.add_argument("--concurrency", type=int, default=200)
+        parser.add_argument("--requests", type=int, default=10000)
+        parser.add_argument("--token", help="access token sent as a Bearer token")
+
+    def handle(self, *args, **options):
+        paths = options["paths"] or ["/api/products/"]
+        headers = ""
+        if options["token"]:
+            headers = f"Authorization: Bearer {options['token']}\r\n"
+        for server in options["servers"]:
+            url = urlsplit(server)
+            if url.scheme != "http" or not url.hostname:
+                raise CommandError(f"{server} is not an http:// URL")
+            for path in paths:
+                result = asyncio.run(
+                    self.run(
+                        url.hostname,
+                        url.port or 80,
+                        path,
+                        headers,
+                        options["concurrency"],
+                        options["requests"],
+                    )
+                )
+                self.report(server, path, options["concurrency"], *result)
+
+    async def run(self, hostname, port, path, headers, concurrency, total):
+        host = f"{hostname}:{port}"
+        remaining = [total]
+        timings, errors = [], []
+
+        async def worker():
+            connection = None
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                started = time.perf_counter()
+                try:
+                    if connection is None:
+                        connection = await asyncio.open_connection(hostname, port)
+                    status, close = await fetch(*connection, host, path, headers)
+                except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+                    errors.append(type(e).__name__)
+                    connection = None
+                    continue
+                if status >= 400:
+                    errors.append(str(status))
+                else:
+                    timings.append(time.perf_counter() - started)
+                if close:
+                    connection[1].close()
+                    connection = None
+            if connection is not None:
+                connection[1].close()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - started, sorted(timings), errors
+
+    def report(self, server, path, concurrency, elapsed, timings, errors):
+        line = (
+            f"{server}{path} at {concurrency} connections: "
+            f"{len(timings) / elapsed:.0f} req/s"
+        )
+        if timings:
+            line += ", " + ", ".join(
+                f"p{int(fraction * 100)} {percentile(timings, fraction) * 1000:.1f}ms"
+                for fraction in (0.5, 0.95, 0.99)
+            )
+        if errors:
+            line += f", {len(errors)} errors ({', '.join(sorted(set(errors)))})"
+        self.stdout.write(line)
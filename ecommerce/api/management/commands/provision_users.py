@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.catalog_io import UnreadableRow, read_rows
+from api.services import Registration
+
+FIELDS = ["email", "first_name", "last_name", "password"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Create users with their referral codes and wallets from a CSV or JSON "
+        "lines file of email, first_name, last_name and optional password"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["csv", "jsonl"])
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        format = options["format"] or options["path"].rsplit(".", 1)[-1]
+        if format not in ("csv", "jsonl"):
+            raise CommandError("Pass --format csv or --format jsonl")
+
+        with open(options["path"], "rb") as stream:
+            created, skipped = Registration.provision(
+                self.users(read_rows(stream, format)),
+                batch_size=options["batch_size"],
+            )
+
+        for email in skipped:
+            self.stderr.write(f"{email}: already registered")
+        self.stdout.write(
+            self.style.SUCCESS(f"Created {created} users, skipped {len(skipped)}")
+        )
+
+    def users(self, rows):
+        for number, row in enumerate(rows, 1):
+            if isinstance(row, UnreadableRow):
+                self.stderr.write(f"row {number}: {row.error}")
+            else:
+                yield {field: row[field] for field in FIELDS if row.get(field)}
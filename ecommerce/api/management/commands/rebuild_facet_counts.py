@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from api.facets import FacetCounter
+
+
+class Command(BaseCommand):
+    help = "Recompute the precomputed catalog facet counts from the products"
+
+    def handle(self, *args, **options):
+        rows = FacetCounter.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} facet counts"))
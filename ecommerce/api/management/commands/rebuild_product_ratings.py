@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from api.services import RatingAggregate
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored rating aggregates of products from their reviews"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "products", nargs="*", type=int, help="product ids, all when omitted"
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rebuilt = RatingAggregate.rebuild(
+            product_ids=options["products"] or None,
+            batch_size=options["batch_size"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt ratings of {rebuilt} products"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from api.search import search_backend
+
+
+class Command(BaseCommand):
+    help = "Recompute the search index of products"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "products", nargs="*", type=int, help="product ids, all when omitted"
+        )
+
+    def handle(self, *args, **options):
+        indexed = search_backend().index(options["products"] or None)
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} products"))
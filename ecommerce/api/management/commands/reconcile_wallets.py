@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from api.services import WalletLedger
+
+
+class Command(BaseCommand):
+    help = "Recompute every wallet's cached balance from its ledger entries"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="only report the wallets whose balance disagrees with the ledger",
+        )
+
+    def handle(self, *args, **options):
+        for wallet in WalletLedger.drifted().select_related("user"):
+            self.stdout.write(
+                f"{wallet.user.email}: balance {wallet.credits}, ledger {wallet.ledger}"
+            )
+        if not options["dry_run"]:
+            wallets = WalletLedger.reconcile()
+            self.stdout.write(self.style.SUCCESS(f"Reconciled {wallets} wallets"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from api.models import StockHold
+from api.services import StockReservation
+
+
+class Command(BaseCommand):
+    help = "Release stock held by cart items whose hold has expired"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--reconcile",
+            action="store_true",
+            help="also recompute the reserved stock of every product from its holds",
+        )
+
+    def handle(self, *args, **options):
+        released = StockReservation.release(
+            StockHold.objects.filter(expires_at__lte=timezone.now()),
+            batch_size=options["batch_size"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Released {released} expired holds"))
+
+        if options["reconcile"]:
+            products = StockReservation.reconcile()
+            self.stdout.write(
+                self.style.SUCCESS(f"Reconciled reserved stock of {products} products")
+            )
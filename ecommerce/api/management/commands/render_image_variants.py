@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from api.images import image_pipeline
+from api.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the resized variants of product images that have none, or "
+        "were made from another image, on the image workers"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="render every product again, e.g. after changing IMAGE_VARIANTS",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        pipeline = image_pipeline()
+        products = (
+            Product.objects.exclude(image="")
+            .only("pk", "image", "image_variants")
+            .order_by("pk")
+            .iterator(chunk_size=options["batch_size"])
+        )
+        batch, rendered = [], 0
+        for product in products:
+            if options["all"] or pipeline.stale(product):
+                batch.append(product.pk)
+            if len(batch) == options["batch_size"]:
+                rendered += pipeline.run(batch)
+                batch = []
+        rendered += pipeline.run(batch)
+        self.stdout.write(f"Rendered the image variants of {rendered} products")
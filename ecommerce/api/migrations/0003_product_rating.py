@@ -0,0 +1,56 @@
+# Generated by Django 5.0.6 on 2026-10-17 04:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_ratings(apps, schema_editor):
+    Product = apps.get_model("api", "Product")
+    ProductRating = apps.get_model("api", "ProductRating")
+    stars = {
+        f"star_{i}": models.Count("reviews", filter=models.Q(reviews__rating=i))
+        for i in range(1, 6)
+    }
+    rows = Product.objects.annotate(
+        review_count=models.Count("reviews"),
+        review_total=models.Sum("reviews__rating"),
+        **stars,
+    ).values("pk", "review_count", "review_total", *stars)
+    ProductRating.objects.bulk_create(
+        (
+            ProductRating(
+                product_id=row["pk"],
+                count=row["review_count"],
+                total=row["review_total"] or 0,
+                average=(row["review_total"] or 0) / (row["review_count"] or 1),
+                **{name: row[name] for name in stars},
+            )
+            for row in rows.iterator(chunk_size=1000)
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_alter_category_options_alter_customuser_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRating',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating', serialize=False, to='api.product')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('average', models.FloatField(default=0.0)),
+                ('star_1', models.PositiveIntegerField(default=0)),
+                ('star_2', models.PositiveIntegerField(default=0)),
+                ('star_3', models.PositiveIntegerField(default=0)),
+                ('star_4', models.PositiveIntegerField(default=0)),
+                ('star_5', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.6 on 2026-10-17 04:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_product_rating'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='reserved',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='StockHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('cart_item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='hold', to='api.cartitem')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='api.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires_at'], name='api_stockho_expires_9dd5f4_idx'), models.Index(fields=['product', 'expires_at'], name='api_stockho_product_653aa2_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.0.6 on 2026-10-17 04:11
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+search_gin = django.contrib.postgres.indexes.GinIndex(
+    fields=["search_vector"], name="api_product_search_gin"
+)
+name_trgm = django.contrib.postgres.indexes.GinIndex(
+    fields=["name"], name="api_product_name_trgm", opclasses=["gin_trgm_ops"]
+)
+
+
+# GIN indexes and the search vector only exist on PostgreSQL; other databases
+# search through the in-process index of api.search.
+def add_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    Product = apps.get_model("api", "Product")
+    schema_editor.add_index(Product, search_gin)
+    schema_editor.add_index(Product, name_trgm)
+    Product.objects.update(
+        search_vector=django.contrib.postgres.search.SearchVector(
+            "name", weight="A", config="english"
+        )
+        + django.contrib.postgres.search.SearchVector(
+            "description", weight="B", config="english"
+        )
+    )
+
+
+def remove_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    Product = apps.get_model("api", "Product")
+    schema_editor.remove_index(Product, name_trgm)
+    schema_editor.remove_index(Product, search_gin)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_order_keyset_indexes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name='product', index=search_gin),
+                migrations.AddIndex(model_name='product', index=name_trgm),
+            ],
+            database_operations=[
+                migrations.RunPython(add_search_indexes, remove_search_indexes),
+            ],
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.0.6 on 2026-10-17 04:12
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+# the facets as they were defined when this migration was written
+PRICE_BUCKETS = [
+    ("0-25", Decimal(0), Decimal(25)),
+    ("25-50", Decimal(25), Decimal(50)),
+    ("50-100", Decimal(50), Decimal(100)),
+    ("100-250", Decimal(100), Decimal(250)),
+    ("250+", Decimal(250), None),
+]
+RATING_BANDS = [("4-5", 4), ("3-4", 3), ("2-3", 2), ("1-2", 1)]
+
+
+def backfill_facet_counts(apps, schema_editor):
+    Product = apps.get_model("api", "Product")
+    FacetCount = apps.get_model("api", "FacetCount")
+
+    conditions = {
+        ("availability", "in_stock"): Q(is_available=True),
+        ("availability", "out_of_stock"): Q(is_available=False),
+        ("rating", "unrated"): Q(rating__isnull=True) | Q(rating__count=0),
+    }
+    for label, low, high in PRICE_BUCKETS:
+        condition = Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        conditions[("price", label)] = condition
+    upper = None
+    for label, low in RATING_BANDS:
+        condition = Q(rating__count__gt=0)
+        if label != RATING_BANDS[-1][0]:
+            condition &= Q(rating__average__gte=low)
+        if upper is not None:
+            condition &= Q(rating__average__lt=upper)
+        conditions[("rating", label)] = condition
+        upper = low
+
+    products = Product.objects.order_by()
+    totals = products.aggregate(
+        **{
+            f"facet_{i}": Count("pk", filter=condition)
+            for i, condition in enumerate(conditions.values())
+        }
+    )
+    counts = {key: totals[f"facet_{i}"] for i, key in enumerate(conditions)}
+    for category_id, count in products.values_list("category_id").annotate(
+        count=Count("pk")
+    ):
+        counts[("category", str(category_id) if category_id else "none")] = count
+    FacetCount.objects.bulk_create(
+        FacetCount(facet=facet, value=value, count=count)
+        for (facet, value), count in counts.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_product_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(max_length=20)),
+                ('value', models.CharField(max_length=50)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='facetcount',
+            constraint=models.UniqueConstraint(fields=('facet', 'value'), name='unique_facet_value'),
+        ),
+        migrations.RunPython(backfill_facet_counts, migrations.RunPython.noop),
+    ]
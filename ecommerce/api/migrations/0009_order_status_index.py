@@ -0,0 +1,19 @@
+# Generated by Django 5.0.6 on 2026-10-17 04:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0008_product_sku"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["status", "-created_at"], name="api_order_status_f9da42_idx"
+            ),
+        ),
+    ]
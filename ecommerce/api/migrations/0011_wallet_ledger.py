@@ -0,0 +1,68 @@
+# Generated by Django 5.0.6 on 2026-10-17 04:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def open_ledgers(apps, schema_editor):
+    # existing balances become each wallet's first ledger entry
+    Wallet = apps.get_model("api", "Wallet")
+    WalletEntry = apps.get_model("api", "WalletEntry")
+    WalletEntry.objects.bulk_create(
+        (
+            WalletEntry(wallet_id=pk, amount=credits, reason="opening balance")
+            for pk, credits in Wallet.objects.exclude(credits=0)
+            .values_list("pk", "credits")
+            .iterator(chunk_size=1000)
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0010_outbox"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="wallet",
+            name="credits",
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.CreateModel(
+            name="WalletEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("amount", models.DecimalField(decimal_places=2, max_digits=12)),
+                ("reason", models.CharField(max_length=50)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "wallet",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="entries",
+                        to="api.wallet",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["wallet", "created_at"],
+                        name="api_wallete_wallet__c2ec44_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(open_ledgers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-17 04:25
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0011_wallet_ledger"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ClaimsUser",
+            fields=[],
+            options={
+                "proxy": True,
+                "indexes": [],
+                "constraints": [],
+            },
+            bases=("api.customuser",),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.6 on 2026-10-17 04:27
+
+from django.db import migrations, models
+
+# prune_tokens deletes outstanding tokens by expiry; the table belongs to
+# simplejwt's token_blacklist app, so its index is added from here.
+expires_at = models.Index(fields=["expires_at"], name="api_outstanding_expires_idx")
+
+
+def add_expiry_index(apps, schema_editor):
+    OutstandingToken = apps.get_model("token_blacklist", "OutstandingToken")
+    schema_editor.add_index(OutstandingToken, expires_at)
+
+
+def remove_expiry_index(apps, schema_editor):
+    OutstandingToken = apps.get_model("token_blacklist", "OutstandingToken")
+    schema_editor.remove_index(OutstandingToken, expires_at)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0012_claims_user"),
+        ("token_blacklist", "0012_alter_outstandingtoken_user"),
+    ]
+
+    operations = [
+        migrations.RunPython(add_expiry_index, remove_expiry_index),
+    ]
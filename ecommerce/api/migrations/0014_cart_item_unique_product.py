@@ -0,0 +1,46 @@
+# Generated by Django 5.0.6 on 2026-10-17 04:38
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+
+def merge_duplicate_items(apps, schema_editor):
+    # repeated products of a cart become its oldest item, holding what the
+    # duplicates held, so Product.reserved stays right
+    CartItem = apps.get_model("api", "CartItem")
+    StockHold = apps.get_model("api", "StockHold")
+    duplicates = (
+        CartItem.objects.values("cart", "product")
+        .annotate(count=Count("pk"), keep=Min("pk"), quantity=Sum("quantity"))
+        .filter(count__gt=1)
+    )
+    for row in duplicates.iterator():
+        items = CartItem.objects.filter(cart=row["cart"], product=row["product"])
+        CartItem.objects.filter(pk=row["keep"]).update(quantity=row["quantity"])
+        holds = StockHold.objects.filter(cart_item__in=items)
+        held = holds.aggregate(quantity=Sum("quantity"), expires_at=Max("expires_at"))
+        hold = holds.order_by("cart_item_id").first()
+        if hold is not None:
+            holds.exclude(pk=hold.pk).delete()
+            hold.cart_item_id = row["keep"]
+            hold.quantity = held["quantity"]
+            hold.expires_at = held["expires_at"]
+            hold.save()
+        items.exclude(pk=row["keep"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0013_outstanding_token_expiry"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="cartitem",
+            constraint=models.UniqueConstraint(
+                fields=("cart", "product"), name="api_cartitem_unique_product"
+            ),
+        ),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 5.0.6 on 2026-10-17 04:46
+
+from decimal import Decimal
+from itertools import islice
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 1000
+
+
+def backfill_totals(apps, schema_editor):
+    # the totals of existing orders from their items, then every user's
+    # summary from the totals; backfill_order_totals repeats both
+    Order = apps.get_model("api", "Order")
+    OrderItem = apps.get_model("api", "OrderItem")
+    OrderSummary = apps.get_model("api", "OrderSummary")
+    CustomUser = apps.get_model("api", "CustomUser")
+
+    items = OrderItem.objects.filter(order=OuterRef("pk")).values("order")
+    total = items.annotate(
+        total=Sum(F("price") * F("quantity"), output_field=models.DecimalField())
+    ).values("total")
+    item_count = items.annotate(count=Sum("quantity")).values("count")
+    last_id = 0
+    while ids := list(
+        Order.objects.filter(pk__gt=last_id)
+        .order_by("pk")
+        .values_list("pk", flat=True)[:BATCH_SIZE]
+    ):
+        Order.objects.filter(pk__in=ids).update(
+            total=Coalesce(Subquery(total), Value(Decimal(0))),
+            item_count=Coalesce(Subquery(item_count), 0),
+        )
+        last_id = ids[-1]
+
+    counted = ~Q(orders__status="Cancelled")
+    rows = (
+        CustomUser.objects.order_by("pk")
+        .annotate(
+            order_count=Count("orders", filter=counted),
+            item_count=Coalesce(Sum("orders__item_count", filter=counted), 0),
+            lifetime_spend=Coalesce(
+                Sum("orders__total", filter=counted), Value(Decimal(0))
+            ),
+            last_order_at=Max("orders__created_at", filter=counted),
+        )
+        .values("pk", "order_count", "item_count", "lifetime_spend", "last_order_at")
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+    while batch := list(islice(rows, BATCH_SIZE)):
+        OrderSummary.objects.bulk_create(
+            [OrderSummary(user_id=row.pop("pk"), **row) for row in batch]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0014_cart_item_unique_product"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OrderSummary",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="order_summary",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("order_count", models.PositiveIntegerField(default=0)),
+                ("item_count", models.PositiveIntegerField(default=0)),
+                (
+                    "lifetime_spend",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                ("last_order_at", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="item_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="total",
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.0.6 on 2026-10-17 04:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def drop_duplicate_reviews(apps, schema_editor):
+    # a user keeps their latest review of a product; the ratings of the
+    # products that lose reviews are counted again
+    Review = apps.get_model("api", "Review")
+    ProductRating = apps.get_model("api", "ProductRating")
+    duplicates = (
+        Review.objects.values("user", "product")
+        .annotate(count=models.Count("pk"), keep=models.Max("pk"))
+        .filter(count__gt=1)
+    )
+    products = set()
+    for row in duplicates.iterator():
+        Review.objects.filter(user=row["user"], product=row["product"]).exclude(
+            pk=row["keep"]
+        ).delete()
+        products.add(row["product"])
+    for product_id in products:
+        reviews = Review.objects.filter(product_id=product_id)
+        stars = {
+            f"star_{i}": models.Count("pk", filter=models.Q(rating=i))
+            for i in range(1, 6)
+        }
+        row = reviews.aggregate(
+            count=models.Count("pk"), total=models.Sum("rating"), **stars
+        )
+        total = row.pop("total") or 0
+        ProductRating.objects.update_or_create(
+            product_id=product_id,
+            defaults={"total": total, "average": total / (row["count"] or 1), **row},
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0015_order_totals_and_summaries"),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_reviews, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="review",
+            constraint=models.UniqueConstraint(
+                fields=("user", "product"), name="api_review_unique_user_product"
+            ),
+        ),
+        # led by the user, the constraint serves the foreign key
+        migrations.AlterField(
+            model_name="review",
+            name="user",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="reviews",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
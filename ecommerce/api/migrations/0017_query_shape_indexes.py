@@ -0,0 +1,107 @@
+# Generated by Django 5.0.6 on 2026-10-17 04:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+indexes = {
+    "orderitem": [
+        models.Index(
+            fields=["order", "product"], name="api_orderit_order_i_faeaf1_idx"
+        ),
+    ],
+    "outboxmessage": [
+        models.Index(
+            condition=models.Q(status="Pending"),
+            fields=["next_attempt_at"],
+            name="api_outbox_pending_idx",
+        ),
+    ],
+    "product": [
+        models.Index(
+            fields=["category", "price", "id"], name="api_product_categor_2c3379_idx"
+        ),
+        models.Index(fields=["price", "id"], name="api_product_price_c2511f_idx"),
+    ],
+}
+
+
+def each_index(apps):
+    for model_name, model_indexes in indexes.items():
+        for index in model_indexes:
+            yield apps.get_model("api", model_name), index
+
+
+# Built without locking out writes on PostgreSQL, which cannot do that in a
+# transaction, hence a non-atomic migration. The indexes they supersede are
+# only dropped once they exist.
+def add_indexes(apps, schema_editor):
+    options = {}
+    if schema_editor.connection.vendor == "postgresql":
+        options["concurrently"] = True
+    for model, index in each_index(apps):
+        schema_editor.add_index(model, index, **options)
+
+
+def remove_indexes(apps, schema_editor):
+    options = {}
+    if schema_editor.connection.vendor == "postgresql":
+        options["concurrently"] = True
+    for model, index in each_index(apps):
+        schema_editor.remove_index(model, index, **options)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("api", "0016_review_unique_user_product"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(add_indexes, remove_indexes)],
+            state_operations=[
+                migrations.AddIndex(model_name=model_name, index=index)
+                for model_name, model_indexes in indexes.items()
+                for index in model_indexes
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name="outboxmessage",
+            name="api_outboxm_status_f462dd_idx",
+        ),
+        # each now leads a composite index or unique constraint
+        migrations.AlterField(
+            model_name="cartitem",
+            name="cart",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="items",
+                to="api.cart",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="orderitem",
+            name="order",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="order_items",
+                to="api.order",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="product",
+            name="category",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="products",
+                to="api.category",
+            ),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.0.6 on 2026-10-17 04:55
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from itertools import islice
+from django.db import migrations, models
+
+
+def record_delivered_products(apps, schema_editor):
+    # dated by their first delivered order, the time it was placed
+    OrderItem = apps.get_model("api", "OrderItem")
+    PurchasedProduct = apps.get_model("api", "PurchasedProduct")
+    rows = (
+        OrderItem.objects.filter(order__status="Delivered")
+        .values("order__user", "product")
+        .annotate(delivered_at=models.Min("order__created_at"))
+        .order_by()
+        .iterator(chunk_size=1000)
+    )
+    while batch := list(islice(rows, 1000)):
+        PurchasedProduct.objects.bulk_create(
+            PurchasedProduct(
+                user_id=row["order__user"],
+                product_id=row["product"],
+                delivered_at=row["delivered_at"],
+            )
+            for row in batch
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0017_query_shape_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PurchasedProduct",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "delivered_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="purchases",
+                        to="api.product",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="purchases",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="purchasedproduct",
+            constraint=models.UniqueConstraint(
+                fields=("user", "product"), name="api_purchasedproduct_unique"
+            ),
+        ),
+        migrations.RunPython(record_delivered_products, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.6 on 2026-10-17 05:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0019_product_image_variants"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="outboxmessage",
+            name="dedupe_key",
+            field=models.CharField(max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name="outboxmessage",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("status", "Pending")),
+                fields=("dedupe_key",),
+                name="api_outbox_pending_dedupe",
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.6 on 2026-10-17 05:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0020_outbox_pending_dedupe"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="facetcount",
+            name="unique_facet_value",
+        ),
+        migrations.AddField(
+            model_name="facetcount",
+            name="slot",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name="facetcount",
+            constraint=models.UniqueConstraint(
+                fields=("facet", "value", "slot"), name="unique_facet_value_slot"
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.6 on 2026-10-17 05:49
+
+from django.db import migrations, models
+
+index = models.Index(fields=["user", "-id"], name="api_order_user_id_ff346f_idx")
+
+
+# Built without locking out writes on PostgreSQL, which cannot do that in a
+# transaction, hence a non-atomic migration.
+def add_index(apps, schema_editor):
+    options = {}
+    if schema_editor.connection.vendor == "postgresql":
+        options["concurrently"] = True
+    schema_editor.add_index(apps.get_model("api", "order"), index, **options)
+
+
+def remove_index(apps, schema_editor):
+    options = {}
+    if schema_editor.connection.vendor == "postgresql":
+        options["concurrently"] = True
+    schema_editor.remove_index(apps.get_model("api", "order"), index, **options)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("api", "0021_facet_count_slots"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(add_index, remove_index)],
+            state_operations=[migrations.AddIndex(model_name="order", index=index)],
+        ),
+    ]
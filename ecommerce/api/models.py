@@ -1,6 +1,9 @@
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 import secrets
 
 
@@ -41,6 +44,28 @@ class CustomUser(AbstractBaseUser):
         ordering = ["email"]
 
 
+class ClaimsUser(CustomUser):
+    """A user built from the claims of an access token, see
+    api.authentication.ClaimsJWTAuthentication. Only the claimed fields are
+    set; the others are loaded together, through the user cache, the first
+    time one of them is read."""
+
+    class Meta:
+        proxy = True
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        from .authentication import user_values
+
+        deferred = self.get_deferred_fields()
+        if fields is None or not deferred.issuperset(fields):
+            return super().refresh_from_db(using, fields, from_queryset)
+        values = user_values(self.pk)
+        if values is None:
+            raise CustomUser.DoesNotExist("User matching query does not exist.")
+        for name in deferred:
+            setattr(self, name, values[name])
+
+
 class ReferralCode(models.Model):
 
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
@@ -72,7 +97,21 @@ class Referral(models.Model):
 class Wallet(models.Model):
 
     user = models.OneToOneField(CustomUser, on_delete=models.DO_NOTHING)
-    credits = models.FloatField(default=0.0)
+    # cached sum of the wallet's ledger entries
+    credits = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+
+class WalletEntry(models.Model):
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name="entries")
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    reason = models.CharField(max_length=50)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.amount} to wallet {self.wallet_id} ({self.reason})"
+
+    class Meta:
+        indexes = [models.Index(fields=["wallet", "created_at"])]
 
 
 class Category(models.Model):
@@ -86,10 +125,13 @@ class Category(models.Model):
 
 
 class Product(models.Model):
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=200)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     description = models.TextField()
     image = models.ImageField(upload_to="images/")
+    # the resized copies of the image, see api.images
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_available = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
@@ -99,8 +141,15 @@ class Product(models.Model):
         blank=True,
         null=True,
         on_delete=models.SET_NULL,
+        db_index=False,
     )
     quantity = models.PositiveIntegerField(default=1)
+    reserved = models.PositiveIntegerField(default=0)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    @property
+    def available_quantity(self):
+        return max(self.quantity - self.reserved, 0)
 
     def save(self, *args, **kwargs):
         if self.quantity == 0:
@@ -111,17 +160,48 @@ class Product(models.Model):
 
     class Meta:
         ordering = ["name"]
+        indexes = [
+            GinIndex(fields=["search_vector"], name="api_product_search_gin"),
+            GinIndex(
+                fields=["name"],
+                name="api_product_name_trgm",
+                opclasses=["gin_trgm_ops"],
+            ),
+            # ProductFilter's category and price filters, in list order; the
+            # first also serves the category foreign key
+            models.Index(fields=["category", "price", "id"]),
+            models.Index(fields=["price", "id"]),
+        ]
 
     def __str__(self):
         return self.name
 
 
+class CartQuerySet(models.QuerySet):
+    def with_items(self):
+        return self.prefetch_related(
+            models.Prefetch(
+                "items", queryset=CartItem.objects.select_related("product")
+            )
+        ).annotate(
+            total_value=Coalesce(
+                models.Sum(
+                    models.F("items__product__price") * models.F("items__quantity"),
+                    output_field=models.DecimalField(max_digits=12, decimal_places=2),
+                ),
+                models.Value(0, output_field=models.DecimalField()),
+            )
+        )
+
+
 class Cart(models.Model):
     user = models.OneToOneField(
         CustomUser, on_delete=models.CASCADE, related_name="cart"
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CartQuerySet.as_manager()
+
     def __str__(self):
         return f"Cart of {self.user.email}"
 
@@ -130,7 +210,9 @@ class Cart(models.Model):
 
 
 class CartItem(models.Model):
-    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="items")
+    cart = models.ForeignKey(
+        Cart, on_delete=models.CASCADE, related_name="items", db_index=False
+    )
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     added_at = models.DateTimeField(auto_now_add=True)
@@ -140,6 +222,38 @@ class CartItem(models.Model):
 
     class Meta:
         ordering = ["-added_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["cart", "product"], name="api_cartitem_unique_product"
+            )
+        ]
+
+
+class StockHold(models.Model):
+    cart_item = models.OneToOneField(
+        CartItem, on_delete=models.CASCADE, related_name="hold"
+    )
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="holds")
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Hold of {self.quantity} x {self.product_id} until {self.expires_at}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["expires_at"]),
+            models.Index(fields=["product", "expires_at"]),
+        ]
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_items(self):
+        return self.prefetch_related(
+            models.Prefetch(
+                "order_items", queryset=OrderItem.objects.select_related("product")
+            )
+        )
 
 
 class Order(models.Model):
@@ -158,17 +272,28 @@ class Order(models.Model):
         ],
         default="Pending",
     )
+    # stored at checkout, and by migration 0015 for older orders
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
+
+    objects = OrderQuerySet.as_manager()
 
     def __str__(self):
         return f"Order {self.id} by {self.user.email}"
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["-created_at", "-id"]),
+            models.Index(fields=["user", "-created_at", "-id"]),
+            models.Index(fields=["user", "-id"]),
+            models.Index(fields=["status", "-created_at"]),
+        ]
 
 
 class OrderItem(models.Model):
     order = models.ForeignKey(
-        Order, related_name="order_items", on_delete=models.CASCADE
+        Order, related_name="order_items", on_delete=models.CASCADE, db_index=False
     )
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
@@ -177,10 +302,53 @@ class OrderItem(models.Model):
     def __str__(self):
         return f"{self.product.name} ({self.quantity})"
 
+    class Meta:
+        indexes = [models.Index(fields=["order", "product"])]
+
+
+class OrderSummary(models.Model):
+    """Lifetime figures of a user's orders, cancelled ones left out."""
+
+    user = models.OneToOneField(
+        CustomUser,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="order_summary",
+    )
+    order_count = models.PositiveIntegerField(default=0)
+    item_count = models.PositiveIntegerField(default=0)
+    lifetime_spend = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    last_order_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Orders of {self.user_id}: {self.order_count}, {self.lifetime_spend}"
+
+
+class PurchasedProduct(models.Model):
+    """A product delivered to a user, who may then review it."""
+
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="purchases", db_index=False
+    )
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="purchases"
+    )
+    delivered_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.product_id} delivered to {self.user_id}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "product"], name="api_purchasedproduct_unique"
+            )
+        ]
+
 
 class Review(models.Model):
     user = models.ForeignKey(
-        CustomUser, on_delete=models.CASCADE, related_name="reviews"
+        CustomUser, on_delete=models.CASCADE, related_name="reviews", db_index=False
     )
     product = models.ForeignKey(
         Product, on_delete=models.CASCADE, related_name="reviews"
@@ -194,3 +362,84 @@ class Review(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "product"], name="api_review_unique_user_product"
+            )
+        ]
+
+
+class ProductRating(models.Model):
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, primary_key=True, related_name="rating"
+    )
+    count = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    average = models.FloatField(default=0.0)
+    star_1 = models.PositiveIntegerField(default=0)
+    star_2 = models.PositiveIntegerField(default=0)
+    star_3 = models.PositiveIntegerField(default=0)
+    star_4 = models.PositiveIntegerField(default=0)
+    star_5 = models.PositiveIntegerField(default=0)
+
+    def histogram(self):
+        return {str(i): getattr(self, f"star_{i}") for i in range(1, 6)}
+
+    def __str__(self):
+        return f"Rating of {self.product_id}: {self.average} ({self.count})"
+
+
+class FacetCount(models.Model):
+    facet = models.CharField(max_length=20)
+    value = models.CharField(max_length=50)
+    # a count is the sum of the rows of all its slots
+    slot = models.PositiveSmallIntegerField(default=0)
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.facet}={self.value}[{self.slot}]: {self.count}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["facet", "value", "slot"], name="unique_facet_value_slot"
+            )
+        ]
+
+
+class OutboxMessage(models.Model):
+    dedupe_key = models.CharField(max_length=64)
+    recipient = models.EmailField()
+    subject = models.CharField(max_length=200)
+    html_content = models.TextField()
+    status = models.CharField(
+        max_length=10,
+        choices=[("Pending", "Pending"), ("Sent", "Sent"), ("Failed", "Failed")],
+        default="Pending",
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.subject} to {self.recipient} ({self.status})"
+
+    class Meta:
+        # only pending messages are ever drained; sent ones pile up outside it
+        indexes = [
+            models.Index(
+                fields=["next_attempt_at"],
+                condition=models.Q(status="Pending"),
+                name="api_outbox_pending_idx",
+            )
+        ]
+        # a key is queued once at a time, and may be queued again once sent
+        constraints = [
+            models.UniqueConstraint(
+                fields=["dedupe_key"],
+                condition=models.Q(status="Pending"),
+                name="api_outbox_pending_dedupe",
+            )
+        ]
@@ -0,0 +1,107 @@
+import hashlib
+from asgiref.sync import sync_to_async
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from .mail import mail_backend
+from .models import OutboxMessage
+
+
+def message(recipient, subject, html_content, dedupe_key=None):
+    if dedupe_key is None:
+        dedupe_key = f"{recipient}\n{subject}\n{html_content}"
+    return OutboxMessage(
+        dedupe_key=hashlib.sha256(dedupe_key.encode()).hexdigest(),
+        recipient=recipient,
+        subject=subject,
+        html_content=html_content,
+    )
+
+
+def enqueue(recipient, subject, html_content, dedupe_key=None):
+    """Queue a message in the caller's transaction. A message whose
+    ``dedupe_key`` is still pending is dropped, and False returned; once it
+    was sent or failed, the same key queues a new message."""
+    try:
+        with transaction.atomic():
+            message(recipient, subject, html_content, dedupe_key).save()
+    except IntegrityError:
+        return False
+    return True
+
+
+# the savepoint that contains a duplicate needs the sync transaction API
+aenqueue = sync_to_async(enqueue)
+
+
+class OutboxWorker:
+    """Deliver due messages, claimed in batches and sent one at a time.
+
+    A batch is claimed under ``SELECT ... FOR UPDATE SKIP LOCKED`` by pushing
+    its next attempt ``lease`` into the future, so several workers can drain
+    the queue and a crashed worker's batch is retried once the lease runs
+    out. Failed messages are retried with exponential backoff until
+    ``OUTBOX_MAX_ATTEMPTS`` is reached.
+    """
+
+    lease = timedelta(minutes=5)
+
+    def __init__(self, batch_size=100):
+        self.batch_size = batch_size
+        self.backend = mail_backend()
+
+    def drain(self):
+        sent = failed = 0
+        while True:
+            batch = self.claim()
+            if not batch:
+                return sent, failed
+            delivered, undelivered = self.deliver(batch)
+            sent += delivered
+            failed += undelivered
+
+    def claim(self):
+        now = timezone.now()
+        with transaction.atomic():
+            batch = list(
+                OutboxMessage.objects.select_for_update(skip_locked=True)
+                .filter(status="Pending", next_attempt_at__lte=now)
+                .order_by("next_attempt_at")[: self.batch_size]
+            )
+            OutboxMessage.objects.filter(pk__in=[m.pk for m in batch]).update(
+                next_attempt_at=now + self.lease
+            )
+        return batch
+
+    def deliver(self, batch):
+        sent, retried = [], []
+        for message in batch:
+            try:
+                self.backend.send(message)
+            except Exception as e:
+                message.attempts += 1
+                message.last_error = str(e)
+                if message.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                    message.status = "Failed"
+                else:
+                    message.next_attempt_at = timezone.now() + self.backoff(
+                        message.attempts
+                    )
+                retried.append(message)
+            else:
+                sent.append(message.pk)
+
+        OutboxMessage.objects.filter(pk__in=sent).update(
+            status="Sent", sent_at=timezone.now(), attempts=F("attempts") + 1
+        )
+        OutboxMessage.objects.bulk_update(
+            retried, ["attempts", "last_error", "status", "next_attempt_at"]
+        )
+        return len(sent), len(retried)
+
+    def backoff(self, attempts):
+        return min(
+            settings.OUTBOX_RETRY_DELAY * 2 ** (attempts - 1), timedelta(hours=6)
+        )
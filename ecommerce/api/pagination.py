@@ -0,0 +1,95 @@
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(CursorPagination):
+    """Cursor pagination over the view's ``keyset_ordering``.
+
+    The cursor holds the value of the first ordering field only, and pages
+    past rows sharing it by offset. That field should therefore be unique,
+    and lead an index after the view's filters, so that every page is a
+    single index range scan.
+    """
+
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        return tuple(view.keyset_ordering)
+
+
+class UncountedPageNumberPagination(PageNumberPagination):
+    """Page number pagination without the ``COUNT(*)``: one extra row is
+    fetched to tell whether there is a next page."""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        try:
+            self.number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            raise NotFound(self.invalid_page_message)
+        if self.number < 1:
+            raise NotFound(self.invalid_page_message)
+
+        self.request = request
+        offset = (self.number - 1) * page_size
+        rows = list(queryset[offset : offset + page_size + 1])
+        self.has_next = len(rows) > page_size
+        return rows[:page_size]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.page_query_param, self.number + 1)
+
+    def get_previous_link(self):
+        if self.number == 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.number - 1)
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+
+class ListPagination(PageNumberPagination):
+    """Default pagination of the API.
+
+    Pages are numbered as before unless the request asks for
+    ``?pagination=cursor`` (or follows a ``cursor`` link), which switches views
+    declaring a ``keyset_ordering`` to keyset pagination, or for
+    ``?count=false``, which drops the total count.
+    """
+
+    delegate = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if getattr(view, "keyset_ordering", None) and (
+            params.get("pagination") == "cursor" or "cursor" in params
+        ):
+            self.delegate = KeysetPagination()
+        elif params.get("count") == "false":
+            self.delegate = UncountedPageNumberPagination()
+        else:
+            return super().paginate_queryset(queryset, request, view)
+        return self.delegate.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.delegate is not None:
+            return self.delegate.get_paginated_response(data)
+        return super().get_paginated_response(data)
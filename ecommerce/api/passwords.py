@@ -0,0 +1,155 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth import hashers
+from django.contrib.auth.backends import ModelBackend
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+def cost(algorithm, name, default):
+    return settings.PASSWORD_HASH_COST.get(algorithm, {}).get(name, default)
+
+
+class ScryptPasswordHasher(hashers.ScryptPasswordHasher):
+    """Scrypt with the cost taken from ``PASSWORD_HASH_COST["scrypt"]``."""
+
+    @property
+    def work_factor(self):
+        return cost("scrypt", "work_factor", 2**14)
+
+    @property
+    def block_size(self):
+        return cost("scrypt", "block_size", 8)
+
+    @property
+    def parallelism(self):
+        return cost("scrypt", "parallelism", 1)
+
+    @property
+    def maxmem(self):
+        # scrypt needs 128 * n * r * p bytes, past OpenSSL's 32MB default once
+        # the work factor is raised; this is a cap, not an allocation, and must
+        # also admit hashes made with an earlier, higher cost
+        return cost("scrypt", "maxmem", 1024**3)
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    """Argon2id (needs argon2-cffi) with the cost taken from
+    ``PASSWORD_HASH_COST["argon2"]``."""
+
+    @property
+    def time_cost(self):
+        return cost("argon2", "time_cost", 2)
+
+    @property
+    def memory_cost(self):
+        return cost("argon2", "memory_cost", 102400)
+
+    @property
+    def parallelism(self):
+        return cost("argon2", "parallelism", 8)
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return cost("pbkdf2_sha256", "iterations", 720000)
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many sign-ins at the moment, please retry shortly."
+    default_code = "hashing_busy"
+    wait = 1
+
+
+class HashingPool:
+    """Run password hashing on at most ``workers`` threads, with at most
+    ``queue`` more calls waiting, so a burst of logins or signups cannot take
+    every core of the web tier. Calls beyond that fail fast with HashingBusy
+    unless ``block`` is set.
+
+    hashlib's scrypt and PBKDF2 and argon2-cffi release the GIL while they
+    hash, so the threads run in parallel.
+    """
+
+    def __init__(self, workers=2, queue=32):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="password-hashing"
+        )
+        self.slots = threading.BoundedSemaphore(workers + queue)
+
+    def submit(self, fn, *args, block=False):
+        if not self.slots.acquire(blocking=block):
+            raise HashingBusy()
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda future: self.slots.release())
+        return future
+
+    def run(self, fn, *args, block=False):
+        return self.submit(fn, *args, block=block).result()
+
+    def map(self, fn, values):
+        """Apply ``fn`` to every value in parallel, waiting for free slots."""
+        futures = [self.submit(fn, value, block=True) for value in values]
+        return [future.result() for future in futures]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def hashing_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = HashingPool(**settings.PASSWORD_HASH_POOL)
+        return _pool
+
+
+@receiver(setting_changed)
+def reset_hashing_pool(setting, **kwargs):
+    global _pool
+    if setting == "PASSWORD_HASH_POOL":
+        with _pool_lock:
+            _pool = None
+
+
+def make_password(password):
+    return hashing_pool().run(hashers.make_password, password)
+
+
+class PooledModelBackend(ModelBackend):
+    """ModelBackend hashing in the hashing pool. The user is read and saved
+    on the request's thread; a correct password stored with another hasher or
+    an outdated cost is rehashed with the preferred one."""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # hash anyway, so unknown emails take as long as wrong passwords
+            make_password(password)
+            return
+        pool = hashing_pool()
+        correct, stale = pool.run(hashers.verify_password, password, user.password)
+        if not correct or not self.user_can_authenticate(user):
+            return
+        if stale:
+            user.password = pool.run(hashers.make_password, password, block=True)
+            user.save(update_fields=["password"])
+        return user
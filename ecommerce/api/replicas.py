@@ -0,0 +1,251 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.dispatch import receiver
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from .authentication import ClaimsJWTAuthentication
+
+# Set for the duration of a request whose reads may go to a replica; reads
+# made anywhere else (unsafe requests, commands, the outbox) stay on the
+# primary.
+_replica_reads = ContextVar("replica_reads", default=False)
+
+
+@contextmanager
+def primary_reads():
+    """Read from the primary within the block, for results that outlive the
+    request and must not carry a replica's lag with them."""
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+# Standby replay lag in seconds: 0 once everything received is replayed, so an
+# idle primary does not make its replicas look behind. NULL on a primary.
+LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+
+class Replicas:
+    """The read replicas in ``DATABASE_REPLICAS`` and their health.
+
+    Each process checks a replica at most every ``health_interval`` seconds
+    and leaves it out while it cannot be reached or replays more than
+    ``max_lag`` seconds behind the primary; with none left, reads go to the
+    primary. A user is pinned to the primary for ``pin_seconds`` after each
+    write, through the default cache, so they read their own writes.
+    """
+
+    def __init__(self, aliases, health_interval=10, max_lag=5, pin_seconds=5):
+        self.aliases = list(aliases)
+        self.health_interval = health_interval
+        self.max_lag = max_lag
+        self.pin_seconds = pin_seconds
+        self.available = list(self.aliases)
+        self.checked_at = 0
+        self._lock = threading.Lock()
+
+    def choose(self):
+        if not self.aliases:
+            return None
+        if time.monotonic() - self.checked_at > self.health_interval:
+            # one thread refreshes, the others go on with the last result
+            if self._lock.acquire(blocking=False):
+                try:
+                    self.available = [a for a in self.aliases if self.healthy(a)]
+                    self.checked_at = time.monotonic()
+                finally:
+                    self._lock.release()
+        if not self.available:
+            return None
+        return random.choice(self.available)
+
+    def healthy(self, alias):
+        try:
+            lag = self.lag(alias)
+        except DatabaseError:
+            connections[alias].close()
+            return False
+        return lag is None or lag <= self.max_lag
+
+    def lag(self, alias):
+        connection = connections[alias]
+        with connection.cursor() as cursor:
+            if connection.vendor != "postgresql":
+                cursor.execute("SELECT 1")
+                return None
+            cursor.execute(LAG_SQL)
+            lag = cursor.fetchone()[0]
+        return None if lag is None else float(lag)
+
+    def pin_key(self, user_id):
+        return f"replicas:pinned:{user_id}"
+
+    def pin(self, user_id):
+        cache.set(self.pin_key(user_id), True, self.pin_seconds)
+
+    def pinned(self, user_id):
+        return bool(cache.get(self.pin_key(user_id)))
+
+    async def apin(self, user_id):
+        await cache.aset(self.pin_key(user_id), True, self.pin_seconds)
+
+    async def apinned(self, user_id):
+        return bool(await cache.aget(self.pin_key(user_id)))
+
+
+_replicas = None
+
+
+def replicas():
+    global _replicas
+    if _replicas is None:
+        _replicas = Replicas(settings.DATABASE_REPLICAS, **settings.REPLICA_ROUTING)
+    return _replicas
+
+
+@receiver(setting_changed)
+def reset_replicas(setting, **kwargs):
+    global _replicas
+    if setting in ("DATABASE_REPLICAS", "REPLICA_ROUTING"):
+        _replicas = None
+
+
+def database_health():
+    """Reachability, and replay lag in seconds for replicas, of every
+    database."""
+    health = {}
+    for alias in [DEFAULT_DB_ALIAS, *replicas().aliases]:
+        try:
+            lag = replicas().lag(alias)
+        except DatabaseError as e:
+            connections[alias].close()
+            health[alias] = {"status": "unavailable", "error": str(e)}
+            continue
+        health[alias] = {"status": "ok"}
+        if alias != DEFAULT_DB_ALIAS:
+            health[alias]["lag"] = lag
+    return health
+
+
+class ReplicaRouter:
+    """Send reads of the catalog, reviews, carts and order history made by
+    safe-method requests to a replica. Everything else, including every
+    write and any read inside a transaction, uses the primary."""
+
+    models = {
+        "api.category",
+        "api.product",
+        "api.productrating",
+        "api.facetcount",
+        "api.review",
+        "api.cart",
+        "api.cartitem",
+        "api.order",
+        "api.orderitem",
+    }
+
+    def db_for_read(self, model, **hints):
+        if (
+            not _replica_reads.get()
+            or model._meta.label_lower not in self.models
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return replicas().choose() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # also for instances read from a replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replicas().aliases}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replicas().aliases:
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """Let safe-method requests read from the replicas unless their user
+    wrote something in the last ``pin_seconds``, and pin users to the primary
+    after each successful write."""
+
+    sync_capable = True
+    async_capable = True
+
+    authentication = ClaimsJWTAuthentication()
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not replicas().aliases:
+            return self.get_response(request)
+        safe = request.method in SAFE_METHODS
+        user_id = self.user_id(request)
+        if user_id is None and settings.SESSION_COOKIE_NAME in request.COOKIES:
+            user_id = request.user.pk
+        token = _replica_reads.set(
+            safe and (user_id is None or not replicas().pinned(user_id))
+        )
+        try:
+            response = self.get_response(request)
+        finally:
+            _replica_reads.reset(token)
+        if not safe and user_id is not None and response.status_code < 400:
+            replicas().pin(user_id)
+        return response
+
+    async def __acall__(self, request):
+        if not replicas().aliases:
+            return await self.get_response(request)
+        safe = request.method in SAFE_METHODS
+        user_id = self.user_id(request)
+        if user_id is None and settings.SESSION_COOKIE_NAME in request.COOKIES:
+            user_id = (await request.auser()).pk
+        token = _replica_reads.set(
+            safe and (user_id is None or not await replicas().apinned(user_id))
+        )
+        try:
+            response = await self.get_response(request)
+        finally:
+            _replica_reads.reset(token)
+        if not safe and user_id is not None and response.status_code < 400:
+            await replicas().apin(user_id)
+        return response
+
+    def user_id(self, request):
+        """The user id claimed by a valid access token, without a query."""
+        header = self.authentication.get_header(request)
+        raw_token = header and self.authentication.get_raw_token(header)
+        if not raw_token:
+            return None
+        try:
+            token = self.authentication.get_validated_token(raw_token)
+        except InvalidToken:
+            return None
+        return token.get(api_settings.USER_ID_CLAIM)
@@ -0,0 +1,116 @@
+import csv
+import io
+import json
+from datetime import datetime, time
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import Order
+
+ORDER_FIELDS = ["id", "user_id", "user__email", "created_at", "status"]
+ITEM_FIELDS = [
+    "order_items__product_id",
+    "order_items__product__name",
+    "order_items__quantity",
+    "order_items__price",
+]
+CSV_COLUMNS = [
+    "order_id",
+    "user_id",
+    "email",
+    "created_at",
+    "status",
+    "product_id",
+    "product_name",
+    "quantity",
+    "price",
+]
+
+
+def parse_moment(value, end_of_day=False):
+    """Parse an ISO datetime or date; a bare date covers the whole day."""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date {value!r}")
+        moment = datetime.combine(day, time.max if end_of_day else time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class OrderExporter:
+    """Stream orders with their items as NDJSON (one order per line) or CSV
+    (one item per line) in constant memory.
+
+    Orders and items are read as one LEFT JOIN ordered by order, through a
+    server-side cursor ``chunk_size`` rows at a time, and consecutive rows
+    of the same order are folded together.
+    """
+
+    def __init__(self, created_after=None, created_before=None, statuses=None):
+        orders = Order.objects.all()
+        if created_after:
+            orders = orders.filter(created_at__gte=created_after)
+        if created_before:
+            orders = orders.filter(created_at__lte=created_before)
+        if statuses:
+            orders = orders.filter(status__in=statuses)
+        self.orders = orders
+
+    def rows(self, chunk_size=2000):
+        return (
+            self.orders.order_by("created_at", "id", "order_items__id")
+            .values_list(*ORDER_FIELDS, *ITEM_FIELDS)
+            .iterator(chunk_size=chunk_size)
+        )
+
+    def orders_with_items(self):
+        current = None
+        for row in self.rows():
+            if current is None or current["id"] != row[0]:
+                if current is not None:
+                    yield current
+                current = {
+                    "id": row[0],
+                    "user": row[1],
+                    "email": row[2],
+                    "created_at": row[3].isoformat(),
+                    "status": row[4],
+                    "items": [],
+                }
+            if row[5] is not None:
+                current["items"].append(
+                    {
+                        "product": row[5],
+                        "product_name": row[6],
+                        "quantity": row[7],
+                        "price": str(row[8]),
+                    }
+                )
+        if current is not None:
+            yield current
+
+    def as_ndjson(self):
+        for order in self.orders_with_items():
+            yield json.dumps(order) + "\n"
+
+    def as_csv(self):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CSV_COLUMNS)
+        for row in self.rows():
+            writer.writerow(
+                [row[0], row[1], row[2], row[3].isoformat(), *row[4:8], row[8] or ""]
+            )
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    def stream(self, format):
+        if format == "csv":
+            return self.as_csv()
+        if format == "ndjson":
+            return self.as_ndjson()
+        raise ValueError(f"Unsupported format {format!r}")
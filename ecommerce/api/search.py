@@ -0,0 +1,240 @@
+import re
+import threading
+from bisect import bisect_left
+from django.conf import settings
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramSimilarity,
+)
+from django.core.signals import setting_changed
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Value, When
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from rest_framework.filters import BaseFilterBackend
+from .models import Product
+
+
+def tokenize(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def trigrams(token):
+    padded = f"  {token} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class PostgresSearchBackend:
+    """Full-text search on ``Product.search_vector`` (GIN indexed), with prefix
+    matching on every term, ``ts_rank`` ordering and a trigram similarity
+    fallback on the name for misspelt queries."""
+
+    config = "english"
+    vector = SearchVector("name", weight="A", config="english") + SearchVector(
+        "description", weight="B", config="english"
+    )
+
+    def search(self, queryset, term):
+        tokens = tokenize(term)
+        if not tokens:
+            return queryset.none()
+        query = SearchQuery(
+            " & ".join(f"{token}:*" for token in tokens),
+            search_type="raw",
+            config=self.config,
+        )
+        matches = queryset.filter(search_vector=query)
+        if matches.exists():
+            return matches.annotate(
+                rank=SearchRank(F("search_vector"), query)
+            ).order_by("-rank", "id")
+        return (
+            queryset.filter(name__trigram_similar=term)
+            .annotate(similarity=TrigramSimilarity("name", term))
+            .order_by("-similarity", "id")
+        )
+
+    def index(self, product_ids=None):
+        products = Product.objects.all()
+        if product_ids is not None:
+            products = products.filter(pk__in=product_ids)
+        return products.update(search_vector=self.vector)
+
+    def refresh(self, product):
+        Product.objects.filter(pk=product.pk).update(search_vector=self.vector)
+
+    def unindex(self, product_id):
+        pass
+
+
+class InvertedIndexBackend:
+    """In-process inverted index used where PostgreSQL is not available.
+
+    Tokens of the name weigh more than tokens of the description, every query
+    term matches as a prefix, and terms with no match fall back to the
+    vocabulary tokens sharing enough trigrams. The index is built from the
+    database on first use and kept current by the Product signals of this
+    process.
+    """
+
+    name_weight = 1.0
+    description_weight = 0.4
+    similarity = 0.3
+    max_results = 1000
+
+    def __init__(self):
+        self._postings = {}
+        self._documents = {}
+        self._trigrams = {}
+        self._vocabulary = []
+        self._sorted = True
+        self._built = False
+        self._lock = threading.RLock()
+
+    def search(self, queryset, term):
+        tokens = tokenize(term)
+        with self._lock:
+            self._build()
+            scores = None
+            for token in tokens:
+                matched = self._match(token)
+                if scores is None:
+                    scores = matched
+                else:
+                    scores = {
+                        pk: score + matched[pk]
+                        for pk, score in scores.items()
+                        if pk in matched
+                    }
+        if not scores:
+            return queryset.none()
+        ranked = sorted(scores, key=lambda pk: (-scores[pk], pk))[: self.max_results]
+        return (
+            queryset.filter(pk__in=ranked)
+            .annotate(
+                rank=Case(
+                    *(When(pk=pk, then=Value(i)) for i, pk in enumerate(ranked)),
+                    output_field=IntegerField(),
+                )
+            )
+            .order_by("rank")
+        )
+
+    def index(self, product_ids=None):
+        products = Product.objects.all()
+        if product_ids is not None:
+            products = products.filter(pk__in=product_ids)
+        indexed = 0
+        with self._lock:
+            for pk, name, description in products.values_list(
+                "pk", "name", "description"
+            ).iterator(chunk_size=2000):
+                self._add(pk, name, description)
+                indexed += 1
+            self._built = True
+        return indexed
+
+    def refresh(self, product):
+        with self._lock:
+            if self._built:
+                self._add(product.pk, product.name, product.description)
+
+    def unindex(self, product_id):
+        with self._lock:
+            self._remove(product_id)
+
+    def _build(self):
+        if not self._built:
+            self.index()
+        if not self._sorted:
+            self._vocabulary = sorted(self._postings)
+            self._sorted = True
+
+    def _match(self, token):
+        matched = {}
+        start = bisect_left(self._vocabulary, token)
+        for candidate in self._vocabulary[start:]:
+            if not candidate.startswith(token):
+                break
+            self._accumulate(matched, candidate)
+        if not matched:
+            for candidate in self._similar(token):
+                self._accumulate(matched, candidate)
+        return matched
+
+    def _accumulate(self, matched, token):
+        for pk, weight in self._postings.get(token, {}).items():
+            matched[pk] = max(matched.get(pk, 0), weight)
+
+    def _similar(self, token):
+        grams = trigrams(token)
+        shared = {}
+        for gram in grams:
+            for candidate in self._trigrams.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        return [
+            candidate
+            for candidate, count in shared.items()
+            if count / len(grams | trigrams(candidate)) >= self.similarity
+        ]
+
+    def _add(self, pk, name, description):
+        self._remove(pk)
+        weights = {}
+        for token in tokenize(description):
+            weights[token] = self.description_weight
+        for token in tokenize(name):
+            weights[token] = self.name_weight
+        for token, weight in weights.items():
+            if token not in self._postings:
+                self._postings[token] = {}
+                for gram in trigrams(token):
+                    self._trigrams.setdefault(gram, set()).add(token)
+            self._postings[token][pk] = weight
+        self._documents[pk] = set(weights)
+        self._sorted = False
+
+    def _remove(self, pk):
+        for token in self._documents.pop(pk, ()):
+            postings = self._postings[token]
+            postings.pop(pk, None)
+            if not postings:
+                del self._postings[token]
+                for gram in trigrams(token):
+                    self._trigrams[gram].discard(token)
+                self._sorted = False
+
+
+_backend = None
+
+
+def search_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, "PRODUCT_SEARCH_BACKEND", None)
+        if path:
+            _backend = import_string(path)()
+        elif connection.vendor == "postgresql":
+            _backend = PostgresSearchBackend()
+        else:
+            _backend = InvertedIndexBackend()
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_search_backend(setting, **kwargs):
+    global _backend
+    if setting == "PRODUCT_SEARCH_BACKEND":
+        _backend = None
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    search_param = "search"
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, "").strip()
+        if not term:
+            return queryset
+        return search_backend().search(queryset, term)
@@ -1,13 +1,14 @@
 from rest_framework import serializers
 from .models import *
 import re
-from rest_framework_simplejwt.tokens import RefreshToken
+from decimal import Decimal
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
-from django.core.exceptions import ObjectDoesNotExist
-from .services import CreateReferral, SendReferral
+from .authentication import tokens_for
+from .images import variant_urls
+from .services import Registration, RegistrationError, SendReferral, ShoppingCart
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -56,33 +57,26 @@ class RegisterSerializer(serializers.ModelSerializer):
         return value
 
     def create(self, validated_data):
-        referral_code = validated_data.pop("referral_code", None)
-        referred_by = None
-        if referral_code:
-            try:
-                referred_by = ReferralCode.objects.get(code=referral_code).user
-            except ObjectDoesNotExist:
-                raise serializers.ValidationError("please enter correct referral code")
-        password = validated_data.pop("password")
-        user = CustomUser.objects.create(**validated_data)
-        user.set_password(password)
-        user.save()
-        if referred_by:
-            referral = CreateReferral(referred_by=referred_by, referred_to=user)
-            referral.new_referral()
-            for value in (referred_by, user):
-                wallet = Wallet.objects.get(user=value)
-                wallet.credits += 100
-                wallet.save()
-        return user
+        try:
+            return Registration.register(**validated_data)
+        except RegistrationError as e:
+            raise serializers.ValidationError(str(e))
 
 
 class WalletSerializer(serializers.ModelSerializer):
+    # a JSON number, as when the balance was a float
+    credits = serializers.DecimalField(
+        max_digits=12, decimal_places=2, coerce_to_string=False, read_only=True
+    )
+
     class Meta:
         model = Wallet
         fields = ["credits"]
 
 
+REFERRAL_PENDING = "A referral to this address is already waiting to be sent."
+
+
 class ReferralCodeSerializer(serializers.ModelSerializer):
     to_email = serializers.EmailField(write_only=True)
 
@@ -96,7 +90,8 @@ class ReferralCodeSerializer(serializers.ModelSerializer):
         current_user = self.context["request"].user
         code = ReferralCode.objects.get(user=current_user).code
         sendReferral = SendReferral(mail_id=to_email, referral_code=code)
-        sendReferral.send_referral_mail()
+        if not sendReferral.send_referral_mail():
+            raise serializers.ValidationError({"to_email": [REFERRAL_PENDING]})
         return validated_data
 
 
@@ -118,7 +113,10 @@ class LoginSerializer(TokenObtainPairSerializer):
         else:
             raise serializers.ValidationError('Must include "email" and "password"')
 
-        refresh = RefreshToken.for_user(user)
+        cart_token = self.context["request"].headers.get("X-Cart-Token")
+        if cart_token:
+            ShoppingCart(user).merge_guest(cart_token)
+        refresh = tokens_for(user)
 
         return {
             "refresh": str(refresh),
@@ -153,6 +151,7 @@ class ReviewSerializer(serializers.ModelSerializer):
 
 class ProductSerializer(serializers.ModelSerializer):
     average_rating = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
@@ -162,6 +161,7 @@ class ProductSerializer(serializers.ModelSerializer):
             "price",
             "description",
             "image",
+            "image_variants",
             "is_available",
             "quantity",
             "created_at",
@@ -170,15 +170,42 @@ class ProductSerializer(serializers.ModelSerializer):
             "average_rating",
         ]
 
+    def get_image_variants(self, obj):
+        return variant_urls(obj, self.context.get("request"))
+
     def get_average_rating(self, obj):
-        reviews = Review.objects.filter(product=obj)
-        if reviews.exists():
-            return reviews.aggregate(average=models.Avg("rating"))["average"]
-        return 0
+        try:
+            return obj.rating.average
+        except ProductRating.DoesNotExist:
+            return 0
+
+
+class ProductImportSerializer(serializers.ModelSerializer):
+    category = serializers.CharField(required=False, allow_blank=True, max_length=200)
+    image = serializers.CharField(required=False, allow_blank=True, max_length=100)
+
+    class Meta:
+        model = Product
+        fields = [
+            "sku",
+            "name",
+            "price",
+            "description",
+            "image",
+            "quantity",
+            "category",
+        ]
+        # rows upsert on sku, so an existing sku is not an error
+        extra_kwargs = {
+            "sku": {"required": True, "allow_null": False, "validators": []}
+        }
 
 
 class ProductDetailSerializer(serializers.ModelSerializer):
     average_rating = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
+    available_quantity = serializers.IntegerField(read_only=True)
+    rating_histogram = serializers.SerializerMethodField()
     reviews = ReviewSerializer(many=True, read_only=True)
 
     class Meta:
@@ -189,20 +216,32 @@ class ProductDetailSerializer(serializers.ModelSerializer):
             "price",
             "description",
             "image",
+            "image_variants",
             "is_available",
             "quantity",
+            "available_quantity",
             "created_at",
             "modified_at",
             "category",
             "average_rating",
+            "rating_histogram",
             "reviews",
         ]
 
+    def get_image_variants(self, obj):
+        return variant_urls(obj, self.context.get("request"))
+
     def get_average_rating(self, obj):
-        reviews = Review.objects.filter(product=obj)
-        if reviews.exists():
-            return reviews.aggregate(average=models.Avg("rating"))["average"]
-        return 0
+        try:
+            return obj.rating.average
+        except ProductRating.DoesNotExist:
+            return 0
+
+    def get_rating_histogram(self, obj):
+        try:
+            return obj.rating.histogram()
+        except ProductRating.DoesNotExist:
+            return {str(i): 0 for i in range(1, 6)}
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -236,6 +275,38 @@ class CartItemSerializer(serializers.ModelSerializer):
         read_only_fields = ["added_at"]
 
 
+class CartChangeSerializer(serializers.Serializer):
+    """One change of a cart batch: ``add`` units of a product, or set its
+    ``quantity`` (0 removes it)."""
+
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, required=False)
+    add = serializers.IntegerField(min_value=1, required=False)
+
+    def validate(self, attrs):
+        if ("quantity" in attrs) == ("add" in attrs):
+            raise serializers.ValidationError("Give either quantity or add.")
+        return attrs
+
+
+class CartBatchSerializer(serializers.Serializer):
+    items = CartChangeSerializer(many=True, allow_empty=False, max_length=500)
+
+    def validate_items(self, items):
+        products = [item["product"] for item in items]
+        if len(set(products)) != len(products):
+            raise serializers.ValidationError("A product may only appear once.")
+        return items
+
+    def changes(self):
+        return {
+            item["product"]: (
+                ("add", item["add"]) if "add" in item else ("set", item["quantity"])
+            )
+            for item in self.validated_data["items"]
+        }
+
+
 class CartSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     total_value = serializers.SerializerMethodField()
@@ -246,7 +317,9 @@ class CartSerializer(serializers.ModelSerializer):
         read_only_fields = ["created_at", "items"]
 
     def get_total_value(self, obj):
-        return sum(item.product.price * item.quantity for item in obj.items.all())
+        if not hasattr(obj, "total_value"):
+            obj = Cart.objects.with_items().get(pk=obj.pk)
+        return obj.total_value
 
     def create(self, validated_data):
         user = self.context["request"].user
@@ -271,11 +344,33 @@ class OrderSerializer(serializers.ModelSerializer):
         fields = ["id", "user", "created_at", "status", "items", "total_value"]
 
     def get_total_value(self, obj):
-        return sum(item.price * item.quantity for item in obj.order_items.all())
+        return obj.total
 
     def create(self, validated_data):
         items_data = validated_data.pop("order_items")
+        validated_data["total"] = sum(
+            (item["price"] * item["quantity"] for item in items_data), Decimal(0)
+        )
+        validated_data["item_count"] = sum(item["quantity"] for item in items_data)
         order = Order.objects.create(**validated_data)
         for item_data in items_data:
             OrderItem.objects.create(order=order, **item_data)
         return order
+
+
+class OrderCompactSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Order
+        fields = ["id", "user", "created_at", "status", "total", "item_count"]
+
+
+class OrderSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderSummary
+        fields = [
+            "user",
+            "order_count",
+            "item_count",
+            "lifetime_spend",
+            "last_order_at",
+        ]
@@ -1,7 +1,45 @@
-from .models import Referral, Wallet
-import os
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
+from .models import (
+    Cart,
+    CartItem,
+    CustomUser,
+    Order,
+    OrderItem,
+    OrderSummary,
+    Product,
+    ProductRating,
+    PurchasedProduct,
+    Referral,
+    ReferralCode,
+    StockHold,
+    Wallet,
+    WalletEntry,
+)
+from .cache import invalidate
+from .carts import CartError, cart_store
+from .facets import FacetCounter
+from decimal import Decimal
+from itertools import islice
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import (
+    Case,
+    Count,
+    DecimalField,
+    F,
+    FloatField,
+    Max,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Cast, Coalesce, Greatest
+from .outbox import aenqueue, enqueue
+from .passwords import hashing_pool, make_password
 
 
 class CreateReferral:
@@ -25,18 +63,701 @@ class SendReferral:
         self.referral_code = referral_code
 
     def send_referral_mail(self):
-        message = Mail(
-            from_email=os.environ.get("gmail_usr"),
-            to_emails=self.mail_id,
-            subject="Referral Code to Signup",
-            html_content=f"Please register to {SendReferral.register_page} using the code <strong>{self.referral_code}</strong>",
+        """Queue the mail for the outbox worker (manage.py drain_outbox);
+        False if the same referral is still waiting to be sent."""
+        return enqueue(**self.mail())
+
+    async def asend_referral_mail(self):
+        return await aenqueue(**self.mail())
+
+    def mail(self):
+        return {
+            "recipient": self.mail_id,
+            "subject": "Referral Code to Signup",
+            "html_content": f"Please register to {SendReferral.register_page} using the code <strong>{self.referral_code}</strong>",
+            "dedupe_key": f"referral:{self.referral_code}:{self.mail_id}",
+        }
+
+
+class RatingAggregate:
+
+    def __init__(self, product_id):
+        self.product_id = product_id
+
+    def apply(self, rating, delta):
+        # shift the stored aggregate by `delta` reviews of `rating` stars in one
+        # UPDATE; the right hand side sees the old row so the average stays exact
+        count = F("count") + delta
+        total = F("total") + rating * delta
+        ProductRating.objects.filter(product_id=self.product_id).update(
+            count=count,
+            total=total,
+            average=Case(
+                When(count=-delta, then=Value(0.0)),
+                default=Cast(total, FloatField()) / count,
+                output_field=FloatField(),
+            ),
+            **{f"star_{rating}": F(f"star_{rating}") + delta},
+        )
+
+    @staticmethod
+    def rebuild(product_ids=None, batch_size=1000):
+        products = Product.objects.order_by("pk")
+        if product_ids is not None:
+            products = products.filter(pk__in=product_ids)
+        stars = {
+            f"star_{i}": Count("reviews", filter=Q(reviews__rating=i))
+            for i in range(1, 6)
+        }
+        rows = products.annotate(
+            review_count=Count("reviews"),
+            review_total=Coalesce(Sum("reviews__rating"), 0),
+            **stars,
+        ).values("pk", "review_count", "review_total", *stars)
+
+        batch = []
+        rebuilt = 0
+        for row in rows.iterator(chunk_size=batch_size):
+            count = row["review_count"]
+            batch.append(
+                ProductRating(
+                    product_id=row["pk"],
+                    count=count,
+                    total=row["review_total"],
+                    average=row["review_total"] / count if count else 0.0,
+                    **{name: row[name] for name in stars},
+                )
+            )
+            if len(batch) >= batch_size:
+                rebuilt += RatingAggregate._save(batch)
+                batch = []
+        if batch:
+            rebuilt += RatingAggregate._save(batch)
+        return rebuilt
+
+    @staticmethod
+    def _save(batch):
+        ProductRating.objects.bulk_create(
+            batch,
+            update_conflicts=True,
+            unique_fields=["product"],
+            update_fields=["count", "total", "average"]
+            + [f"star_{i}" for i in range(1, 6)],
+        )
+        return len(batch)
+
+
+class OrderSummaries:
+    """Keep ``OrderSummary`` rows in step with orders. Orders are counted
+    while they are not cancelled."""
+
+    @staticmethod
+    def counted(status):
+        return status != "Cancelled"
+
+    @staticmethod
+    def shift(order, delta):
+        """Count ``order`` into (1) or out of (-1) its user's summary in one
+        UPDATE. A user without a summary yet gets one rebuilt."""
+        if delta > 0:
+            created_at = Value(order.created_at)
+            last_order_at = Greatest(Coalesce("last_order_at", created_at), created_at)
+        else:
+            # the order is already cancelled or deleted
+            last_order_at = Subquery(
+                Order.objects.filter(user=OuterRef("user"))
+                .exclude(status="Cancelled")
+                .order_by("-created_at")
+                .values("created_at")[:1]
+            )
+        updated = OrderSummary.objects.filter(user_id=order.user_id).update(
+            order_count=F("order_count") + delta,
+            item_count=F("item_count") + delta * order.item_count,
+            lifetime_spend=F("lifetime_spend") + delta * order.total,
+            last_order_at=last_order_at,
+        )
+        if not updated:
+            OrderSummaries.rebuild([order.user_id])
+
+    @staticmethod
+    def rebuild(user_ids=None, batch_size=1000):
+        users = CustomUser.objects.order_by("pk")
+        if user_ids is not None:
+            users = users.filter(pk__in=user_ids)
+        counted = ~Q(orders__status="Cancelled")
+        rows = users.annotate(
+            order_count=Count("orders", filter=counted),
+            item_count=Coalesce(Sum("orders__item_count", filter=counted), 0),
+            lifetime_spend=Coalesce(
+                Sum("orders__total", filter=counted), Value(Decimal(0))
+            ),
+            last_order_at=Max("orders__created_at", filter=counted),
+        ).values("pk", "order_count", "item_count", "lifetime_spend", "last_order_at")
+
+        rebuilt = 0
+        rows = rows.iterator(chunk_size=batch_size)
+        while batch := list(islice(rows, batch_size)):
+            OrderSummary.objects.bulk_create(
+                [OrderSummary(user_id=row.pop("pk"), **row) for row in batch],
+                update_conflicts=True,
+                unique_fields=["user"],
+                update_fields=[
+                    "order_count",
+                    "item_count",
+                    "lifetime_spend",
+                    "last_order_at",
+                ],
+            )
+            rebuilt += len(batch)
+        return rebuilt
+
+    @staticmethod
+    def backfill_totals(batch_size=1000):
+        """Store the total and item count of every order from its items, one
+        UPDATE per ``batch_size`` orders."""
+        items = OrderItem.objects.filter(order=OuterRef("pk")).values("order")
+        total = items.annotate(
+            total=Sum(F("price") * F("quantity"), output_field=DecimalField())
+        ).values("total")
+        item_count = items.annotate(count=Sum("quantity")).values("count")
+
+        last_id, backfilled = 0, 0
+        while True:
+            ids = list(
+                Order.objects.filter(pk__gt=last_id)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not ids:
+                return backfilled
+            Order.objects.filter(pk__in=ids).update(
+                total=Coalesce(Subquery(total), Value(Decimal(0))),
+                item_count=Coalesce(Subquery(item_count), 0),
+            )
+            backfilled += len(ids)
+            last_id = ids[-1]
+
+
+class PurchaseHistory:
+    """The products delivered to each user, recorded as orders are delivered
+    so that whether a user may review a product is one indexed lookup."""
+
+    @staticmethod
+    def record(user_id, product_ids):
+        PurchasedProduct.objects.bulk_create(
+            [PurchasedProduct(user_id=user_id, product_id=pk) for pk in product_ids],
+            ignore_conflicts=True,
+        )
+
+    @staticmethod
+    def record_order(order):
+        PurchaseHistory.record(
+            order.user_id,
+            set(order.order_items.values_list("product_id", flat=True)),
         )
+
+    @staticmethod
+    def delivered(user, product_id):
         try:
-            sg = SendGridAPIClient(os.environ.get("SENDGRID_API_KEY"))
-            response = sg.send(message)
-            print(response.status_code)
-            print(response.body)
-            print(response.headers)
-        except Exception as e:
-            print("error sendgrid::::::::::::::", e)
-            raise e
+            return PurchasedProduct.objects.filter(
+                user=user, product_id=product_id
+            ).exists()
+        except (TypeError, ValueError):
+            # not a product id
+            return False
+
+
+class StockReservation:
+
+    def __init__(self, cart_item):
+        self.cart_item = cart_item
+
+    def hold(self, quantity):
+        """Reserve ``quantity`` units for the cart item, replacing its current
+        hold. Returns False and leaves the hold untouched if the stock that is
+        not held by anyone else is insufficient."""
+        product_id = self.cart_item.product_id
+        with transaction.atomic():
+            hold = (
+                StockHold.objects.select_for_update()
+                .filter(cart_item=self.cart_item)
+                .first()
+            )
+            delta = quantity - (hold.quantity if hold else 0)
+            if delta > 0 and not self._reserve(product_id, delta):
+                StockReservation.release(
+                    StockHold.objects.filter(
+                        product_id=product_id, expires_at__lte=timezone.now()
+                    ).exclude(cart_item=self.cart_item)
+                )
+                if not self._reserve(product_id, delta):
+                    return False
+            elif delta < 0:
+                Product.objects.filter(pk=product_id).update(
+                    reserved=F("reserved") + delta
+                )
+
+            expires_at = timezone.now() + settings.INVENTORY_HOLD_TTL
+            if hold:
+                hold.quantity = quantity
+                hold.expires_at = expires_at
+                hold.save(update_fields=["quantity", "expires_at"])
+            else:
+                StockHold.objects.create(
+                    cart_item=self.cart_item,
+                    product_id=product_id,
+                    quantity=quantity,
+                    expires_at=expires_at,
+                )
+            if delta:
+                transaction.on_commit(lambda: invalidate(f"product:{product_id}"))
+        return True
+
+    def _reserve(self, product_id, quantity):
+        # conditional increment: matches no row once the stock is exhausted
+        return Product.objects.filter(
+            pk=product_id, quantity__gte=F("reserved") + quantity
+        ).update(reserved=F("reserved") + quantity)
+
+    @staticmethod
+    def release(holds, batch_size=1000):
+        """Delete ``holds`` and give their units back, one UPDATE and one
+        DELETE per batch. Holds locked by a concurrent transaction are
+        skipped."""
+        released = 0
+        while True:
+            with transaction.atomic():
+                rows = list(
+                    holds.select_for_update(skip_locked=True)
+                    .order_by("pk")
+                    .values_list("pk", "product_id", "quantity")[:batch_size]
+                )
+                if not rows:
+                    return released
+                quantities = {}
+                for _, product_id, quantity in rows:
+                    quantities[product_id] = quantities.get(product_id, 0) + quantity
+                Product.objects.filter(pk__in=quantities).update(
+                    reserved=Case(
+                        *(
+                            When(pk=product_id, then=F("reserved") - quantity)
+                            for product_id, quantity in quantities.items()
+                        )
+                    )
+                )
+                StockHold.objects.filter(pk__in=[row[0] for row in rows]).delete()
+                tags = [f"product:{product_id}" for product_id in quantities]
+                transaction.on_commit(lambda tags=tags: invalidate(*tags))
+            released += len(rows)
+            if len(rows) < batch_size:
+                return released
+
+    @staticmethod
+    def hold_items(quantities):
+        """Set the holds of many cart items at once, ``{cart_item: quantity}``
+        with 0 releasing the hold, in a fixed number of queries. Returns the
+        products lacking stock, leaving every hold untouched, if any."""
+        items = {item.pk: (item, quantity) for item, quantity in quantities.items()}
+        with transaction.atomic():
+            held = dict(
+                StockHold.objects.select_for_update()
+                .filter(cart_item__in=items)
+                .values_list("cart_item_id", "quantity")
+            )
+            deltas = {}
+            for pk, (item, quantity) in items.items():
+                delta = quantity - held.get(pk, 0)
+                deltas[item.product_id] = deltas.get(item.product_id, 0) + delta
+            deltas = {
+                product_id: delta for product_id, delta in deltas.items() if delta
+            }
+
+            def short():
+                return [
+                    product
+                    for product in Product.objects.select_for_update()
+                    .filter(pk__in=[pk for pk, delta in deltas.items() if delta > 0])
+                    .order_by("pk")
+                    if deltas[product.pk] > product.quantity - product.reserved
+                ]
+
+            if lacking := short():
+                StockReservation.release(
+                    StockHold.objects.filter(
+                        product__in=lacking, expires_at__lte=timezone.now()
+                    ).exclude(cart_item__in=items)
+                )
+                if lacking := short():
+                    return lacking
+
+            if deltas:
+                Product.objects.filter(pk__in=deltas).update(
+                    reserved=Case(
+                        *(
+                            When(pk=product_id, then=F("reserved") + delta)
+                            for product_id, delta in deltas.items()
+                        )
+                    )
+                )
+            StockHold.objects.filter(
+                cart_item__in=[
+                    pk for pk, (_, quantity) in items.items() if not quantity
+                ]
+            ).delete()
+            expires_at = timezone.now() + settings.INVENTORY_HOLD_TTL
+            StockHold.objects.bulk_create(
+                [
+                    StockHold(
+                        cart_item=item,
+                        product_id=item.product_id,
+                        quantity=quantity,
+                        expires_at=expires_at,
+                    )
+                    for item, quantity in items.values()
+                    if quantity
+                ],
+                update_conflicts=True,
+                unique_fields=["cart_item"],
+                update_fields=["quantity", "expires_at"],
+            )
+            if deltas:
+                tags = [f"product:{product_id}" for product_id in deltas]
+                transaction.on_commit(lambda: invalidate(*tags))
+        return []
+
+    @staticmethod
+    def reconcile():
+        """Recompute ``Product.reserved`` from the holds that still exist."""
+        held = (
+            StockHold.objects.filter(product=OuterRef("pk"))
+            .values("product")
+            .annotate(total=Sum("quantity"))
+            .values("total")
+        )
+        return Product.objects.update(reserved=Coalesce(Subquery(held), 0))
+
+
+class ShoppingCart:
+    """Add, update and remove many items of a user's cart in one transaction
+    and a fixed number of queries, whatever their count.
+
+    ``changes`` map product ids to ``("add", n)`` or ``("set", n)``; setting
+    0 removes the item. A product is in a cart once: adding it again raises
+    the quantity of its item. Changes to one cart, and its checkout, are
+    serialized on the cart row.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    def apply(self, changes):
+        """Returns the changed items, with ``quantity`` 0 for removed ones,
+        and the product ids whose item was created."""
+        with transaction.atomic():
+            cart, _created = Cart.objects.select_for_update().get_or_create(
+                user=self.user
+            )
+            products = Product.objects.in_bulk(list(changes))
+            for product_id in changes:
+                if product_id not in products:
+                    raise CartError(f"Product {product_id} does not exist")
+            existing = {
+                item.product_id: item
+                for item in CartItem.objects.filter(cart=cart, product__in=products)
+            }
+
+            items = {}
+            for product_id, (operation, quantity) in changes.items():
+                item = existing.get(product_id)
+                if item is not None:
+                    item.product = products[product_id]
+                current = item.quantity if item else 0
+                quantity = current + quantity if operation == "add" else quantity
+                if quantity > current and not products[product_id].is_available:
+                    raise CartError(f"{products[product_id].name} is out of stock")
+                if item is None:
+                    if not quantity:
+                        continue
+                    item = CartItem(cart=cart, product=products[product_id])
+                item.quantity = quantity
+                items[product_id] = item
+
+            created = [pk for pk, item in items.items() if item.pk is None]
+            CartItem.objects.bulk_create([items[pk] for pk in created])
+            lacking = StockReservation.hold_items(
+                {item: item.quantity for item in items.values()}
+            )
+            if lacking:
+                raise CartError(f"Not enough {lacking[0].name} available.")
+            CartItem.objects.bulk_update(
+                [
+                    item
+                    for pk, item in items.items()
+                    if item.quantity and pk not in created
+                ],
+                ["quantity"],
+            )
+            CartItem.objects.filter(
+                pk__in=[item.pk for item in items.values() if not item.quantity]
+            ).delete()
+            cart_store().changed(self.user.pk)
+        return list(items.values()), created
+
+    def merge_guest(self, token):
+        """Move the guest cart under ``token`` into the user's cart, adding
+        to the items it already has. Products that cannot be added any more
+        are left out."""
+        quantities = cart_store().take_guest(token)
+        changes = {pk: ("add", quantity) for pk, quantity in quantities.items()}
+        try:
+            self.apply(changes)
+        except CartError:
+            for product_id, change in changes.items():
+                try:
+                    self.apply({product_id: change})
+                except CartError:
+                    pass
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class Checkout:
+
+    def __init__(self, user):
+        self.user = user
+
+    def place_order(self):
+        with transaction.atomic():
+            # waits for ShoppingCart changes to the same cart
+            Cart.objects.select_for_update().filter(user=self.user).first()
+            quantities = {}
+            for product_id, quantity in CartItem.objects.filter(
+                cart__user=self.user
+            ).values_list("product_id", "quantity"):
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+            if not quantities:
+                raise CheckoutError("Cart is empty")
+
+            # lock the cart's holds before its products, as the sweeper does,
+            # and products in primary key order, so concurrent checkouts and
+            # sweeps cannot deadlock
+            held = {}
+            for product_id, quantity in (
+                StockHold.objects.select_for_update(of=("self",))
+                .filter(cart_item__cart__user=self.user)
+                .order_by("pk")
+                .values_list("product_id", "quantity")
+            ):
+                held[product_id] = held.get(product_id, 0) + quantity
+            products = list(
+                Product.objects.select_for_update()
+                .filter(pk__in=quantities)
+                .order_by("pk")
+            )
+            for product in products:
+                # stock reserved by this cart is ours to take
+                available = product.quantity - product.reserved
+                if quantities[product.pk] > available + held.get(product.pk, 0):
+                    raise CheckoutError(f"Not enough {product.name} available.")
+
+            order = Order.objects.create(
+                user=self.user,
+                total=sum(
+                    (product.price * quantities[product.pk] for product in products),
+                    Decimal(0),
+                ),
+                item_count=sum(quantities.values()),
+            )
+            OrderItem.objects.bulk_create(
+                OrderItem(
+                    order=order,
+                    product=product,
+                    quantity=quantities[product.pk],
+                    price=product.price,
+                )
+                for product in products
+            )
+
+            now = timezone.now()
+            sold_out = sum(
+                product.is_available and product.quantity == quantities[product.pk]
+                for product in products
+            )
+            for product in products:
+                product.quantity -= quantities[product.pk]
+                product.reserved -= held.get(product.pk, 0)
+                product.is_available = product.quantity > 0
+                product.modified_at = now
+            Product.objects.bulk_update(
+                products, ["quantity", "reserved", "is_available", "modified_at"]
+            )
+            # the cart's holds go with its items
+            CartItem.objects.filter(cart__user=self.user).delete()
+            cart_store().changed(self.user.pk)
+            FacetCounter.shift(
+                {
+                    ("availability", "in_stock"): -sold_out,
+                    ("availability", "out_of_stock"): sold_out,
+                }
+            )
+
+            # bulk_update sends no signals, so the catalog cache is told here
+            tags = ["products"]
+            for product in products:
+                tags += [f"product:{product.pk}", f"category:{product.category_id}"]
+            transaction.on_commit(lambda: invalidate(*tags))
+        return order
+
+
+class WalletLedger:
+    """Every change to a wallet is an entry in its ledger. ``Wallet.credits``
+    caches the ledger sum and is only moved by ``credits = credits + amount``
+    in the transaction writing the entries, so concurrent credits never
+    overwrite each other."""
+
+    @staticmethod
+    def credit(users, amount, reason):
+        """Credit the wallets of ``users`` with ``amount`` each: one INSERT
+        for the entries and one UPDATE for the balances."""
+        wallet_ids = list(
+            Wallet.objects.filter(user__in=users).values_list("pk", flat=True)
+        )
+        return WalletLedger.credit_wallets(wallet_ids, amount, reason)
+
+    @staticmethod
+    def credit_wallets(wallet_ids, amount, reason):
+        amount = Decimal(amount)
+        with transaction.atomic():
+            WalletEntry.objects.bulk_create(
+                WalletEntry(wallet_id=pk, amount=amount, reason=reason)
+                for pk in wallet_ids
+            )
+            Wallet.objects.filter(pk__in=wallet_ids).update(
+                credits=F("credits") + amount
+            )
+        return len(wallet_ids)
+
+    @staticmethod
+    def balances():
+        return Coalesce(
+            Subquery(
+                WalletEntry.objects.filter(wallet=OuterRef("pk"))
+                .values("wallet")
+                .annotate(total=Sum("amount"))
+                .values("total")
+            ),
+            Value(Decimal(0)),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        )
+
+    @staticmethod
+    def drifted():
+        """Wallets whose cached balance disagrees with their ledger."""
+        return Wallet.objects.annotate(ledger=WalletLedger.balances()).exclude(
+            credits=F("ledger")
+        )
+
+    @staticmethod
+    def reconcile():
+        """Recompute every cached balance from the ledger in one UPDATE."""
+        return Wallet.objects.update(credits=WalletLedger.balances())
+
+
+class RegistrationError(Exception):
+    pass
+
+
+class Registration:
+    """Create users with their referral code and wallet in one transaction.
+
+    Passwords are hashed on the hashing pool before the user is inserted, so
+    a registration is one INSERT per table: the user, its referral code and
+    its wallet, plus the referral and its ledger credit when a referral code
+    is given.
+    """
+
+    referral_credit = 100
+
+    @staticmethod
+    def register(email, password, referral_code=None, **fields):
+        referrer = None
+        if referral_code:
+            referrer = (
+                ReferralCode.objects.filter(code=referral_code)
+                .values_list("user_id", "user__wallet")
+                .first()
+            )
+            if referrer is None:
+                raise RegistrationError("please enter correct referral code")
+
+        user = CustomUser(email=CustomUser.objects.normalize_email(email), **fields)
+        user.password = make_password(password)
+        with transaction.atomic():
+            # the post_save receiver provisions the referral code and wallet
+            user.save()
+            if referrer:
+                referrer_id, referrer_wallet = referrer
+                Referral.objects.create(referred_by_id=referrer_id, referred_to=user)
+                WalletLedger.credit_wallets(
+                    [pk for pk in (referrer_wallet, user.wallet.pk) if pk],
+                    Registration.referral_credit,
+                    "referral",
+                )
+        return user
+
+    @staticmethod
+    def provision(rows, batch_size=1000):
+        """Create users in bulk from dicts of user fields, ``batch_size`` at a
+        time with one INSERT per table per batch.
+
+        Rows without a password get an unusable one. Emails that already
+        exist, or repeat within the batch, are skipped and returned.
+        """
+        created, skipped = 0, []
+        rows = iter(rows)
+        while chunk := list(islice(rows, batch_size)):
+            users = {}
+            for row in chunk:
+                fields = dict(row)
+                password = fields.pop("password", None) or None
+                user = CustomUser(**fields)
+                user.email = CustomUser.objects.normalize_email(user.email)
+                if user.email in users:
+                    skipped.append(user.email)
+                    continue
+                user.password = password
+                users[user.email] = user
+            for email in CustomUser.objects.filter(email__in=users).values_list(
+                "email", flat=True
+            ):
+                skipped.append(email)
+                del users[email]
+            if not users:
+                continue
+            # hashed in parallel on the hashing pool
+            passwords = hashing_pool().map(
+                hashers.make_password, [user.password for user in users.values()]
+            )
+            for user, password in zip(users.values(), passwords):
+                user.password = password
+            with transaction.atomic():
+                new = CustomUser.objects.bulk_create(users.values())
+                Registration.provision_accounts(new)
+            created += len(new)
+        return created, skipped
+
+    @staticmethod
+    def provision_accounts(users):
+        """Create the referral code and wallet of newly inserted users."""
+        codes, wallets = [], []
+        for user in users:
+            code = ReferralCode(user=user)
+            code.code = code.generate_code()
+            codes.append(code)
+            wallets.append(Wallet(user=user))
+        ReferralCode.objects.bulk_create(codes)
+        Wallet.objects.bulk_create(wallets)
+        for user, wallet in zip(users, wallets):
+            user.wallet = wallet
@@ -1,15 +1,227 @@
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from .models import *
+from .services import OrderSummaries, PurchaseHistory, RatingAggregate, Registration
+from .authentication import forget_user
+from .cache import invalidate_on_commit
+from .carts import cart_store
+from .search import search_backend
+from .facets import FacetCounter, product_facets
+from .images import image_pipeline
 
 
 @receiver(post_save, sender=CustomUser)
-def create_referral_code(sender, instance, created, **kwargs):
+def provision_user_accounts(sender, instance, created, **kwargs):
     if created:
-        ReferralCode.objects.create(user=instance)
+        Registration.provision_accounts([instance])
 
 
 @receiver(post_save, sender=CustomUser)
-def create_user_wallet(sender, instance, created, **kwargs):
+@receiver(post_delete, sender=CustomUser)
+def forget_cached_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def create_product_rating(sender, instance, created, **kwargs):
     if created:
-        Wallet.objects.create(user=instance)
+        ProductRating.objects.create(product=instance)
+
+
+@receiver(pre_save, sender=Review)
+def remember_previous_rating(sender, instance, **kwargs):
+    instance._previous_rating = None
+    instance._rated_categories = ()
+    if instance.pk:
+        instance._previous_rating = (
+            Review.objects.filter(pk=instance.pk)
+            .values_list("product_id", "rating")
+            .first()
+        )
+
+
+@receiver(post_save, sender=Review)
+def update_rating_on_save(sender, instance, created, **kwargs):
+    previous = getattr(instance, "_previous_rating", None)
+    current = (instance.product_id, int(instance.rating))
+    if previous == current:
+        return
+    with FacetCounter.tracking_ratings(
+        {current[0], (previous or current)[0]}
+    ) as categories:
+        if previous:
+            RatingAggregate(previous[0]).apply(previous[1], -1)
+        RatingAggregate(current[0]).apply(current[1], 1)
+    # the categories list the products with their ratings
+    instance._rated_categories = set(categories.values())
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_delete(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Product):
+        # the product and its aggregates are going away with the review
+        return
+    with FacetCounter.tracking_ratings([instance.product_id]) as categories:
+        RatingAggregate(instance.product_id).apply(int(instance.rating), -1)
+    instance._rated_categories = set(categories.values())
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_product(sender, instance, **kwargs):
+    instance._previous_facets = None
+    if instance.pk:
+        instance._previous_facets = FacetCounter.product_state([instance.pk]).get(
+            instance.pk
+        )
+
+
+@receiver(pre_delete, sender=Product)
+def remember_deleted_product(sender, instance, **kwargs):
+    instance._previous_facets = FacetCounter.product_state([instance.pk]).get(
+        instance.pk
+    )
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    previous = getattr(instance, "_previous_facets", None) or {}
+    invalidate_on_commit(
+        "products",
+        f"product:{instance.pk}",
+        f"category:{instance.category_id}",
+        f"category:{previous.get('category')}",
+    )
+
+
+@receiver(pre_delete, sender=Category)
+def detach_category_products(sender, instance, **kwargs):
+    # products are detached with an UPDATE that sends no signals
+    product_ids = list(instance.products.values_list("pk", flat=True))
+    invalidate_on_commit(*(f"product:{pk}" for pk in product_ids))
+    FacetCounter.shift(
+        {
+            ("category", str(instance.pk)): -len(product_ids),
+            ("category", "none"): len(product_ids),
+        }
+    )
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category(sender, instance, **kwargs):
+    invalidate_on_commit("categories", f"category:{instance.pk}", "products")
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_reviewed_product(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Product):
+        return
+    # the categories of the products whose rating changed, if any
+    categories = getattr(instance, "_rated_categories", ())
+    invalidate_on_commit(
+        "products",
+        f"product:{instance.product_id}",
+        *(f"category:{category_id}" for category_id in categories),
+    )
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {"name", "description"} & set(update_fields):
+        search_backend().refresh(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search_backend().unindex(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def count_product_facets(sender, instance, created, **kwargs):
+    previous = getattr(instance, "_previous_facets", None)
+    current = product_facets(
+        instance.category_id, instance.price, instance.is_available
+    )
+    current["rating"] = previous["rating"] if previous else "unrated"
+    FacetCounter.move(previous, current)
+
+
+@receiver(post_delete, sender=Product)
+def uncount_product_facets(sender, instance, **kwargs):
+    FacetCounter.move(getattr(instance, "_previous_facets", None), None)
+
+
+@receiver(post_save, sender=Product)
+def reprice_carts(sender, instance, **kwargs):
+    cart_store().reprice([instance])
+
+
+@receiver(post_save, sender=Product)
+def render_image_variants(sender, instance, **kwargs):
+    image_pipeline().refresh([instance])
+
+
+@receiver(post_delete, sender=Product)
+def drop_from_carts(sender, instance, **kwargs):
+    cart_store().reprice(deleted=[instance.pk])
+
+
+@receiver(post_save, sender=Cart)
+@receiver(post_delete, sender=Cart)
+@receiver(post_save, sender=CartItem)
+def retire_cached_cart(sender, instance, **kwargs):
+    cart = instance if isinstance(instance, Cart) else instance.cart
+    cart_store().changed(cart.user_id)
+
+
+@receiver(pre_save, sender=Order)
+def remember_previous_status(sender, instance, **kwargs):
+    instance._previous_status = None
+    if instance.pk:
+        instance._previous_status = (
+            Order.objects.filter(pk=instance.pk)
+            .values_list("status", flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=Order)
+def summarize_order(sender, instance, created, **kwargs):
+    previous = getattr(instance, "_previous_status", None)
+    was_counted = previous is not None and OrderSummaries.counted(previous)
+    is_counted = OrderSummaries.counted(instance.status)
+    if was_counted != is_counted:
+        OrderSummaries.shift(instance, 1 if is_counted else -1)
+
+
+@receiver(post_save, sender=Order)
+def record_delivered_products(sender, instance, **kwargs):
+    previous = getattr(instance, "_previous_status", None)
+    if instance.status == "Delivered" and previous != "Delivered":
+        PurchaseHistory.record_order(instance)
+
+
+@receiver(post_save, sender=OrderItem)
+def record_delivered_item(sender, instance, created, **kwargs):
+    # items added to an order created as delivered
+    if created and instance.order.status == "Delivered":
+        PurchaseHistory.record(instance.order.user_id, [instance.product_id])
+
+
+@receiver(pre_delete, sender=Order)
+def remember_deleted_status(sender, instance, origin=None, **kwargs):
+    # the status stored, which a stale instance may not hold
+    if not isinstance(origin, CustomUser):
+        remember_previous_status(sender, instance)
+
+
+@receiver(post_delete, sender=Order)
+def unsummarize_order(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, CustomUser):
+        # the summary is going away with the user
+        return
+    previous = getattr(instance, "_previous_status", None)
+    if previous is not None and OrderSummaries.counted(previous):
+        OrderSummaries.shift(instance, -1)
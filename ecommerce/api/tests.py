@@ -1,3 +1,1129 @@
-from django.test import TestCase
+import io
+import json
+import re
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+    tag,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+from rest_framework.views import APIView
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+from rest_framework_simplejwt.tokens import AccessToken
+from .authentication import bump_user_version
+from .blacklist import BloomFilter, RevocableRefreshToken, RevokedTokens
+from .cache import CatalogCacheMixin
+from .carts import cart_store
+from .facets import FacetCounter
+from .images import ImagePipeline
+from .mail import LocMemBackend, MailError
+from .models import *
+from .outbox import OutboxWorker, enqueue
+from .replicas import ReplicaRouter, ReplicaRoutingMiddleware, Replicas, replicas
+from .search import search_backend
+from .services import (
+    Checkout,
+    CheckoutError,
+    PurchaseHistory,
+    Registration,
+    RegistrationError,
+    ShoppingCart,
+    StockReservation,
+    WalletLedger,
+)
 
-# Create your tests here.
+PASSWORD = "Test#Passw0rd"
+
+
+@override_settings(CATALOG_CACHE=None)
+class QueryCountTests(TestCase):
+    """The list and detail endpoints make as many queries over ten rows as
+    over one."""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="user@example.com")
+        self.staff = CustomUser.objects.create_user(
+            email="staff@example.com", is_staff=True
+        )
+        self.category = Category.objects.create(name="Books")
+        self.cart = Cart.objects.create(user=self.user)
+        self.products = self.seed(1)
+
+    def seed(self, rows):
+        products = [
+            Product.objects.create(
+                name=f"Book {i}",
+                price="9.99",
+                description="A book",
+                image="images/book.jpg",
+                category=self.category,
+                quantity=10,
+            )
+            for i in range(rows)
+        ]
+        for product in products:
+            CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+            for reviewer in (self.user, self.staff):
+                Review.objects.create(user=reviewer, product=product, rating=4)
+        for _ in range(rows):
+            order = Order.objects.create(user=self.user, status="Delivered")
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, product=product, quantity=1, price=product.price)
+                for product in products
+            )
+        return products
+
+    def assertConstantQueries(self, path, user=None):
+        client = APIClient()
+        client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(client.get(path).status_code, 200)
+        self.seed(9)
+        with self.assertNumQueries(len(queries)):
+            self.assertEqual(client.get(path).status_code, 200)
+
+    def test_product_list(self):
+        self.assertConstantQueries("/api/products/")
+
+    def test_product_detail(self):
+        self.assertConstantQueries(f"/api/products/{self.products[0].pk}/")
+
+    def test_category_list(self):
+        self.assertConstantQueries("/api/categories/")
+
+    def test_category_detail(self):
+        self.assertConstantQueries(f"/api/categories/{self.category.pk}/")
+
+    def test_cart(self):
+        self.assertConstantQueries("/api/cart/", self.user)
+
+    def test_cart_items(self):
+        self.assertConstantQueries("/api/cart-items/", self.user)
+
+    def test_order_history(self):
+        self.assertConstantQueries("/api/orders/", self.user)
+
+    def test_all_orders(self):
+        self.assertConstantQueries("/api/orders/", self.staff)
+
+
+class TokenRefreshTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="staff@example.com",
+            password=PASSWORD,
+            is_staff=True,
+            is_superuser=True,
+        )
+        self.client = APIClient()
+        response = self.client.post(
+            "/api/login/",
+            {"email": self.user.email, "password": PASSWORD},
+            format="json",
+        )
+        self.refresh = response.json()["refresh"]
+
+    def refresh_tokens(self):
+        return self.client.post(
+            "/api/token/refresh/", {"refresh": self.refresh}, format="json"
+        )
+
+    def test_refresh_reloads_claims(self):
+        self.user.is_staff = self.user.is_superuser = False
+        self.user.save()
+
+        response = self.refresh_tokens()
+        self.assertEqual(response.status_code, 200)
+        access = AccessToken(response.json()["access"])
+        self.assertFalse(access["is_staff"])
+        self.assertFalse(access["is_superuser"])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        self.assertEqual(self.client.get("/api/admin/users/").status_code, 403)
+
+        # the rotated refresh token carries the new claims on
+        self.client.credentials()
+        self.refresh = response.json()["refresh"]
+        access = AccessToken(self.refresh_tokens().json()["access"])
+        self.assertFalse(access["is_staff"])
+
+    def test_refresh_refuses_inactive_users(self):
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(self.refresh_tokens().status_code, 401)
+
+    def test_refresh_sees_saves_of_other_processes(self):
+        response = self.refresh_tokens()
+        self.refresh = response.json()["refresh"]
+        # saved elsewhere: the row changes and the shared version is bumped,
+        # while this process still holds the user
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=False)
+        bump_user_version(self.user.pk)
+
+        self.assertEqual(self.refresh_tokens().status_code, 401)
+
+
+class CartItemUpdateTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="shopper@example.com", password=PASSWORD
+        )
+        category = Category.objects.create(name="Books")
+        self.product, self.other = [
+            Product.objects.create(
+                name=name,
+                price="10.00",
+                description=name,
+                image="images/book.jpg",
+                category=category,
+                quantity=2,
+            )
+            for name in ("Book", "Other book")
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for product in (self.product, self.other):
+            self.client.post("/api/cart-items/", {"product": product.pk}, format="json")
+        self.item = CartItem.objects.get(product=self.product)
+
+    def put(self, **data):
+        return self.client.put(
+            f"/api/cart-items/{self.item.pk}/",
+            {"product": self.product.pk, **data},
+            format="json",
+        )
+
+    def test_put_holds_stock(self):
+        self.assertEqual(self.put(quantity=2).status_code, 200)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved, 2)
+
+        self.assertEqual(self.put(quantity=50).status_code, 400)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantity, 2)
+
+    def test_put_keeps_product(self):
+        response = self.put(product=self.other.pk, quantity=1)
+        self.assertEqual(response.status_code, 200)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.product, self.product)
+
+
+class ProductImportTests(TestCase):
+    def setUp(self):
+        self.staff = CustomUser.objects.create_user(
+            email="staff@example.com", password=PASSWORD, is_staff=True
+        )
+        self.category = Category.objects.create(name="Lighting")
+        self.product = Product.objects.create(
+            sku="LAMP-1",
+            name="Lamp",
+            price="12.50",
+            description="A lamp",
+            image="images/lamp.jpg",
+            category=self.category,
+            quantity=3,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def upload(self, name, content):
+        file = io.BytesIO(content)
+        file.name = name
+        response = self.client.post(
+            "/api/products/import/", {"file": file}, format="multipart"
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_unreadable_lines_are_row_errors(self):
+        result = self.upload(
+            "catalog.jsonl",
+            b'{"sku": "A1", "name": "Chair", "price": "99", "description": "d"}\n'
+            b'{"sku": "A2", "name": \n'
+            b'{"sku": "A3", "name": "Caf\xe9", "price": "5", "description": "d"}\n'
+            b'{"sku": "A4", "name": "Desk", "price": "150", "description": "d"}\n',
+        )
+        self.assertEqual(result["imported"], 2)
+        self.assertEqual([error["row"] for error in result["errors"]], [2, 3])
+        self.assertTrue(Product.objects.filter(sku="A4").exists())
+
+        result = self.upload(
+            "catalog.csv",
+            b"sku,name,price,description\n" b"A5,Stool,20,d,EXTRA\n" b"A6,Shelf,35,d\n",
+        )
+        self.assertEqual(result["imported"], 1)
+        self.assertEqual([error["row"] for error in result["errors"]], [1])
+
+    def test_missing_columns_keep_their_values(self):
+        result = self.upload(
+            "catalog.csv",
+            b"sku,name,price,description\nLAMP-1,Desk lamp,14.00,A desk lamp\n",
+        )
+        self.assertEqual(result["imported"], 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.name, "Desk lamp")
+        self.assertEqual(self.product.image.name, "images/lamp.jpg")
+        self.assertEqual(self.product.category, self.category)
+        self.assertEqual(self.product.quantity, 3)
+
+
+class StockReleaseTests(TestCase):
+    def test_release_invalidates_every_batch(self):
+        user = CustomUser.objects.create_user(
+            email="shopper@example.com", password=PASSWORD
+        )
+        category = Category.objects.create(name="Books")
+        products = [
+            Product.objects.create(
+                name=f"Book {i}",
+                price="10.00",
+                description="A book",
+                image="images/book.jpg",
+                category=category,
+                quantity=2,
+            )
+            for i in range(3)
+        ]
+        ShoppingCart(user).apply({product.pk: ("add", 1) for product in products})
+
+        with mock.patch("api.services.invalidate") as invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    released = StockReservation.release(
+                        StockHold.objects.all(), batch_size=1
+                    )
+        self.assertEqual(released, 3)
+        tags = {tag for call in invalidate.call_args_list for tag in call.args}
+        self.assertEqual(tags, {f"product:{product.pk}" for product in products})
+
+
+class ImagePipelineTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Books")
+
+    def create(self, image):
+        return Product.objects.create(
+            name="Book",
+            price="10.00",
+            description="A book",
+            image=image,
+            category=self.category,
+            quantity=2,
+        )
+
+    def test_products_without_image_are_not_queued(self):
+        pipeline = ImagePipeline({"small": 320}, workers=0)
+        product = self.create("")
+        self.assertFalse(pipeline.stale(product))
+        with mock.patch.object(pipeline, "submit") as submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                pipeline.refresh([product])
+        submit.assert_not_called()
+
+    def test_batch_invalidates_once(self):
+        pipeline = ImagePipeline({"small": 320}, workers=0, batch_size=10)
+        products = [self.create("images/missing.jpg") for _ in range(3)]
+        with mock.patch("api.images.invalidate") as invalidate:
+            pipeline.run([product.pk for product in products])
+        invalidate.assert_called_once()
+        for product in products:
+            product.refresh_from_db()
+            self.assertEqual(product.image_variants["source"], "images/missing.jpg")
+            self.assertIn("error", product.image_variants)
+
+
+@tag("slow")
+class QueryPlanTests(TestCase):
+    def test_queries_use_indexes(self):
+        output = io.StringIO()
+        try:
+            call_command("check_query_plans", stdout=output)
+        except CommandError:
+            self.fail(output.getvalue())
+
+
+class CatalogInvalidationTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="reviewer@example.com", password=PASSWORD
+        )
+        self.category = Category.objects.create(name="Books")
+        self.product = Product.objects.create(
+            name="Book",
+            price="10.00",
+            description="A book",
+            image="images/book.jpg",
+            category=self.category,
+            quantity=2,
+        )
+
+    def test_tags_are_bumped_again_on_commit(self):
+        with mock.patch("api.cache.invalidate") as invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.name = "Another book"
+                self.product.save()
+                self.assertEqual(invalidate.call_count, 1)
+        self.assertEqual(invalidate.call_count, 2)
+        self.assertEqual(invalidate.call_args_list[0], invalidate.call_args_list[1])
+        self.assertIn(f"product:{self.product.pk}", invalidate.call_args.args)
+
+    def test_review_bumps_its_category_without_loading_the_product(self):
+        review = Review(user=self.user, product_id=self.product.pk, rating=4)
+        with mock.patch("api.cache.invalidate") as invalidate:
+            review.save()
+        self.assertIn(f"category:{self.category.pk}", invalidate.call_args.args)
+        self.assertFalse(Review.product.is_cached(review))
+
+
+class FailingBackend:
+    def send(self, message):
+        raise MailError("refused")
+
+
+@override_settings(
+    OUTBOX_MAIL_BACKEND="api.mail.LocMemBackend",
+    OUTBOX_MAX_ATTEMPTS=3,
+    OUTBOX_RETRY_DELAY=timedelta(seconds=30),
+)
+class OutboxTests(TestCase):
+    def setUp(self):
+        LocMemBackend.outbox.clear()
+
+    def enqueue(self):
+        return enqueue("friend@example.com", "Hello", "<p>Hi</p>", "greeting")
+
+    def test_enqueue_drops_pending_duplicates(self):
+        self.assertTrue(self.enqueue())
+        self.assertFalse(self.enqueue())
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+        OutboxWorker().drain()
+        self.assertEqual(len(LocMemBackend.outbox), 1)
+        # once sent, the same key can be queued again
+        self.assertTrue(self.enqueue())
+
+    def test_claim_leases_the_batch(self):
+        self.enqueue()
+        enqueue("other@example.com", "Hello", "<p>Hi</p>")
+        worker = OutboxWorker(batch_size=1)
+        first = worker.claim()
+        self.assertEqual(len(first), 1)
+        first[0].refresh_from_db()
+        self.assertGreater(first[0].next_attempt_at, timezone.now())
+        # another worker does not get the leased message
+        second = OutboxWorker().claim()
+        self.assertEqual(len(second), 1)
+        self.assertNotEqual(first[0].pk, second[0].pk)
+        self.assertEqual(OutboxWorker().claim(), [])
+
+    @override_settings(OUTBOX_MAIL_BACKEND="api.tests.FailingBackend")
+    def test_failures_back_off_until_failed(self):
+        self.enqueue()
+        worker = OutboxWorker()
+        for attempt in range(1, 4):
+            OutboxMessage.objects.update(next_attempt_at=timezone.now())
+            started = timezone.now()
+            self.assertEqual(worker.drain(), (0, 1))
+            message = OutboxMessage.objects.get()
+            self.assertEqual(message.attempts, attempt)
+            self.assertEqual(message.last_error, "refused")
+            if attempt < 3:
+                self.assertEqual(message.status, "Pending")
+                self.assertGreaterEqual(
+                    message.next_attempt_at,
+                    started + timedelta(seconds=30 * 2 ** (attempt - 1)),
+                )
+        self.assertEqual(message.status, "Failed")
+        self.assertEqual(worker.drain(), (0, 0))
+        # a failed message can be queued again
+        self.assertTrue(self.enqueue())
+
+    def test_referral_reports_a_pending_duplicate(self):
+        user = CustomUser.objects.create_user(
+            email="referrer@example.com", password=PASSWORD
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        data = {"to_email": "friend@example.com"}
+        self.assertEqual(client.post("/api/referral/", data).status_code, 202)
+        response = client.post("/api/referral/", data)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("to_email", response.json())
+
+
+class ProbeView(APIView):
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request):
+        return Response({"database": ReplicaRouter().db_for_read(Product)})
+
+    post = get
+
+
+class CachedProbeView(CatalogCacheMixin, ProbeView):
+    cache_tags = ["probe"]
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"], CATALOG_CACHE=None)
+@mock.patch.object(Replicas, "healthy", return_value=True)
+class ReplicaRoutingTests(SimpleTestCase):
+    """Routing decisions, without a second database."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.token = AccessToken.for_user(CustomUser(pk=7))
+        cache.delete(replicas().pin_key(7))
+        # health is checked again at the first read
+        replicas().checked_at = 0
+
+    def request(self, method, view=ProbeView, status=200):
+        def get_response(request):
+            response = view.as_view()(request)
+            response.status_code = status
+            return response.render()
+
+        request = getattr(self.factory, method)(
+            "/probe/", HTTP_AUTHORIZATION=f"Bearer {self.token}"
+        )
+        return ReplicaRoutingMiddleware(get_response)(request)
+
+    def database(self, *args, **kwargs):
+        return json.loads(self.request(*args, **kwargs).content)["database"]
+
+    def test_safe_requests_read_from_a_replica(self, healthy):
+        self.assertEqual(self.database("get"), "replica1")
+        self.assertEqual(self.database("post"), "default")
+        # outside a request, reads stay on the primary
+        self.assertEqual(ReplicaRouter().db_for_read(Product), "default")
+        self.assertEqual(ReplicaRouter().db_for_read(CustomUser), "default")
+
+    def test_writers_are_pinned_to_the_primary(self, healthy):
+        self.database("post", status=400)
+        self.assertEqual(self.database("get"), "replica1")
+        self.database("post")
+        self.assertEqual(self.database("get"), "default")
+
+    def test_unhealthy_replicas_are_skipped(self, healthy):
+        healthy.return_value = False
+        self.assertEqual(self.database("get"), "default")
+
+    @override_settings(
+        CATALOG_CACHE={
+            "BACKEND": "api.cache.LocalLRUCache",
+            "OPTIONS": {"timeout": 60, "max_entries": 10},
+        }
+    )
+    def test_catalog_cache_is_filled_from_the_primary(self, healthy):
+        self.assertEqual(self.database("get", CachedProbeView), "default")
+
+
+@skipUnless(settings.DATABASE_REPLICAS, "needs DATABASE_REPLICAS")
+@override_settings(CATALOG_CACHE=None)
+class ReplicaMirrorTests(TransactionTestCase):
+    """Reads through a replica alias that mirrors the test database."""
+
+    databases = "__all__"
+
+    def test_product_is_read_from_the_replica(self):
+        category = Category.objects.create(name="Books")
+        product = Product.objects.create(
+            name="Book",
+            price="10.00",
+            description="A book",
+            image="images/book.jpg",
+            category=category,
+            quantity=2,
+        )
+        queries = CaptureQueriesContext(connections[settings.DATABASE_REPLICAS[0]])
+        with queries:
+            response = self.client.get(f"/api/products/{product.pk}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["name"], "Book")
+        self.assertTrue(queries.captured_queries)
+
+
+class WalletLedgerTests(TestCase):
+    def setUp(self):
+        self.users = [
+            CustomUser.objects.create_user(
+                email=f"wallet-{i}@example.com", password=PASSWORD
+            )
+            for i in range(2)
+        ]
+
+    def wallet(self, user):
+        return Wallet.objects.get(user=user)
+
+    def test_credit_writes_entries_and_moves_balances(self):
+        self.assertEqual(WalletLedger.credit(self.users, "2.50", "bonus"), 2)
+        self.assertEqual(WalletLedger.credit(self.users[:1], "1.25", "bonus"), 1)
+
+        self.assertEqual(self.wallet(self.users[0]).credits, Decimal("3.75"))
+        self.assertEqual(self.wallet(self.users[1]).credits, Decimal("2.50"))
+        self.assertEqual(
+            WalletEntry.objects.filter(wallet__user=self.users[0]).count(), 2
+        )
+        self.assertFalse(WalletLedger.drifted().exists())
+
+    def test_credit_is_one_insert_and_one_update(self):
+        wallet_ids = [self.wallet(user).pk for user in self.users]
+        with CaptureQueriesContext(connection) as queries:
+            WalletLedger.credit_wallets(wallet_ids, 5, "bonus")
+        statements = [
+            query["sql"].split()[0]
+            for query in queries.captured_queries
+            if not query["sql"].startswith(("SAVEPOINT", "RELEASE"))
+        ]
+        self.assertEqual(statements, ["INSERT", "UPDATE"])
+        self.assertEqual(
+            sorted(Wallet.objects.values_list("credits", flat=True)), [5, 5]
+        )
+
+    def test_reconcile_recomputes_drifted_balances(self):
+        WalletLedger.credit(self.users, 4, "bonus")
+        Wallet.objects.filter(user=self.users[0]).update(credits=99)
+        self.assertEqual(
+            list(WalletLedger.drifted().values_list("user", flat=True)),
+            [self.users[0].pk],
+        )
+
+        WalletLedger.reconcile()
+        self.assertFalse(WalletLedger.drifted().exists())
+        self.assertEqual(self.wallet(self.users[0]).credits, Decimal(4))
+
+    def test_wallet_credits_are_a_number(self):
+        WalletLedger.credit(self.users[:1], "2.50", "bonus")
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        self.assertEqual(client.get("/api/wallet/").json(), {"credits": 2.5})
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="shopper@example.com", password=PASSWORD
+        )
+        self.other = CustomUser.objects.create_user(
+            email="other@example.com", password=PASSWORD
+        )
+        category = Category.objects.create(name="Books")
+        self.book, self.map = [
+            Product.objects.create(
+                name=name,
+                price=price,
+                description=name,
+                image="images/book.jpg",
+                category=category,
+                quantity=quantity,
+            )
+            for name, price, quantity in (("Book", "10.00", 3), ("Map", "4.50", 1))
+        ]
+
+    def test_place_order_takes_the_held_stock(self):
+        ShoppingCart(self.user).apply(
+            {self.book.pk: ("add", 2), self.map.pk: ("add", 1)}
+        )
+        order = Checkout(self.user).place_order()
+
+        self.assertEqual(order.total, Decimal("24.50"))
+        self.assertEqual(order.item_count, 3)
+        self.assertEqual(
+            sorted(order.order_items.values_list("product", "quantity", "price")),
+            [(self.book.pk, 2, Decimal("10.00")), (self.map.pk, 1, Decimal("4.50"))],
+        )
+        self.book.refresh_from_db()
+        self.map.refresh_from_db()
+        self.assertEqual((self.book.quantity, self.book.reserved), (1, 0))
+        self.assertEqual((self.map.quantity, self.map.reserved), (0, 0))
+        self.assertFalse(self.map.is_available)
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_stock_held_by_other_carts_is_not_sold(self):
+        ShoppingCart(self.other).apply({self.book.pk: ("add", 2)})
+        # an item without a hold, as left by an expired or missing reservation
+        cart, _ = Cart.objects.get_or_create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.book, quantity=2)
+
+        with self.assertRaisesMessage(CheckoutError, "Not enough Book available."):
+            Checkout(self.user).place_order()
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.quantity, self.book.reserved), (3, 2))
+        self.assertFalse(Order.objects.exists())
+
+    def test_empty_cart_is_refused(self):
+        with self.assertRaisesMessage(CheckoutError, "Cart is empty"):
+            Checkout(self.user).place_order()
+
+    @skipUnless(connection.features.has_select_for_update, "needs row locks")
+    def test_cart_holds_and_products_are_locked_in_order(self):
+        ShoppingCart(self.user).apply(
+            {self.map.pk: ("add", 1), self.book.pk: ("add", 1)}
+        )
+        with CaptureQueriesContext(connection) as queries:
+            Checkout(self.user).place_order()
+        locked = [
+            re.search(r'FROM "(\w+)"', query["sql"])[1]
+            for query in queries.captured_queries
+            if "FOR UPDATE" in query["sql"]
+        ]
+        self.assertEqual(locked, ["api_cart", "api_stockhold", "api_product"])
+        products = next(
+            query["sql"]
+            for query in queries.captured_queries
+            if "FOR UPDATE" in query["sql"] and 'FROM "api_product"' in query["sql"]
+        )
+        self.assertIn('ORDER BY "api_product"."id" ASC', products)
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.users = [
+            CustomUser.objects.create_user(
+                email=f"holder-{i}@example.com", password=PASSWORD
+            )
+            for i in range(2)
+        ]
+        self.product = Product.objects.create(
+            name="Book",
+            price="10.00",
+            description="A book",
+            image="images/book.jpg",
+            category=Category.objects.create(name="Books"),
+            quantity=3,
+        )
+        self.items = [
+            CartItem.objects.create(
+                cart=Cart.objects.get_or_create(user=user)[0], product=self.product
+            )
+            for user in self.users
+        ]
+
+    def reserved(self):
+        self.product.refresh_from_db()
+        return self.product.reserved
+
+    def test_hold_replaces_the_previous_hold(self):
+        reservation = StockReservation(self.items[0])
+        self.assertTrue(reservation.hold(2))
+        self.assertEqual(self.reserved(), 2)
+        self.assertTrue(reservation.hold(1))
+        self.assertEqual(self.reserved(), 1)
+        self.assertEqual(StockHold.objects.get().quantity, 1)
+
+    def test_hold_refuses_stock_held_by_others(self):
+        self.assertTrue(StockReservation(self.items[0]).hold(2))
+        self.assertFalse(StockReservation(self.items[1]).hold(2))
+        self.assertEqual(self.reserved(), 2)
+        self.assertFalse(StockHold.objects.filter(cart_item=self.items[1]).exists())
+
+    def test_hold_reclaims_expired_holds(self):
+        self.assertTrue(StockReservation(self.items[0]).hold(2))
+        StockHold.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        self.assertTrue(StockReservation(self.items[1]).hold(2))
+        self.assertEqual(self.reserved(), 2)
+        self.assertEqual(
+            list(StockHold.objects.values_list("cart_item", flat=True)),
+            [self.items[1].pk],
+        )
+
+    def test_reconcile_recomputes_reserved_from_holds(self):
+        StockReservation(self.items[0]).hold(1)
+        StockReservation(self.items[1]).hold(2)
+        Product.objects.update(reserved=0)
+
+        StockReservation.reconcile()
+        self.assertEqual(self.reserved(), 3)
+
+
+@override_settings(
+    PRODUCT_SEARCH_BACKEND="api.search.InvertedIndexBackend", CATALOG_CACHE=None
+)
+class InvertedIndexSearchTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Lighting")
+        self.products = {
+            name: Product.objects.create(
+                name=name,
+                price="10.00",
+                description=description,
+                image="images/lamp.jpg",
+                category=category,
+                quantity=2,
+            )
+            for name, description in (
+                ("Desk lamp", "A lamp for the desk"),
+                ("Floor lamp", "Tall"),
+                ("Desk", "Oak desk with a lamp hook"),
+            )
+        }
+
+    def search(self, term):
+        return list(
+            search_backend()
+            .search(Product.objects.all(), term)
+            .values_list("name", flat=True)
+        )
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self.search("lamp"), ["Desk lamp", "Floor lamp", "Desk"])
+
+    def test_every_term_matches_as_a_prefix(self):
+        self.assertEqual(self.search("des la"), ["Desk lamp", "Desk"])
+        self.assertEqual(self.search("chair"), [])
+
+    def test_misspelt_terms_match_similar_tokens(self):
+        self.assertEqual(self.search("flor"), ["Floor lamp"])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.search("lamp")
+        floor = self.products["Floor lamp"]
+        floor.name = "Floor light"
+        floor.save()
+        self.products["Desk"].delete()
+
+        self.assertEqual(self.search("lamp"), ["Desk lamp"])
+        self.assertEqual(self.search("light"), ["Floor light"])
+
+    def test_product_list_is_ranked(self):
+        response = self.client.get("/api/products/", {"search": "lamp"})
+        self.assertEqual(
+            [product["name"] for product in response.json()["results"]],
+            ["Desk lamp", "Floor lamp", "Desk"],
+        )
+
+
+@skipUnless(connection.vendor == "postgresql", "needs PostgreSQL")
+@override_settings(PRODUCT_SEARCH_BACKEND="api.search.PostgresSearchBackend")
+class PostgresSearchTests(InvertedIndexSearchTests):
+    def setUp(self):
+        super().setUp()
+        search_backend().index()
+
+
+class FacetCounterTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="shopper@example.com", password=PASSWORD
+        )
+        self.books = Category.objects.create(name="Books")
+        self.maps = Category.objects.create(name="Maps")
+        self.products = [
+            Product.objects.create(
+                name=f"Product {i}",
+                price=price,
+                description="A product",
+                image="images/product.jpg",
+                category=category,
+                quantity=1,
+            )
+            for i, (price, category) in enumerate(
+                [("10.00", self.books), ("30.00", self.books), ("60.00", self.maps)]
+            )
+        ]
+
+    def assertCountsMatchCatalog(self):
+        self.assertEqual(
+            FacetCounter.counts(), FacetCounter.counts(Product.objects.all())
+        )
+
+    def test_counts_follow_writes(self):
+        product = self.products[0]
+        product.price = "120.00"
+        product.category = self.maps
+        product.save()
+        Review.objects.create(user=self.user, product=self.products[1], rating=5)
+        ShoppingCart(self.user).apply({self.products[2].pk: ("add", 1)})
+        Checkout(self.user).place_order()
+        self.products[1].delete()
+
+        counts = FacetCounter.counts()
+        self.assertEqual(counts["category"], {str(self.maps.pk): 2})
+        self.assertEqual(counts["price"]["100-250"], 1)
+        self.assertEqual(counts["availability"], {"in_stock": 1, "out_of_stock": 1})
+        self.assertCountsMatchCatalog()
+
+    def test_counts_sum_every_slot(self):
+        counts = FacetCount.objects.filter(facet="price", value="25-50")
+        counts.delete()
+        with mock.patch("api.facets.random.randrange", side_effect=[3, 7]):
+            FacetCounter.shift({("price", "25-50"): 2})
+            FacetCounter.shift({("price", "25-50"): -1})
+        self.assertEqual(dict(counts.values_list("slot", "count")), {3: 2, 7: -1})
+        self.assertEqual(FacetCounter.counts()["price"]["25-50"], 1)
+
+    def test_rebuild_recounts_the_catalog(self):
+        Product.objects.filter(pk=self.products[0].pk).update(price="300.00")
+        FacetCount.objects.update(count=0)
+
+        FacetCounter.rebuild()
+        self.assertEqual(FacetCounter.counts()["price"]["250+"], 1)
+        self.assertCountsMatchCatalog()
+
+
+class BloomFilterTests(SimpleTestCase):
+    def test_added_keys_are_always_held(self):
+        bloom = BloomFilter(1000, 0.01)
+        keys = [f"jti-{i}" for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
+        self.assertEqual(bloom.count, 1000)
+
+    def test_false_positives_stay_near_the_error_rate(self):
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add(f"jti-{i}")
+        false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class RevokedTokensTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="holder@example.com", password=PASSWORD
+        )
+
+    def revoke_elsewhere(self):
+        """A token blacklisted by another process."""
+        token = RevocableRefreshToken.for_user(self.user)
+        BlacklistedToken.objects.create(
+            token=OutstandingToken.objects.get(jti=token["jti"])
+        )
+        return token["jti"]
+
+    def test_unknown_tokens_are_not_looked_up(self):
+        revoked = RevokedTokens(sync_interval=60)
+        revoked.sync()
+        with self.assertNumQueries(0):
+            self.assertNotIn("unknown", revoked)
+
+    def test_tokens_revoked_elsewhere_are_read_on_sync(self):
+        revoked = RevokedTokens(sync_interval=60)
+        revoked.sync()
+        jti = self.revoke_elsewhere()
+        revoked.synced_at -= 61
+        self.assertIn(jti, revoked)
+
+    def test_filter_grows_past_its_capacity(self):
+        revoked = RevokedTokens(capacity=2)
+        jtis = [self.revoke_elsewhere() for _ in range(3)]
+        revoked.warm()
+        self.assertEqual(revoked.filter.capacity, 4)
+        self.assertTrue(all(jti in revoked for jti in jtis))
+
+    def test_token_cannot_be_blacklisted_twice(self):
+        token = RevocableRefreshToken.for_user(self.user)
+        token.blacklist()
+        with self.assertRaises(TokenError):
+            token.blacklist()
+        with self.assertRaises(TokenError):
+            token.check_blacklist()
+
+
+class RegistrationTests(TestCase):
+    def test_register_provisions_code_and_wallet(self):
+        user = Registration.register("New@Example.com", PASSWORD)
+        self.assertEqual(user.email, "New@example.com")
+        self.assertTrue(user.check_password(PASSWORD))
+        self.assertTrue(ReferralCode.objects.filter(user=user).exists())
+        self.assertEqual(Wallet.objects.get(user=user).credits, 0)
+
+    def test_referral_credits_both_wallets(self):
+        referrer = Registration.register("referrer@example.com", PASSWORD)
+        code = ReferralCode.objects.get(user=referrer).code
+        user = Registration.register("referred@example.com", PASSWORD, code)
+
+        self.assertTrue(
+            Referral.objects.filter(referred_by=referrer, referred_to=user).exists()
+        )
+        for account in (referrer, user):
+            self.assertEqual(
+                Wallet.objects.get(user=account).credits,
+                Registration.referral_credit,
+            )
+        self.assertFalse(WalletLedger.drifted().exists())
+
+    def test_unknown_referral_code_creates_nothing(self):
+        with self.assertRaises(RegistrationError):
+            Registration.register("referred@example.com", PASSWORD, "unknown")
+        self.assertFalse(CustomUser.objects.exists())
+
+    def test_provision_skips_existing_and_repeated_emails(self):
+        Registration.register("taken@example.com", PASSWORD)
+        created, skipped = Registration.provision(
+            [
+                {"email": "one@example.com", "password": PASSWORD},
+                {"email": "two@example.com"},
+                {"email": "taken@example.com"},
+                {"email": "one@example.com"},
+            ],
+            batch_size=2,
+        )
+
+        self.assertEqual(created, 2)
+        self.assertEqual(sorted(skipped), ["one@example.com", "taken@example.com"])
+        one = CustomUser.objects.get(email="one@example.com")
+        self.assertTrue(one.check_password(PASSWORD))
+        self.assertFalse(
+            CustomUser.objects.get(email="two@example.com").has_usable_password()
+        )
+        self.assertEqual(ReferralCode.objects.count(), 3)
+        self.assertEqual(Wallet.objects.count(), 3)
+
+
+class CartStoreTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            email="shopper@example.com", password=PASSWORD
+        )
+        category = Category.objects.create(name="Books")
+        self.book, self.map = [
+            Product.objects.create(
+                name=name,
+                price="10.00",
+                description=name,
+                image="images/book.jpg",
+                category=category,
+                quantity=quantity,
+            )
+            for name, quantity in (("Book", 5), ("Map", 1))
+        ]
+        self.store = cart_store()
+
+    def quantities(self, cart):
+        return {item["product"]: item["quantity"] for item in cart["items"]}
+
+    def test_cached_cart_is_read_without_queries(self):
+        ShoppingCart(self.user).apply({self.book.pk: ("add", 1)})
+        self.store.get(self.user.pk)
+        with self.assertNumQueries(0):
+            cart = self.store.get(self.user.pk)
+        self.assertEqual(self.quantities(cart), {self.book.pk: 1})
+
+    def test_cart_changes_and_reprices_retire_the_cached_cart(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ShoppingCart(self.user).apply({self.book.pk: ("add", 1)})
+        self.store.get(self.user.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ShoppingCart(self.user).apply({self.book.pk: ("add", 2)})
+        self.assertEqual(
+            self.quantities(self.store.get(self.user.pk)), {self.book.pk: 3}
+        )
+
+        self.book.price = "12.50"
+        self.book.save()
+        cart = self.store.get(self.user.pk)
+        self.assertEqual(cart["items"][0]["product_price"], "12.50")
+        self.assertEqual(cart["total_value"], Decimal("37.50"))
+
+    def test_guest_cart_is_merged_at_login(self):
+        ShoppingCart(self.user).apply({self.book.pk: ("add", 1)})
+        response = self.client.post(
+            "/api/cart/guest/",
+            {
+                "items": [
+                    {"product": self.book.pk, "add": 2},
+                    {"product": self.map.pk, "add": 1},
+                ]
+            },
+            content_type="application/json",
+        )
+        token = response.json()["token"]
+        # sold out before the shopper logs in
+        self.map.quantity = 0
+        self.map.is_available = False
+        self.map.save()
+
+        response = self.client.post(
+            "/api/login/",
+            {"email": self.user.email, "password": PASSWORD},
+            content_type="application/json",
+            HTTP_X_CART_TOKEN=token,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            dict(
+                CartItem.objects.filter(cart__user=self.user).values_list(
+                    "product", "quantity"
+                )
+            ),
+            {self.book.pk: 3},
+        )
+        self.assertEqual(self.store.take_guest(token), {})
+
+
+class PurchaseHistoryTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="reviewer@example.com", password=PASSWORD
+        )
+        category = Category.objects.create(name="Books")
+        self.book, self.map = [
+            Product.objects.create(
+                name=name,
+                price="10.00",
+                description=name,
+                image="images/book.jpg",
+                category=category,
+                quantity=5,
+            )
+            for name in ("Book", "Map")
+        ]
+        ShoppingCart(self.user).apply({self.book.pk: ("add", 1)})
+        self.order = Checkout(self.user).place_order()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def deliver(self):
+        self.order.status = "Delivered"
+        self.order.save()
+
+    def review(self, product):
+        return self.client.post(
+            "/api/reviews/", {"product": product.pk, "rating": 4}, format="json"
+        )
+
+    def test_delivery_records_the_products(self):
+        self.assertFalse(PurchaseHistory.delivered(self.user, self.book.pk))
+        self.deliver()
+        self.assertTrue(PurchaseHistory.delivered(self.user, self.book.pk))
+        self.assertFalse(PurchaseHistory.delivered(self.user, self.map.pk))
+        self.assertFalse(PurchaseHistory.delivered(self.user, "book"))
+
+        # delivered again after a status change, still recorded once
+        self.order.status = "Shipped"
+        self.order.save()
+        self.deliver()
+        self.assertEqual(PurchasedProduct.objects.filter(user=self.user).count(), 1)
+
+    def test_only_delivered_products_can_be_reviewed_once(self):
+        self.assertEqual(self.review(self.book).status_code, 400)
+        self.deliver()
+        self.assertEqual(self.review(self.book).status_code, 201)
+        self.assertEqual(self.review(self.book).status_code, 400)
+        self.assertEqual(self.review(self.map).status_code, 400)
+        self.assertEqual(Review.objects.filter(user=self.user).count(), 1)
@@ -1,6 +1,13 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import *
+from .async_views import (
+    AsyncCartList,
+    AsyncProductDetail,
+    AsyncProductList,
+    AsyncReferralView,
+    AsyncWalletDetail,
+)
 from rest_framework_simplejwt.views import (
     TokenRefreshView,
     TokenVerifyView,
@@ -29,7 +36,9 @@ router.register(r"cart-items", CartItemViewSet, basename="cart-items")
 
 
 urlpatterns = [
+    path("cart/guest/", GuestCartView.as_view(), name="guest-cart"),
     path("", include(router.urls)),
+    path("health/", HealthView.as_view(), name="health"),
     path("register/", RegisterView.as_view(), name="register"),
     path("login/", LoginView.as_view(), name="login"),
     path("logout/", LogoutView.as_view(), name="logout"),
@@ -37,11 +46,17 @@ urlpatterns = [
     path("token/verify/", TokenVerifyView.as_view(), name="token_verify"),
     path("admin/users/", UserView.as_view(), name="users"),
     path("products/", ProductList.as_view()),
+    path("products/facets/", ProductFacetList.as_view(), name="product-facets"),
+    path("products/import/", ProductImportView.as_view(), name="product-import"),
+    path("products/export/", ProductExportView.as_view(), name="product-export"),
     path("products/<int:pk>/", ProductDetail.as_view()),
     path("categories/", CategoryList.as_view()),
     path("categories/<int:pk>/", CategoryDetail.as_view()),
     path("orders/create/", CreateOrderView.as_view(), name="order-create"),
     path("orders/", ListOrderView.as_view(), name="order-list"),
+    path("orders/export/", OrderExportView.as_view(), name="order-export"),
+    path("orders/compact/", CompactOrderListView.as_view(), name="order-compact"),
+    path("orders/summary/", OrderSummaryView.as_view(), name="order-summary"),
     path(
         "orders/<int:pk>/",
         OrderRetrieveUpdateDestroyAPIView.as_view(),
@@ -57,6 +72,36 @@ urlpatterns = [
     ),  # for documentation
 ]
 
+# Under ASGI the hot read endpoints and the referral mail run on Django's
+# async request path; see api/async_views.py.
+if settings.ASYNC_API_VIEWS:
+    urlpatterns = [
+        path(
+            "products/",
+            AsyncProductList.as_view(sync_view=ProductList.as_view()),
+        ),
+        path(
+            "products/<int:pk>/",
+            AsyncProductDetail.as_view(sync_view=ProductDetail.as_view()),
+        ),
+        path(
+            "cart/",
+            AsyncCartList.as_view(
+                sync_view=CartViewSet.as_view({"get": "list", "post": "create"})
+            ),
+        ),
+        path(
+            "wallet/",
+            AsyncWalletDetail.as_view(sync_view=WalletDetailView.as_view()),
+            name="wallet-details",
+        ),
+        path(
+            "referral/",
+            AsyncReferralView.as_view(sync_view=ReferralView.as_view()),
+            name="referral",
+        ),
+    ] + urlpatterns
+
 
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
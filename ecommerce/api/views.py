@@ -2,16 +2,35 @@ from rest_framework.response import Response
 from rest_framework import generics
 from django_filters import rest_framework as filters
 from rest_framework import status, viewsets, permissions, generics
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.tokens import RefreshToken
+from .blacklist import RevocableRefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
 from .models import *
 from .serializers import *
 from rest_framework.views import APIView
 from rest_framework.exceptions import ValidationError, PermissionDenied
 from rest_framework import views
-from rest_framework.parsers import JSONParser
-from django.http import HttpResponse, JsonResponse
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.utils.encoders import JSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
+from .cache import CatalogCacheMixin
+from .search import ProductSearchFilter
+from .facets import FacetCounter
+from .catalog_io import ProductExporter, ProductImporter, read_rows
+from .reports import OrderExporter, parse_moment
+from .replicas import database_health
+from .carts import cart_store
+from .services import (
+    CartError,
+    Checkout,
+    CheckoutError,
+    PurchaseHistory,
+    ShoppingCart,
+    StockReservation,
+)
 
 
 class IsAdminOrReadOnly(permissions.BasePermission):
@@ -47,6 +66,25 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
         return obj.user == request.user
 
 
+class HealthView(APIView):
+    """Reachability of the primary and the replicas, for load balancers;
+    503 when the primary is down. Replicas that are down are only reported:
+    reads fall back to the primary."""
+
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        databases = database_health()
+        healthy = databases["default"]["status"] == "ok"
+        return Response(
+            {"status": "ok" if healthy else "unavailable", "databases": databases},
+            status=(
+                status.HTTP_200_OK if healthy else status.HTTP_503_SERVICE_UNAVAILABLE
+            ),
+        )
+
+
 class RegisterView(generics.CreateAPIView):
     serializer_class = RegisterSerializer
 
@@ -67,7 +105,7 @@ class LogoutView(APIView):
     def post(self, request):
         try:
             refresh_token = request.data["refresh_token"]
-            refreshToken = RefreshToken(refresh_token)
+            refreshToken = RevocableRefreshToken(refresh_token)
             refreshToken.blacklist()
 
             return Response(
@@ -83,6 +121,7 @@ class LogoutView(APIView):
 class UserView(generics.ListAPIView):
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
+    keyset_ordering = ["email"]
 
     def get_queryset(self):
         user = self.request.user
@@ -92,38 +131,117 @@ class UserView(generics.ListAPIView):
             raise PermissionDenied("You do not have permission to perform this action.")
 
 
-class CategoryList(generics.ListCreateAPIView):
+class CategoryList(CatalogCacheMixin, generics.ListCreateAPIView):
     queryset = Category.objects.all().order_by("id")
     serializer_class = CategoryListSerializer
     permission_classes = [IsAdminOrReadOnly]
+    cache_tags = ["categories"]
 
 
-class CategoryDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Category.objects.all()
+class CategoryDetail(CatalogCacheMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = Category.objects.prefetch_related(
+        Prefetch("products", queryset=Product.objects.select_related("rating"))
+    )
     serializer_class = CategorySerializer
     permission_classes = [IsAdminOrReadOnly]
+    cache_tags = ["category:{pk}"]
 
 
 class ProductFilter(filters.FilterSet):
-    category = filters.CharFilter(field_name="category__name", lookup_expr="icontains")
+    category = filters.CharFilter(method="filter_category")
 
     class Meta:
         model = Product
         fields = ["category", "price"]
 
+    def filter_category(self, queryset, name, value):
+        # match names on the small category table and filter products by the
+        # indexed foreign key instead of scanning the join
+        return queryset.filter(
+            category_id__in=Category.objects.filter(name__icontains=value).values("pk")
+        )
 
-class ProductList(generics.ListCreateAPIView):
-    queryset = Product.objects.all().order_by("id")
+
+class ProductList(CatalogCacheMixin, generics.ListCreateAPIView):
+    queryset = Product.objects.select_related("rating").order_by("id")
     serializer_class = ProductSerializer
     permission_classes = [IsAdminOrReadOnly]
     filterset_class = ProductFilter
-    search_fields = ["name", "description"]
+    filter_backends = [filters.DjangoFilterBackend, ProductSearchFilter]
+    keyset_ordering = ["id"]
+    cache_tags = ["products"]
+
+
+class ProductFacetList(ProductList):
+    http_method_names = ["get", "head", "options"]
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        filtered = any(
+            request.query_params.get(param)
+            for param in ["category", "price", ProductSearchFilter.search_param]
+        )
+        # unfiltered browsing reads the precomputed counts of the catalog
+        response.data["facets"] = FacetCounter.counts(
+            self.filter_queryset(self.get_queryset()) if filtered else None
+        )
+        return response
+
+
+class ProductImportView(views.APIView):
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response(
+                {"error": "Upload the catalog as the file field"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        format = (
+            request.query_params.get("file_format") or upload.name.rsplit(".", 1)[-1]
+        )
+        if format not in ("csv", "jsonl"):
+            return Response(
+                {"error": "Format must be csv or jsonl"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        importer = ProductImporter().run(read_rows(upload.file, format))
+        return Response(
+            {
+                "imported": importer.imported,
+                "error_count": len(importer.errors),
+                "errors": importer.errors[:1000],
+            },
+            status=status.HTTP_200_OK,
+        )
+
 
+class ProductExportView(views.APIView):
+    permission_classes = [permissions.IsAdminUser]
 
-class ProductDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Product.objects.all()
+    def get(self, request):
+        format = request.query_params.get("file_format", "csv")
+        if format not in ("csv", "jsonl"):
+            return Response(
+                {"error": "Format must be csv or jsonl"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        response = StreamingHttpResponse(
+            ProductExporter().stream(format),
+            content_type="text/csv" if format == "csv" else "application/x-ndjson",
+        )
+        response["Content-Disposition"] = f'attachment; filename="products.{format}"'
+        return response
+
+
+class ProductDetail(CatalogCacheMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = Product.objects.select_related("rating").prefetch_related("reviews")
     serializer_class = ProductDetailSerializer
     permission_classes = [IsAdminOrReadOnly]
+    cache_tags = ["product:{pk}"]
 
 
 class CartViewSet(viewsets.ModelViewSet):
@@ -131,40 +249,63 @@ class CartViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Cart.objects.filter(user=self.request.user).order_by("id")
+        return Cart.objects.filter(user=self.request.user).with_items().order_by("id")
+
+    def list(self, request, *args, **kwargs):
+        # from the cart store, without a query unless the cart changed
+        cart = cart_store().get(request.user.pk)
+        carts = [cart] if cart is not None else []
+        page = self.paginate_queryset(carts)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(carts)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            StockReservation.release(StockHold.objects.filter(cart_item__cart=instance))
+            instance.delete()
+
 
 class CartItemViewSet(viewsets.ModelViewSet):
     serializer_class = CartItemSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return CartItem.objects.filter(cart__user=self.request.user)
+        return CartItem.objects.filter(cart__user=self.request.user).select_related(
+            "product"
+        )
 
-    def create(self, request, *args, **kwargs):
-        product_id = request.data.get("product")
-
-        try:
-            cart = Cart.objects.get(user=request.user)
-        except Cart.DoesNotExist:
-            cart = Cart.objects.create(user=request.user)
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            StockReservation.release(StockHold.objects.filter(cart_item=instance))
+            instance.delete()
+            cart_store().changed(self.request.user.pk)
 
+    def create(self, request, *args, **kwargs):
+        """Add ``quantity`` (default 1) units of ``product``, to its item if
+        the cart already has one."""
+        change = CartChangeSerializer(
+            data={
+                "product": request.data.get("product"),
+                "add": request.data.get("quantity", 1),
+            }
+        )
+        change.is_valid(raise_exception=True)
+        product_id = change.validated_data["product"]
         try:
-            product = Product.objects.get(pk=product_id)
-
-        except Product.DoesNotExist:
-            return Response({"error": "Product does not exist"})
-
-        if product.is_available == False:
-            return Response({"error": "Product is out of stock"})
-
-        cart_item = CartItem.objects.create(cart=cart, product=product)
-
-        serializer = self.get_serializer(cart_item)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+            items, created = ShoppingCart(request.user).apply(
+                {product_id: ("add", change.validated_data["add"])}
+            )
+        except CartError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = self.get_serializer(items[0])
+        return Response(
+            serializer.data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
 
     def partial_update(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -184,66 +325,78 @@ class CartItemViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-            if instance.product.quantity < new_quantity:
-                return Response(
-                    {"error": "Not enough quantity available"},
-                    status=status.HTTP_400_BAD_REQUEST,
+            try:
+                items, _created = ShoppingCart(request.user).apply(
+                    {instance.product_id: ("set", new_quantity)}
                 )
-
-            instance.quantity = new_quantity
-            instance.save()
+            except CartError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            instance = items[0]
 
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
+    def update(self, request, *args, **kwargs):
+        """Set the quantity of the item like PATCH, so that it goes through
+        ShoppingCart and the stock holds; the product of an item cannot be
+        changed."""
+        return self.partial_update(request, *args, **kwargs)
+
+    @action(detail=False, methods=["post"])
+    def batch(self, request):
+        """Add, update or remove many items in one transaction:
+        ``{"items": [{"product": 1, "add": 2}, {"product": 2, "quantity": 0}]}``.
+        Returns the cart."""
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            ShoppingCart(request.user).apply(serializer.changes())
+        except CartError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        cart = Cart.objects.with_items().get(user=request.user)
+        return Response(CartSerializer(cart, context={"request": request}).data)
 
-class CreateOrderView(generics.CreateAPIView):
-    serializer_class = OrderSerializer
-    permission_classes = [IsAuthenticated]
 
-    def create(self, request, *args, **kwargs):
-        user = request.user
-        cart_items = CartItem.objects.filter(cart=user.cart)
+class GuestCartView(APIView):
+    """Cart of a shopper who has not logged in, kept in the cart store under
+    the token given in the ``X-Cart-Token`` header; POST takes the batch
+    changes of ``cart-items/batch/`` and returns the cart with its token,
+    created on the first change. Logging in with the header moves the cart
+    into the user's."""
 
-        if not cart_items.exists():
-            return Response(
-                {"error": "Cart is empty"}, status=status.HTTP_400_BAD_REQUEST
-            )
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
 
-        order_data = {
-            "user": user.id,
-            "items": [
-                {
-                    "product": item.product.id,
-                    "quantity": item.quantity,
-                    "price": item.product.price,
-                }
-                for item in cart_items
-            ],
-        }
-
-        for item in cart_items:
-            product = item.product
-            if item.quantity > product.quantity:
-                return Response(
-                    {"error": f"Not enough {product.name} available."},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
+    def get(self, request):
+        store = cart_store()
+        return Response(
+            store.render_guest(store.guest(request.headers.get("X-Cart-Token")))
+        )
 
-        # create order
-        serializer = self.get_serializer(data=order_data)
+    def post(self, request):
+        serializer = CartBatchSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+        store = cart_store()
+        try:
+            entry = store.change_guest(
+                request.headers.get("X-Cart-Token"), serializer.changes()
+            )
+        except CartError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(store.render_guest(entry))
 
-        self.perform_create(serializer)
 
-        # update product quantity
-        for item in cart_items:
-            product = item.product
-            product.quantity -= item.quantity
-            product.save()
+class CreateOrderView(generics.CreateAPIView):
+    serializer_class = OrderSerializer
+    permission_classes = [IsAuthenticated]
 
-        cart_items.delete()
+    def create(self, request, *args, **kwargs):
+        try:
+            order = Checkout(request.user).place_order()
+        except CheckoutError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+        serializer = self.get_serializer(Order.objects.with_items().get(pk=order.pk))
         headers = self.get_success_headers(serializer.data)
 
         return Response(
@@ -254,16 +407,100 @@ class CreateOrderView(generics.CreateAPIView):
 class ListOrderView(generics.ListAPIView):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # ids grow with created_at and, unlike it, are unique
+    keyset_ordering = ["-id"]
 
     def get_queryset(self):
         if self.request.user.is_staff:
-            return Order.objects.all().order_by("-created_at")
+            return Order.objects.with_items().order_by("-created_at")
         else:
-            return Order.objects.filter(user=self.request.user).order_by("-created_at")
+            return (
+                Order.objects.filter(user=self.request.user)
+                .with_items()
+                .order_by("-created_at")
+            )
+
+
+class CompactOrderListView(generics.ListAPIView):
+    """Orders with the totals stored at checkout, without their items. Staff
+    see every order, or those of ``?user=``."""
+
+    serializer_class = OrderCompactSerializer
+    permission_classes = [IsAuthenticated]
+    keyset_ordering = ["-id"]
+
+    def get_queryset(self):
+        orders = Order.objects.order_by("-created_at", "-id")
+        if not self.request.user.is_staff:
+            return orders.filter(user=self.request.user)
+        if "user" in self.request.query_params:
+            return orders.filter(user_id=user_param(self.request))
+        return orders
+
+
+class OrderSummaryView(views.APIView):
+    """Lifetime order figures of the user, or for staff of ``?user=``."""
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        user_id = request.user.pk
+        if request.user.is_staff and "user" in request.query_params:
+            user_id = user_param(request)
+        summary = OrderSummary.objects.filter(user_id=user_id).first()
+        if summary is None:
+            summary = OrderSummary(user_id=user_id)
+        return Response(OrderSummarySerializer(summary).data)
+
+
+def user_param(request):
+    try:
+        return int(request.query_params["user"])
+    except ValueError:
+        raise ValidationError({"user": "Must be a user id."})
+
+
+class OrderExportView(views.APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        params = request.query_params
+        format = params.get("file_format", "ndjson")
+        if format not in ("ndjson", "csv"):
+            return Response(
+                {"error": "Format must be ndjson or csv"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        statuses = [value for value in params.get("status", "").split(",") if value]
+        choices = dict(Order._meta.get_field("status").choices)
+        if any(value not in choices for value in statuses):
+            return Response(
+                {"error": f"Status must be one of {', '.join(choices)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            created_after = params.get("created_after")
+            created_before = params.get("created_before")
+            exporter = OrderExporter(
+                created_after=created_after and parse_moment(created_after),
+                created_before=created_before
+                and parse_moment(created_before, end_of_day=True),
+                statuses=statuses,
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(
+            exporter.stream(format),
+            content_type="text/csv" if format == "csv" else "application/x-ndjson",
+        )
+        response["Content-Disposition"] = f'attachment; filename="orders.{format}"'
+        return response
 
 
 class OrderRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Order.objects.all()
+    queryset = Order.objects.with_items().select_related("user")
     serializer_class = OrderSerializer
     permission_classes = [IsAdminOrOrderOwner]
 
@@ -281,25 +518,18 @@ class ReviewCreateView(generics.CreateAPIView):
         if rating is None or not (1 <= int(rating) <= 5):
             raise ValidationError("Rating must be between 1 to 5.")
 
-        try:
-            product = (
-                OrderItem.objects.filter(
-                    order__user=user, order__status="Delivered", product_id=product_id
-                )
-                .first()
-                .product
-            )
-
-        except OrderItem.DoesNotExist:
+        if not PurchaseHistory.delivered(user, product_id):
             raise ValidationError(
                 "You can only review products that have been delivered."
             )
 
-        if Review.objects.filter(user=user, product=product).exists():
+        # the unique constraint settles concurrent duplicates
+        try:
+            with transaction.atomic():
+                serializer.save(user=user, product_id=product_id)
+        except IntegrityError:
             raise ValidationError("You have already reviewed this product.")
 
-        serializer.save(user=user, product=product)
-
 
 class WalletDetailView(views.APIView):
     permission_classes = [IsAuthenticated]
@@ -307,7 +537,8 @@ class WalletDetailView(views.APIView):
     def get(self, request):
         wallet = Wallet.objects.get(user=request.user)
         serializer = WalletSerializer(wallet)
-        return JsonResponse(serializer.data, status=200)
+        # DjangoJSONEncoder would write the Decimal as a string
+        return JsonResponse(serializer.data, status=200, encoder=JSONEncoder)
 
 
 class ReferralView(views.APIView):
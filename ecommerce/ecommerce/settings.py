@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 from pathlib import Path
 from datetime import timedelta
 import os
+from urllib.parse import urlsplit
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -40,6 +41,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "rest_framework_simplejwt.token_blacklist",
     "django_filters",
@@ -53,6 +55,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "api.replicas.ReplicaRoutingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -89,8 +92,53 @@ DATABASES = {
         "PASSWORD": "0000",
         "HOST": "localhost",
         "PORT": "",
+        # Keep connections open between requests, checking them before reuse
+        # so a restarted server is not seen as a failed request. Under ASGI
+        # requests do not stay on one thread, so connections are closed after
+        # each one and pooling is left to PgBouncer in front of PostgreSQL.
+        "CONN_MAX_AGE": int(os.environ.get("DATABASE_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
+if os.environ.get("ASYNC_API_VIEWS") == "1":
+    DATABASES["default"]["CONN_MAX_AGE"] = 0
+
+# Read replicas of the default database, as "host[:port][/name]" separated by
+# commas, e.g. DATABASE_REPLICAS="replica1.internal,localhost/ecommerce_replica".
+# Safe-method reads of the catalog, reviews, carts and order history go to
+# them; see api/replicas.py.
+DATABASE_REPLICAS = []
+for number, replica in enumerate(
+    filter(None, os.environ.get("DATABASE_REPLICAS", "").split(",")), start=1
+):
+    location = urlsplit(f"//{replica.strip()}")
+    DATABASES[f"replica{number}"] = {
+        **DATABASES["default"],
+        "HOST": location.hostname or DATABASES["default"]["HOST"],
+        "PORT": location.port or DATABASES["default"]["PORT"],
+        "NAME": location.path.strip("/") or DATABASES["default"]["NAME"],
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(f"replica{number}")
+DATABASE_ROUTERS = ["api.replicas.ReplicaRouter"]
+
+# Replicas are health-checked every health_interval seconds and skipped when
+# more than max_lag seconds behind; users read from the primary for
+# pin_seconds after each write. Pins are kept in the default cache, which
+# must be shared by all processes once there is more than one.
+REPLICA_ROUTING = {"health_interval": 10, "max_lag": 5, "pin_seconds": 5}
+
+
+# Caches. Without REDIS_URL each process has its own in-memory cache, which
+# is only right for a single process: the cart store, replica pins and
+# DjangoCacheBackend catalog entries must be shared by every process.
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ["REDIS_URL"],
+        }
+    }
 
 
 # Password validation
@@ -144,13 +192,86 @@ REST_FRAMEWORK = {
         "django_filters.rest_framework.DjangoFilterBackend",
         "rest_framework.filters.SearchFilter",
     ],
-    "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
+    "DEFAULT_PAGINATION_CLASS": "api.pagination.ListPagination",
     "PAGE_SIZE": 10,
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "api.authentication.ClaimsJWTAuthentication",
     ],
 }
 
+# Response cache of the public catalog endpoints. LocalLRUCache lives in each
+# worker process and is only invalidated by writes made through that process,
+# so multi-process deployments should use DjangoCacheBackend on a shared cache.
+CATALOG_CACHE = {
+    "BACKEND": "api.cache.LocalLRUCache",
+    "OPTIONS": {
+        "timeout": 60,
+        "max_entries": 1024,
+        "max_bytes": 64 * 1024 * 1024,
+    },
+}
+
+# How long stock stays reserved for a cart item before the sweeper
+# (manage.py release_expired_holds) may hand it to other shoppers.
+INVENTORY_HOLD_TTL = timedelta(minutes=15)
+
+# Product search engine; defaults to PostgreSQL full-text search and to the
+# in-process inverted index (api.search.InvertedIndexBackend) elsewhere.
+PRODUCT_SEARCH_BACKEND = None
+
+# Serve the async views of api/async_views.py; ecommerce/asgi.py turns this
+# on, so it applies when the project runs under an ASGI server.
+ASYNC_API_VIEWS = os.environ.get("ASYNC_API_VIEWS") == "1"
+
+# Outgoing mail is queued in the outbox table and delivered by
+# "manage.py drain_outbox"; api.mail.LocMemBackend stands in for SendGrid
+# in tests and local development.
+OUTBOX_MAIL_BACKEND = "api.mail.SendGridBackend"
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_RETRY_DELAY = timedelta(seconds=30)
+
+# New passwords are hashed with the first hasher; the others only verify
+# existing hashes, which are rehashed with the first one at the next login.
+# Move api.passwords.Argon2PasswordHasher first to hash with argon2id.
+PASSWORD_HASHERS = [
+    "api.passwords.ScryptPasswordHasher",
+    "api.passwords.Argon2PasswordHasher",
+    "api.passwords.PBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+]
+# Changing a cost rehashes each password at its owner's next login.
+PASSWORD_HASH_COST = {
+    "scrypt": {"work_factor": 2**14, "block_size": 8, "parallelism": 1},
+    "argon2": {"time_cost": 2, "memory_cost": 102400, "parallelism": 8},
+    "pbkdf2_sha256": {"iterations": 720000},
+}
+# Hashing runs on at most "workers" threads per process with "queue" more
+# waiting; logins beyond that are answered 503 with Retry-After.
+PASSWORD_HASH_POOL = {"workers": 2, "queue": 32}
+AUTHENTICATION_BACKENDS = ["api.passwords.PooledModelBackend"]
+
+# Product images get WebP and JPEG copies at most "widths" pixels wide,
+# rendered on "workers" threads per process (inline with 0) after each
+# upload, "batch_size" products per task; past "queue_size" waiting tasks
+# uploads are left to "manage.py render_image_variants", which also renders
+# those of existing products. Their names hash the original, so they can be
+# cached forever.
+IMAGE_VARIANTS = {
+    "widths": {"thumbnail": 160, "small": 320, "medium": 640, "large": 1280},
+    "formats": ["webp", "jpeg"],
+    "quality": 80,
+    "workers": 2,
+    "batch_size": 100,
+    "queue_size": 100,
+}
+
+# Users read by api.authentication.ClaimsJWTAuthentication are kept for
+# "timeout" seconds in each process. Entries are keyed on a version of the
+# user in the default cache, bumped on save or delete, so processes sharing
+# that cache (Redis with REDIS_URL) drop them together. With the per-process
+# default cache, other processes may serve a saved user for "timeout" seconds.
+AUTH_USER_CACHE = {"timeout": 30, "max_entries": 10000}
+
 
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=15),
@@ -172,4 +293,14 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_REFRESH_EXP_CLAIM": "refresh_exp",
     "SLIDING_TOKEN_LIFETIME": timedelta(minutes=15),
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
+    "TOKEN_REFRESH_SERIALIZER": "api.blacklist.RefreshSerializer",
+    "TOKEN_VERIFY_SERIALIZER": "api.blacklist.VerifySerializer",
 }
+
+# Bloom filter of blacklisted refresh tokens kept by each process, see
+# api.blacklist.RevokedTokens; "manage.py prune_tokens" drops expired tokens.
+TOKEN_BLACKLIST = {"capacity": 100_000, "error_rate": 0.001, "sync_interval": 5}
+
+# Cart store of api/carts.py in this cache: users' carts are cached for
+# timeout seconds, guest carts only live there, for guest_timeout seconds.
+CART_CACHE = {"alias": "default", "timeout": 900, "guest_timeout": 7 * 24 * 3600}